@@ -1,26 +1,56 @@
-from flask import Flask, send_from_directory, request
-import os
+from flask import Flask, request
 from flask_cors import CORS
 from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from database.models import db
+from database.token_cache import token_cache
+from app.cache import response_cache
+from app.features import feature_store
+from app.jobs import job_queue
+from app.library import library_sync
+from app.metrics import metrics
+from app.snapshots import snapshot_writer
+from app.static_files import static_files
+from app.tokens import token_refresh_scheduler
+from app.upstream import upstream
 from config.config import config
 from datetime import timedelta
 
-# Initialise limiter at module level so blueprints can import it
+# Registers the sqlite:// and batched+ limiter storages
+from app import ratelimit  # noqa: F401
+
+# Initialise limiter at module level so blueprints can import it.
+# Storage comes from RATELIMIT_STORAGE_URI (see app/ratelimit.py).
 limiter = Limiter(
     key_func=get_remote_address,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://",
 )
 
 
+@limiter.request_filter
+def _not_rate_limited():
+    """Only the API and auth routes are limited; the frontend's static files never touch the store."""
+    return not (request.path.startswith('/api/') or request.path.startswith('/auth/'))
+
+
 def create_app(config_name='default'):
     """Factory pattern to create Flask app"""
     app = Flask(__name__)
     app.config.from_object(config[config_name])
 
+    if not app.config.get('SECRET_KEY'):
+        if app.config.get('REQUIRE_SECRET_KEY'):
+            raise RuntimeError(
+                "SECRET_KEY must be set in production. "
+                "Add SECRET_KEY to your environment variables or .env file."
+            )
+        if app.config.get('INSECURE_SECRET_KEY'):
+            app.config['SECRET_KEY'] = app.config['INSECURE_SECRET_KEY']
+            app.logger.warning(
+                "SECRET_KEY not set — using insecure dev default. Set SECRET_KEY in .env for production."
+            )
+
     # Apply ProxyFix to handle Render's forwarded headers
     app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
     
@@ -32,7 +62,17 @@ def create_app(config_name='default'):
     
     # Initialize extensions
     db.init_app(app)
+    metrics.init_app(app)
     limiter.init_app(app)
+    response_cache.init_app(app)
+    feature_store.init_app(app)
+    snapshot_writer.init_app(app)
+    library_sync.init_app(app)
+    job_queue.init_app(app)
+    token_cache.init_app(app)
+    token_refresh_scheduler.init_app(app)
+    upstream.init_app(app)
+    static_files.init_app(app)
     
     # Configure CORS to allow credentials
     cors_origins = [origin.strip() for origin in app.config.get('CORS_ORIGINS', '').split(',') if origin.strip()]
@@ -41,13 +81,20 @@ def create_app(config_name='default'):
     # Register blueprints
     from app.auth import auth_bp
     from app.api import api_bp
+    from app.insights import insights_bp
     
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(api_bp, url_prefix='/api')
+    app.register_blueprint(insights_bp, url_prefix='/api/insights')
+
+    # Register CLI maintenance commands
+    from app.commands import register_commands
+    register_commands(app)
     
-    # Create database tables
-    with app.app_context():
-        db.create_all()
+    # Create database tables (otherwise done once per deploy by `flask migrate`)
+    if app.config.get('AUTO_CREATE_TABLES', True):
+        with app.app_context():
+            db.create_all()
     
     # Add after_request handler for CORS headers and Cache-Control
     @app.after_request
@@ -56,12 +103,12 @@ def create_app(config_name='default'):
         response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
         response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
         
-        # Critical: Tell caches that this response varies based on the Cookie header
-        response.headers.add('Vary', 'Cookie')
-        
         # Disable caching for auth and API endpoints to prevent session leakage
         try:
             if request.path.startswith('/auth/') or request.path.startswith('/api/'):
+                # Critical: Tell caches that these responses vary based on the Cookie header
+                # (static files don't, so they stay cacheable; see app/static_files.py)
+                response.vary.add('Cookie')
                 response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
                 response.headers['Pragma'] = 'no-cache'
                 response.headers['Expires'] = '0'
@@ -74,9 +121,7 @@ def create_app(config_name='default'):
     @app.route('/', defaults={'path': ''})
     @app.route('/<path:path>')
     def serve(path):
-        if path != "" and os.path.exists(app.static_folder + '/' + path):
-            return app.send_static_file(path)
-        return app.send_static_file('index.html')
+        return static_files.serve(path)
 
     return app
 
@@ -0,0 +1,218 @@
+"""
+Listening-habit analytics over locally stored history.
+
+A user's plays (and the tracks/artists in their latest top-item snapshots) are
+loaded into columnar NumPy arrays once per request, and every statistic is a
+handful of vectorised operations (`bincount`, `unique`, fancy indexing) over
+those arrays rather than a Python loop per play. Track metadata is looked up
+once per distinct track and broadcast back to the plays with the inverse index
+from `np.unique`; only pulling the album fields out of each track's JSON is
+done in Python, the release years and album dedup are array operations.
+
+Nothing here calls Spotify: the inputs come from the `plays` table
+(see `app.history`) and `user_stats` snapshots.
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from database.compaction import rehydrate
+from database.models import db, Play, SpotifyItem, UserStats
+
+WEEKDAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+EPOCH_WEEKDAY = 3  # 1970-01-01 was a Thursday
+
+
+class TrackFrame:
+    """Column arrays for a sequence of track occurrences (plays or ranked top tracks).
+
+    `weights` is 1 per play, or the rank weight for top tracks. Metadata columns
+    (`album_ids`, `release_years`) are aligned with `track_ids`. Pass `tracks`
+    (track id -> track object) when the metadata is already at hand to skip the
+    `spotify_items` lookup.
+    """
+
+    def __init__(self, track_ids, weights, played_at=None, tracks=None):
+        self.track_ids = np.asarray(track_ids, dtype=object)
+        self.weights = np.asarray(weights, dtype=np.int64)
+        self.played_at = played_at
+        self.albums = {}  # album id -> {'id', 'name', 'images'}
+        self._load_metadata(tracks)
+
+    def __len__(self):
+        return len(self.track_ids)
+
+    def _load_metadata(self, tracks=None):
+        unique_ids, inverse = np.unique(self.track_ids.astype(str), return_inverse=True)
+        if tracks is None and len(unique_ids):
+            tracks = {
+                row.id: row.data
+                for row in SpotifyItem.query.filter(
+                    SpotifyItem.item_type == 'tracks', SpotifyItem.id.in_(unique_ids.tolist())
+                )
+            }
+        tracks = tracks or {}
+
+        # One entry per distinct track, then broadcast to every occurrence
+        albums = [(tracks.get(track_id) or {}).get('album') or {} for track_id in unique_ids.tolist()]
+        album_ids = np.array([album.get('id') or '' for album in albums], dtype=object)
+        releases = np.array([(album.get('release_date') or '')[:4] for album in albums], dtype='U4')
+        known = np.char.isdigit(releases)
+        years = np.zeros(len(unique_ids), dtype=np.int64)
+        years[known] = releases[known].astype(np.int64)
+
+        # Album metadata once per distinct album, from its first track
+        distinct, first = np.unique(album_ids.astype(str), return_index=True)
+        for album_id, i in zip(distinct.tolist(), first.tolist()):
+            if album_id:
+                album = albums[i]
+                self.albums[album_id] = {'id': album_id, 'name': album.get('name'), 'images': album.get('images', [])}
+
+        self.album_ids = album_ids[inverse]
+        self.release_years = years[inverse]
+
+
+def load_plays(user_id, days=None):
+    """Load a user's stored plays, optionally only the last `days` days."""
+    query = db.session.query(Play.played_at, Play.track_id).filter(Play.user_id == user_id)
+    if days:
+        query = query.filter(Play.played_at >= datetime.utcnow() - timedelta(days=days))
+    rows = query.all()
+
+    played_at = np.array([row.played_at for row in rows], dtype='datetime64[s]')
+    return TrackFrame(
+        [row.track_id for row in rows],
+        np.ones(len(rows), dtype=np.int64),
+        played_at=played_at,
+    )
+
+
+def latest_snapshot(user_id, data_type, time_range):
+    """Rehydrated payload of the newest snapshot for (user, data_type, time_range), or None."""
+    snapshot = (
+        UserStats.query
+        .filter_by(user_id=user_id, data_type=data_type, time_range=time_range)
+        .order_by(UserStats.created_at.desc())
+        .first()
+    )
+    if snapshot is None:
+        return None
+    return rehydrate([snapshot])[snapshot.id]
+
+
+def load_top_tracks(user_id, time_range):
+    """Load the latest top-tracks snapshot, weighted by rank like the genre distribution."""
+    payload = latest_snapshot(user_id, 'tracks', time_range) or {}
+    track_ids = [item.get('id') for item in payload.get('items', []) if item and item.get('id')]
+    # higher-ranked tracks contribute more
+    return TrackFrame(track_ids, np.arange(len(track_ids), 0, -1))
+
+
+def _local_times(played_at, tz_offset):
+    return played_at + np.timedelta64(int(tz_offset), 'm')
+
+
+def hour_histogram(frame, tz_offset=0):
+    """Plays per hour of day (0-23) in the user's time zone (`tz_offset` minutes east of UTC)."""
+    local = _local_times(frame.played_at, tz_offset)
+    hours = (local.astype('datetime64[h]') - local.astype('datetime64[D]')).astype(np.int64)
+    return np.bincount(hours, weights=frame.weights, minlength=24).astype(np.int64)
+
+
+def weekday_histogram(frame, tz_offset=0):
+    """Plays per day of week, Monday first."""
+    days = _local_times(frame.played_at, tz_offset).astype('datetime64[D]').astype(np.int64)
+    return np.bincount((days + EPOCH_WEEKDAY) % 7, weights=frame.weights, minlength=7).astype(np.int64)
+
+
+def decade_histogram(frame):
+    """Weighted counts per release decade. Returns (decades, counts) sorted by decade."""
+    known = frame.release_years > 0
+    decades = frame.release_years[known] // 10 * 10
+    if not len(decades):
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    unique, inverse = np.unique(decades, return_inverse=True)
+    return unique, np.bincount(inverse, weights=frame.weights[known]).astype(np.int64)
+
+
+def top_albums(frame, limit):
+    """Albums ranked by weighted occurrences. Returns [(album_id, count), ...]."""
+    known = frame.album_ids != ''
+    if not known.any():
+        return []
+    unique, inverse = np.unique(frame.album_ids[known].astype(str), return_inverse=True)
+    counts = np.bincount(inverse, weights=frame.weights[known]).astype(np.int64)
+    # stable sort keeps ties in album id order
+    order = np.argsort(-counts, kind='stable')[:limit]
+    return [(str(unique[i]), int(counts[i])) for i in order]
+
+
+def compute_genre_distribution(artists, limit):
+    """Count genre occurrences across an artists payload, weighted by artist ranking."""
+    items = artists.get('items', [])
+    genre_counts = Counter()
+    for i, artist in enumerate(items):
+        # higher-ranked artists contribute more
+        genre_counts.update(dict.fromkeys(artist.get('genres', []), limit - i))
+
+    return {
+        "genres": [{"name": name, "count": count} for name, count in genre_counts.most_common()],
+        "total_artists_sampled": len(items)
+    }
+
+
+def genre_diversity(artists):
+    """Diversity of the genres across a ranked top-artists payload.
+
+    Returns the number of unique genres plus Shannon entropy, evenness
+    (entropy normalised to 0-1) and the Simpson index over rank-weighted counts.
+    """
+    items = artists.get('items', [])
+    n = len(items)
+    genres = [artist.get('genres', []) for artist in items]
+    lengths = np.fromiter((len(g) for g in genres), dtype=np.int64, count=n)
+    flat = np.array([genre for g in genres for genre in g], dtype=object)
+
+    if not len(flat):
+        return {'unique_genres': 0, 'shannon_entropy': 0.0, 'evenness': 0.0,
+                'simpson_index': 0.0, 'total_artists_sampled': n}
+
+    # Each genre inherits its artist's rank weight (higher-ranked artists count more)
+    weights = np.repeat(np.arange(n, 0, -1), lengths)
+    _, inverse = np.unique(flat.astype(str), return_inverse=True)
+    counts = np.bincount(inverse, weights=weights)
+    p = counts / counts.sum()
+    entropy = float(-(p * np.log(p)).sum())
+    unique_genres = len(counts)
+
+    return {
+        'unique_genres': unique_genres,
+        'shannon_entropy': round(entropy, 4),
+        'evenness': round(entropy / np.log(unique_genres), 4) if unique_genres > 1 else 0.0,
+        'simpson_index': round(float(1 - (p ** 2).sum()), 4),
+        'total_artists_sampled': n,
+    }
+
+
+PROFILE_FEATURES = ('danceability', 'energy', 'valence', 'acousticness', 'instrumentalness',
+                    'speechiness', 'liveness', 'loudness', 'tempo')
+
+
+def audio_profile(features):
+    """Mean and spread of each audio feature over a list of feature dicts (None = unavailable)."""
+    available = [f for f in features if f]
+    if not available:
+        return {'averages': None, 'spread': None, 'tracks_sampled': 0,
+                'tracks_without_features': len(features)}
+
+    matrix = np.array([[f.get(name) if f.get(name) is not None else np.nan for name in PROFILE_FEATURES]
+                       for f in available], dtype=np.float64)
+    means = np.nanmean(matrix, axis=0)
+    spread = np.nanstd(matrix, axis=0)
+    return {
+        'averages': {name: round(float(v), 4) for name, v in zip(PROFILE_FEATURES, means)},
+        'spread': {name: round(float(v), 4) for name, v in zip(PROFILE_FEATURES, spread)},
+        'tracks_sampled': len(available),
+        'tracks_without_features': len(features) - len(available),
+    }
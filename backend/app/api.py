@@ -1,44 +1,203 @@
-from flask import Blueprint, jsonify, request, session, current_app
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
+import base64
+import json
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from flask import Blueprint, Response, jsonify, request, session, current_app, stream_with_context
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import load_only
 from datetime import datetime, timedelta
-from database.models import db, User, UserStats
+from database.models import db, Job, Play, User, UserStats, UserStatsRollup
+from database.compaction import rehydrate
+from database.token_cache import token_cache
+from app.analytics import audio_profile, compute_genre_distribution, latest_snapshot
+from app.cache import response_cache
+from app.compare import add_friend, can_compare, compare, list_friends, remove_friend, similar_users, visible_to
+from app.features import feature_store
+from app.materialized import load_summary
+from app.history import ingest_due, ingest_recent_plays, load_recent_plays
+from app.jobs import PRIORITY_NORMAL, job_queue
+from app.metrics import CACHE_LOOKUPS, TOKEN_DECRYPT
+from app.library import load_playlist_tracks, load_playlists, load_saved_tracks, sync_states
+from app.snapshots import snapshot_writer
+from app.spotify import make_client
+from app.upstream import UpstreamThrottled, upstream
+from app.tokens import REFRESH_MARGIN, refresh_user_token, token_refresh_scheduler
 
 api_bp = Blueprint('api', __name__)
 
-def get_spotify_client(user_id):
+TIME_RANGES = ('short_term', 'medium_term', 'long_term')
+MAX_TOP_LIMIT = 50  # Spotify's maximum page size for top items
+MAX_FEATURE_IDS = 500  # track ids accepted by /audio-profile/tracks
+THROTTLED_MESSAGE = "Spotify is rate limiting requests, please retry shortly"
+
+# Bounded pool shared by all /dashboard requests, created on first use
+_dashboard_executor = None
+_dashboard_executor_lock = threading.Lock()
+
+def get_spotify_client(user_id, active=True):
     """Helper to get an authenticated Spotify client for a user.
-    Auto-refreshes the token if it has expired."""
+    Tokens of `active` users (making requests, as opposed to background jobs)
+    are kept fresh by the background refresh scheduler; an expired token is
+    refreshed inline as a fallback."""
+    if active:
+        token_refresh_scheduler.touch(user_id)
+
+    # Fast path: a decrypted token cached in this process, no DB round trip
+    access_token = token_cache.get_valid(user_id, REFRESH_MARGIN)
+    if access_token:
+        CACHE_LOOKUPS.labels('token', 'hit').inc()
+        return make_client(access_token)
+    CACHE_LOOKUPS.labels('token', 'miss').inc()
+
     user = User.query.get(user_id)
-    if not user or not user.access_token:
+    if not user:
+        return None
+    with TOKEN_DECRYPT.time():
+        access_token = user.access_token
+    if not access_token:
         return None
 
     # Check if token is expired (or will expire in the next 60 seconds)
-    if not user.token_expiration or user.token_expiration < datetime.now() + timedelta(seconds=60):
+    if not user.token_expiration or user.token_expiration < datetime.now() + REFRESH_MARGIN:
         if not user.refresh_token:
             current_app.logger.warning("Token expired and no refresh token available for user %s", user_id)
             return None
 
         try:
-            sp_oauth = SpotifyOAuth(
-                client_id=current_app.config["SPOTIFY_CLIENT_ID"],
-                client_secret=current_app.config["SPOTIFY_CLIENT_SECRET"],
-                redirect_uri=current_app.config["SPOTIFY_REDIRECT_URI"],
-            )
-            token_info = sp_oauth.refresh_access_token(user.refresh_token)
-
-            user.access_token = token_info["access_token"]
-            if token_info.get("refresh_token"):
-                user.refresh_token = token_info["refresh_token"]
-            user.token_expiration = datetime.now() + timedelta(seconds=token_info["expires_in"])
-            db.session.commit()
-
-            current_app.logger.info("Auto-refreshed token for user %s", user_id)
+            user = refresh_user_token(user_id)
         except Exception:
             current_app.logger.exception("Failed to auto-refresh token for user %s", user_id)
             return None
+        if user is None:
+            return None
+
+    return make_client(user.access_token)
+
+
+def throttled_response(exc):
+    """503 telling the client when Spotify will accept requests again."""
+    response = jsonify({"error": THROTTLED_MESSAGE})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(exc.retry_after)
+    return response
+
+
+def fetch_top_items(sp, user_id, item_type, time_range, limit):
+    """Fetch top artists/tracks from Spotify, snapshot them and cache the response."""
+    if item_type == 'artists':
+        fetch = lambda: sp.current_user_top_artists(limit=limit, time_range=time_range)
+    else:  # tracks
+        fetch = lambda: sp.current_user_top_tracks(limit=limit, time_range=time_range)
+    items = upstream.call(
+        response_cache.make_key(user_id, f'top:{item_type}', time_range, limit), fetch
+    )
+
+    # Snapshot in the database (skipped if unchanged or snapshotted recently)
+    snapshot_writer.record(user_id, item_type, time_range, items)
+
+    response_cache.set(user_id, f'top:{item_type}', items, time_range=time_range, limit=limit)
+    return items
+
+
+def get_cached_top_items(user_id, item_type, time_range, limit):
+    """Return cached top artists/tracks, slicing a cached full page if that's all we have."""
+    endpoint = f'top:{item_type}'
+    items = response_cache.get(user_id, endpoint, time_range=time_range, limit=limit)
+    if items is None and limit < MAX_TOP_LIMIT:
+        items = response_cache.get(user_id, endpoint, time_range=time_range, limit=MAX_TOP_LIMIT)
+        if items is not None:
+            items['items'] = items.get('items', [])[:limit]
+            items['limit'] = limit
+    return items
+
+
+def _latest_top_artists(user_id, time_range, limit):
+    """Find a top-artists payload without calling Spotify: the cache first, then
+    a snapshot young enough to still count as fresh. Returns None if neither exists."""
+    artists = get_cached_top_items(user_id, 'artists', time_range, limit)
+    if artists is not None:
+        return artists
+
+    max_age = timedelta(seconds=response_cache.ttls.get('top:artists', 3600))
+    snapshot = (
+        UserStats.query
+        .filter_by(user_id=user_id, data_type='artists', time_range=time_range)
+        .filter(UserStats.created_at >= datetime.utcnow() - max_age)
+        .order_by(UserStats.created_at.desc())
+        .first()
+    )
+    if snapshot is None:
+        return None
+
+    payload = rehydrate([snapshot])[snapshot.id]
+    items = payload.get('items', [])
+    if len(items) < limit and len(items) < (payload.get('total') or 0):
+        return None  # snapshot was taken with a smaller limit
+    return {**payload, 'items': items[:limit]}
+
+
+def aggregate_top_genres(user_id, time_range, limit, artists=None):
+    """Derive top genres from top-artist payloads that have already been fetched.
+
+    Every time range whose artists are available locally is computed and cached
+    in the same pass, but only `time_range` is stored as a `genres` snapshot, so a
+    request writes at most one. Returns the distribution for `time_range`, or
+    None if its artists have not been fetched yet.
+    """
+    sources = {
+        tr: _latest_top_artists(user_id, tr, limit)
+        for tr in TIME_RANGES
+        if tr != time_range and response_cache.get(user_id, 'top-genres', time_range=tr, limit=limit) is None
+    }
+    sources[time_range] = artists if artists is not None else _latest_top_artists(user_id, time_range, limit)
+    if sources[time_range] is None:
+        return None
+
+    distributions = {}
+    for tr, payload in sources.items():
+        if payload is None:
+            continue
+        distributions[tr] = compute_genre_distribution(payload, limit)
+        if tr == time_range:
+            snapshot_writer.record(user_id, 'genres', tr, distributions[tr])
+        response_cache.set(user_id, 'top-genres', distributions[tr], time_range=tr, limit=limit)
 
-    return spotipy.Spotify(auth=user.access_token)
+    return distributions[time_range]
+
+
+def fetch_top_genres(sp, user_id, time_range, limit):
+    """Derive top genres, fetching the user's top artists from Spotify only if they
+    are not already available locally."""
+    genres = aggregate_top_genres(user_id, time_range, limit)
+    if genres is None:
+        artists = fetch_top_items(sp, user_id, 'artists', time_range, limit)
+        genres = aggregate_top_genres(user_id, time_range, limit, artists=artists)
+    return genres
+
+
+def fetch_profile(sp, user_id):
+    """Fetch the user's Spotify profile and cache it."""
+    profile = upstream.call(response_cache.make_key(user_id, 'profile'), sp.current_user)
+    response_cache.set(user_id, 'profile', profile)
+    return profile
+
+
+def fetch_recently_played(user_id, limit, before=None, sp=None):
+    """Serve recently played from the local history, ingesting new plays first when due.
+
+    Ingestion failures are logged and the stored history is served regardless.
+    """
+    if before is None and ingest_due(user_id):
+        try:
+            sp = sp or get_spotify_client(user_id)
+            if sp:
+                ingest_recent_plays(sp, user_id)
+        except UpstreamThrottled:
+            current_app.logger.warning("Spotify throttled, serving stored plays for user %s", user_id)
+        except Exception:
+            current_app.logger.exception("Failed to ingest recently played")
+            db.session.rollback()
+    return load_recent_plays(user_id, limit, before)
 
 
 @api_bp.route('/profile')
@@ -48,14 +207,19 @@ def get_profile():
     current_app.logger.info(f"GET /profile requested by Session User ID: {user_id}")
     if not user_id:
         return jsonify({"error": "Not authenticated"}), 401
+
+    cached = response_cache.get(user_id, 'profile')
+    if cached is not None:
+        return jsonify(cached)
     
     sp = get_spotify_client(user_id)
     if not sp:
         return jsonify({"error": "Failed to create Spotify client"}), 500
     
     try:
-        profile = sp.current_user()
-        return jsonify(profile)
+        return jsonify(fetch_profile(sp, user_id))
+    except UpstreamThrottled as e:
+        return throttled_response(e)
     except Exception as e:
         current_app.logger.exception("Failed to fetch user profile")
         return jsonify({"error": "An internal error occurred"}), 500
@@ -78,29 +242,20 @@ def get_top_items(item_type):
     # Get optional parameters
     time_range = request.args.get('time_range', 'medium_term')  # short_term, medium_term, long_term
     limit = request.args.get('limit', 20, type=int)
+
+    cached = get_cached_top_items(user_id, item_type, time_range, limit)
+    if cached is not None:
+        return jsonify(cached)
     
     sp = get_spotify_client(user_id)
     if not sp:
         return jsonify({"error": "Failed to create Spotify client"}), 500
     
     try:
-        if item_type == 'artists':
-            items = sp.current_user_top_artists(limit=limit, time_range=time_range)
-        else:  # tracks
-            items = sp.current_user_top_tracks(limit=limit, time_range=time_range)
-        
-        # Store in database
-        user = User.query.get(user_id)
-        stats = UserStats(
-            user_id=user.id,
-            time_range=time_range,
-            data_type=item_type,
-            data=items
-        )
-        db.session.add(stats)
-        db.session.commit()
-        
+        items = fetch_top_items(sp, user_id, item_type, time_range, limit)
         return jsonify(items)
+    except UpstreamThrottled as e:
+        return throttled_response(e)
     except Exception as e:
         current_app.logger.exception("Failed to fetch top %s", item_type)
         return jsonify({"error": "An internal error occurred"}), 500
@@ -116,28 +271,26 @@ def get_top_genres():
     time_range = request.args.get('time_range', 'medium_term')
     limit = request.args.get('limit', 50, type=int)
 
+    cached = response_cache.get(user_id, 'top-genres', time_range=time_range, limit=limit)
+    if cached is not None:
+        return jsonify(cached)
+
+    try:
+        genres = aggregate_top_genres(user_id, time_range, limit)
+    except Exception:
+        current_app.logger.exception("Failed to aggregate top genres")
+        genres = None
+    if genres is not None:
+        return jsonify(genres)
+
     sp = get_spotify_client(user_id)
     if not sp:
         return jsonify({"error": "Failed to create Spotify client"}), 500
 
     try:
-        # Fetch top artists (up to 50) to get a good genre sample
-        artists = sp.current_user_top_artists(limit=limit, time_range=time_range)
-        
-        # Count genre occurrences, weighted by artist ranking
-        genre_counts = {}
-        for i, artist in enumerate(artists.get('items', [])):
-            weight = limit - i  # higher-ranked artists contribute more
-            for genre in artist.get('genres', []):
-                genre_counts[genre] = genre_counts.get(genre, 0) + weight
-
-        # Sort by count descending
-        sorted_genres = sorted(genre_counts.items(), key=lambda x: x[1], reverse=True)
-
-        return jsonify({
-            "genres": [{"name": name, "count": count} for name, count in sorted_genres],
-            "total_artists_sampled": len(artists.get('items', []))
-        })
+        return jsonify(fetch_top_genres(sp, user_id, time_range, limit))
+    except UpstreamThrottled as e:
+        return throttled_response(e)
     except Exception as e:
         current_app.logger.exception("Failed to fetch top genres")
         return jsonify({"error": "An internal error occurred"}), 500
@@ -150,29 +303,467 @@ def get_recently_played():
     if not user_id:
         return jsonify({"error": "Not authenticated"}), 401
     
-    limit = request.args.get('limit', 20, type=int)
-    
-    sp = get_spotify_client(user_id)
-    if not sp:
-        return jsonify({"error": "Failed to create Spotify client"}), 500
-    
+    limit = min(max(request.args.get('limit', 20, type=int), 1), MAX_TOP_LIMIT)
+    before = request.args.get('before', type=int)
+
     try:
-        items = sp.current_user_recently_played(limit=limit)
-        return jsonify(items)
+        return jsonify(fetch_recently_played(user_id, limit, before))
     except Exception as e:
         current_app.logger.exception("Failed to fetch recently played")
         return jsonify({"error": "An internal error occurred"}), 500
 
 
+@api_bp.route('/audio-profile')
+def get_audio_profile():
+    """Average audio features of the user's top tracks (source=top) or latest plays (source=recent)"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not authenticated"}), 401
+
+    source = request.args.get('source', 'top')
+    time_range = request.args.get('time_range', 'medium_term')
+    limit = min(max(request.args.get('limit', MAX_TOP_LIMIT, type=int), 1), MAX_TOP_LIMIT)
+    if source not in ('top', 'recent'):
+        return jsonify({"error": "Invalid source. Must be 'top' or 'recent'"}), 400
+
+    try:
+        if source == 'recent':
+            track_ids = [
+                track_id for (track_id,) in
+                db.session.query(Play.track_id)
+                .filter(Play.user_id == user_id)
+                .order_by(Play.played_at.desc())
+                .limit(limit)
+            ]
+        else:
+            # Top tracks from the cache or the latest snapshot before asking Spotify
+            tracks = get_cached_top_items(user_id, 'tracks', time_range, limit) \
+                or latest_snapshot(user_id, 'tracks', time_range)
+            if tracks is None:
+                sp = get_spotify_client(user_id)
+                if not sp:
+                    return jsonify({"error": "Failed to create Spotify client"}), 500
+                tracks = fetch_top_items(sp, user_id, 'tracks', time_range, limit)
+            track_ids = [item['id'] for item in tracks.get('items', [])[:limit] if item and item.get('id')]
+
+        features = feature_store.get_features(track_ids, lambda: get_spotify_client(user_id))
+        return jsonify({
+            **audio_profile([features.get(track_id) for track_id in track_ids]),
+            'source': source,
+            'time_range': time_range if source == 'top' else None,
+        })
+    except UpstreamThrottled as e:
+        return throttled_response(e)
+    except Exception as e:
+        current_app.logger.exception("Failed to build audio profile")
+        return jsonify({"error": "An internal error occurred"}), 500
+
+
+@api_bp.route('/audio-profile/tracks')
+def get_track_features():
+    """Audio features for a comma-separated list of track ids"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not authenticated"}), 401
+
+    track_ids = [track_id.strip() for track_id in request.args.get('ids', '').split(',') if track_id.strip()]
+    if not track_ids:
+        return jsonify({"error": "Missing ids"}), 400
+    if len(track_ids) > MAX_FEATURE_IDS:
+        return jsonify({"error": f"Too many ids. Maximum is {MAX_FEATURE_IDS}"}), 400
+
+    try:
+        features = feature_store.get_features(track_ids, lambda: get_spotify_client(user_id))
+        return jsonify({"audio_features": [
+            {"id": track_id, **features[track_id]} if features.get(track_id) else {"id": track_id, "unavailable": True}
+            for track_id in track_ids
+        ]})
+    except UpstreamThrottled as e:
+        return throttled_response(e)
+    except Exception as e:
+        current_app.logger.exception("Failed to fetch audio features")
+        return jsonify({"error": "An internal error occurred"}), 500
+
+
+@api_bp.route('/library/sync', methods=['GET', 'POST'])
+def library_sync_status():
+    """Queue a sync of saved tracks and playlists (POST), or report its progress (GET)"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not authenticated"}), 401
+
+    if request.method == 'GET':
+        return jsonify({"states": sync_states(user_id)})
+
+    full = request.args.get('full', 'false').lower() == 'true'
+    try:
+        job = job_queue.enqueue('sync-library', user_id, payload={'full': full}, priority=PRIORITY_NORMAL)
+    except Exception as e:
+        current_app.logger.exception("Failed to queue library sync")
+        return jsonify({"error": "An internal error occurred"}), 500
+    return jsonify({"job": job.to_dict(), "states": sync_states(user_id)}), 202
+
+
+@api_bp.route('/jobs/<int:job_id>')
+def get_job(job_id):
+    """Status (and result or error) of one of the user's background jobs"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not authenticated"}), 401
+
+    job = db.session.get(Job, job_id)
+    if job is None or job.user_id != user_id:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+
+@api_bp.route('/library/tracks')
+def get_saved_tracks():
+    """Saved tracks from the last library sync, newest first"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not authenticated"}), 401
+
+    limit = min(max(request.args.get('limit', 50, type=int), 1), STATS_MAX_PAGE_SIZE)
+    try:
+        return jsonify(load_saved_tracks(user_id, limit, request.args.get('cursor')))
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+
+
+@api_bp.route('/library/playlists')
+def get_playlists():
+    """Playlists from the last library sync, in Spotify's order"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not authenticated"}), 401
+    return jsonify(load_playlists(user_id))
+
+
+@api_bp.route('/library/playlists/<playlist_id>/tracks')
+def get_playlist_tracks(playlist_id):
+    """Tracks of a synced playlist, paged by position"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not authenticated"}), 401
+
+    limit = min(max(request.args.get('limit', 100, type=int), 1), STATS_MAX_PAGE_SIZE)
+    page = load_playlist_tracks(user_id, playlist_id, limit, request.args.get('after', type=int))
+    if page is None:
+        return jsonify({"error": "Playlist not found"}), 404
+    return jsonify(page)
+
+
+@api_bp.route('/compare/<other>')
+def compare_with(other):
+    """Shared top artists, tracks and genres with another user (by Spotify id), with similarity scores"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not authenticated"}), 401
+
+    time_range = request.args.get('time_range', 'medium_term')
+    if time_range not in TIME_RANGES:
+        return jsonify({"error": f"Invalid time_range. Must be one of: {', '.join(TIME_RANGES)}"}), 400
+
+    # Users who neither opted in nor added this user back are indistinguishable from unknown ones
+    other_id = db.session.query(User.id).filter_by(spotify_id=other).scalar()
+    if other_id is None or not can_compare(user_id, other_id):
+        return jsonify({"error": "User not found"}), 404
+    try:
+        return jsonify({"user": other, **compare(user_id, other_id, time_range)})
+    except Exception as e:
+        current_app.logger.exception("Failed to compare users")
+        return jsonify({"error": "An internal error occurred"}), 500
+
+
+@api_bp.route('/similar')
+def get_similar_users():
+    """Users whose top lists are most similar to the current user's"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not authenticated"}), 401
+
+    time_range = request.args.get('time_range', 'medium_term')
+    if time_range not in TIME_RANGES:
+        return jsonify({"error": f"Invalid time_range. Must be one of: {', '.join(TIME_RANGES)}"}), 400
+    limit = min(max(request.args.get('limit', 20, type=int), 1), MAX_TOP_LIMIT)
+
+    result = response_cache.get(user_id, 'similar', time_range=time_range, limit=limit)
+    if result is None:
+        try:
+            result = {'time_range': time_range, 'users': similar_users(user_id, time_range, limit)}
+        except Exception as e:
+            current_app.logger.exception("Failed to find similar users")
+            return jsonify({"error": "An internal error occurred"}), 500
+        response_cache.set(user_id, 'similar', result, time_range=time_range, limit=limit)
+    else:
+        # Drop anyone who opted out or unfriended since the result was cached
+        spotify_ids = [entry['spotify_id'] for entry in result['users']]
+        visible = {
+            spotify_id for (spotify_id,) in db.session.query(User.spotify_id).filter(
+                User.spotify_id.in_(spotify_ids), User.id.in_(visible_to(user_id)))
+        } if spotify_ids else set()
+        result = {**result, 'users': [entry for entry in result['users'] if entry['spotify_id'] in visible]}
+    return jsonify(result)
+
+
+@api_bp.route('/sharing', methods=['GET', 'PUT'])
+def sharing():
+    """Whether other users may find and compare with this user without being friends"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not authenticated"}), 401
+
+    user = db.session.get(User, user_id)
+    if user is None:
+        return jsonify({"error": "User not found"}), 404
+    if request.method == 'PUT':
+        discoverable = (request.get_json(silent=True) or {}).get('discoverable')
+        if not isinstance(discoverable, bool):
+            return jsonify({"error": "discoverable must be true or false"}), 400
+        user.discoverable = discoverable
+        db.session.commit()
+    return jsonify({"discoverable": bool(user.discoverable)})
+
+
+@api_bp.route('/friends')
+def get_friends():
+    """Friends (added both ways), pending (added by this user) and requests (added this user)"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not authenticated"}), 401
+    return jsonify(list_friends(user_id))
+
+
+@api_bp.route('/friends/<other>', methods=['PUT', 'DELETE'])
+def update_friend(other):
+    """Add (PUT) or remove (DELETE) another user, by Spotify id, as a friend"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not authenticated"}), 401
+
+    other_id = db.session.query(User.id).filter_by(spotify_id=other).scalar()
+    if other_id is None or other_id == user_id:
+        return jsonify({"error": "User not found"}), 404
+    if request.method == 'PUT':
+        add_friend(user_id, other_id)
+    else:
+        remove_friend(user_id, other_id)
+    db.session.commit()
+    return jsonify(list_friends(user_id))
+
+
+def _get_dashboard_executor(max_workers):
+    global _dashboard_executor
+    with _dashboard_executor_lock:
+        if _dashboard_executor is None:
+            _dashboard_executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix='dashboard'
+            )
+        return _dashboard_executor
+
+
+@api_bp.route('/dashboard')
+def get_dashboard():
+    """Get everything the dashboard needs in one response.
+
+    Cached sections are served directly; the rest are fetched from Spotify
+    concurrently with a single client. A cache or local read that fails is
+    treated as a miss. Materialized insights ride along from `user_insights`.
+    A failing section is reported under `errors` instead of failing the whole
+    response.
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not authenticated"}), 401
+
+    time_range = request.args.get('time_range', 'medium_term')
+    limit = request.args.get('limit', 20, type=int)
+    genre_limit = request.args.get('genre_limit', 50, type=int)
+
+    # When both are needed, fetch one page of artists big enough for the genre
+    # sample and slice it, so genres never cost a second upstream call.
+    artist_limit = min(max(limit, genre_limit), MAX_TOP_LIMIT)
+
+    def local_recently_played():
+        # Served from the local play history; only needs Spotify when new plays are due
+        return None if ingest_due(user_id) else fetch_recently_played(user_id, limit)
+
+    # section -> (lookup returning the cached value or None, fetcher)
+    sections = {
+        'profile': (lambda: response_cache.get(user_id, 'profile'),
+                    lambda sp: fetch_profile(sp, user_id)),
+        'top_artists': (lambda: get_cached_top_items(user_id, 'artists', time_range, limit),
+                        lambda sp: fetch_top_items(sp, user_id, 'artists', time_range, artist_limit)),
+        'top_tracks': (lambda: get_cached_top_items(user_id, 'tracks', time_range, limit),
+                       lambda sp: fetch_top_items(sp, user_id, 'tracks', time_range, limit)),
+        'recently_played': (local_recently_played,
+                            lambda sp: fetch_recently_played(user_id, limit, sp=sp)),
+    }
+
+    result = {}
+    errors = {}
+    pending = {}
+    for name, (lookup, fetcher) in sections.items():
+        try:
+            cached = lookup()
+        except Exception:
+            current_app.logger.exception("Failed to read dashboard section %s", name)
+            db.session.rollback()
+            cached = None
+        if cached is not None:
+            result[name] = cached
+        else:
+            pending[name] = fetcher
+
+    # Precomputed genres, albums, rank changes and listening habits: one indexed read
+    result['insights'] = load_summary(user_id, time_range)
+
+    result['top_genres'] = response_cache.get(user_id, 'top-genres', time_range=time_range, limit=genre_limit)
+    materialized_genres = result['insights']['top_genres']
+    if result['top_genres'] is None and materialized_genres \
+            and materialized_genres.get('total_artists_sampled') == genre_limit:
+        result['top_genres'] = materialized_genres
+    if result['top_genres'] is None and 'top_artists' not in pending:
+        try:
+            result['top_genres'] = aggregate_top_genres(user_id, time_range, genre_limit)
+        except Exception:
+            current_app.logger.exception("Failed to aggregate dashboard section top_genres")
+    genres_pending = result['top_genres'] is None
+
+    if pending or genres_pending:
+        sp = get_spotify_client(user_id)
+        if not sp:
+            return jsonify({"error": "Failed to create Spotify client"}), 500
+
+        app = current_app._get_current_object()
+
+        def run(name, fetcher):
+            with app.app_context():
+                try:
+                    return fetcher(sp)
+                except UpstreamThrottled:
+                    raise
+                except Exception:
+                    app.logger.exception("Failed to fetch dashboard section %s", name)
+                    raise
+
+        executor = _get_dashboard_executor(app.config.get('DASHBOARD_MAX_WORKERS', 8))
+        futures = {name: executor.submit(run, name, fetcher) for name, fetcher in pending.items()}
+        for name, future in futures.items():
+            try:
+                result[name] = future.result()
+            except UpstreamThrottled:
+                result[name] = None
+                errors[name] = THROTTLED_MESSAGE
+            except Exception:
+                result[name] = None
+                errors[name] = "An internal error occurred"
+
+        if result.get('top_artists') and 'top_artists' in pending:
+            result['top_artists'] = {
+                **result['top_artists'],
+                'items': result['top_artists'].get('items', [])[:limit],
+                'limit': limit,
+            }
+
+        # Genres reuse the artists page fetched above (or fetch their own if that failed)
+        if genres_pending:
+            try:
+                result['top_genres'] = fetch_top_genres(sp, user_id, time_range, genre_limit)
+            except UpstreamThrottled:
+                errors['top_genres'] = THROTTLED_MESSAGE
+            except Exception:
+                current_app.logger.exception("Failed to fetch dashboard section top_genres")
+                errors['top_genres'] = "An internal error occurred"
+
+    result['errors'] = errors
+    return jsonify(result)
+
+
+STATS_FIELDS = ('id', 'data_type', 'time_range', 'data', 'created_at')
+STATS_PAGE_SIZE = 50
+STATS_MAX_PAGE_SIZE = 200
+STATS_EXPORT_BATCH = 500
+
+
+def _encode_stats_cursor(stat):
+    raw = f"{stat.created_at.isoformat()}|{stat.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_stats_cursor(cursor):
+    """Return (created_at, id) from a cursor, or None if it is malformed."""
+    try:
+        created_at, stat_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(stat_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _stats_page(query, after, limit, with_data):
+    """Fetch one keyset page (newest first) strictly after the (created_at, id) position."""
+    if after is not None:
+        created_at, stat_id = after
+        query = query.filter(or_(
+            UserStats.created_at < created_at,
+            and_(UserStats.created_at == created_at, UserStats.id < stat_id),
+        ))
+    if not with_data:
+        query = query.options(load_only(
+            UserStats.id, UserStats.data_type, UserStats.time_range, UserStats.created_at
+        ))
+    return query.order_by(UserStats.created_at.desc(), UserStats.id.desc()).limit(limit).all()
+
+
+def _serialize_stats(stats, fields):
+    payloads = rehydrate(stats) if 'data' in fields else {}
+    result = []
+    for stat in stats:
+        row = {
+            'id': stat.id,
+            'data_type': stat.data_type,
+            'time_range': stat.time_range,
+            'created_at': stat.created_at.isoformat(),
+        }
+        if 'data' in fields:
+            row['data'] = payloads[stat.id]
+        result.append({field: row[field] for field in fields})
+    return result
+
+
 @api_bp.route('/stats')
 def get_saved_stats():
-    """Get user's saved statistics from the database"""
+    """Get user's saved statistics from the database
+
+    Query params:
+        type, time_range: optional filters
+        fields: comma-separated subset of id,data_type,time_range,data,created_at
+        limit: page size (max 200); cursor: `next_cursor` from the previous page
+        format: 'ndjson' streams every matching row instead of one page
+
+    Without `limit` or `cursor` the response is the original bare list of every
+    matching row; with either it is one page, `{"items": [...], "next_cursor": ...}`.
+    """
     user_id = session.get('user_id')
     if not user_id:
         return jsonify({"error": "Not authenticated"}), 401
     
     data_type = request.args.get('type')
     time_range = request.args.get('time_range')
+
+    fields = STATS_FIELDS
+    if request.args.get('fields'):
+        fields = tuple(f.strip() for f in request.args['fields'].split(',') if f.strip())
+        if not fields or any(f not in STATS_FIELDS for f in fields):
+            return jsonify({"error": f"Invalid fields. Allowed: {', '.join(STATS_FIELDS)}"}), 400
+    with_data = 'data' in fields
+
+    after = None
+    if request.args.get('cursor'):
+        after = _decode_stats_cursor(request.args['cursor'])
+        if after is None:
+            return jsonify({"error": "Invalid cursor"}), 400
     
     query = UserStats.query.filter_by(user_id=user_id)
     
@@ -180,17 +771,69 @@ def get_saved_stats():
         query = query.filter_by(data_type=data_type)
     if time_range:
         query = query.filter_by(time_range=time_range)
-        
-    stats = query.order_by(UserStats.created_at.desc()).all()
-    
-    result = []
-    for stat in stats:
-        result.append({
-            'id': stat.id,
-            'data_type': stat.data_type,
-            'time_range': stat.time_range,
-            'data': stat.data,
-            'created_at': stat.created_at.isoformat()
-        })
-    
-    return jsonify(result)
+
+    def rows(after):
+        # Walk the same keyset pages so memory stays flat however long the history is
+        while True:
+            stats = _stats_page(query, after, STATS_EXPORT_BATCH, with_data)
+            yield from _serialize_stats(stats, fields)
+            if len(stats) < STATS_EXPORT_BATCH:
+                return
+            after = (stats[-1].created_at, stats[-1].id)
+
+    if request.args.get('format') == 'ndjson':
+        ndjson = (json.dumps(row) + '\n' for row in rows(after))
+        return Response(stream_with_context(ndjson), mimetype='application/x-ndjson')
+
+    if 'limit' not in request.args and after is None:
+        # Existing clients expect a bare JSON list of the whole history
+        def array():
+            yield '['
+            for i, row in enumerate(rows(None)):
+                yield (',' if i else '') + json.dumps(row)
+            yield ']\n'
+
+        return Response(stream_with_context(array()), mimetype='application/json')
+
+    limit = max(1, min(request.args.get('limit', STATS_PAGE_SIZE, type=int), STATS_MAX_PAGE_SIZE))
+    stats = _stats_page(query, after, limit + 1, with_data)
+    has_more = len(stats) > limit
+    stats = stats[:limit]
+
+    return jsonify({
+        'items': _serialize_stats(stats, fields),
+        'next_cursor': _encode_stats_cursor(stats[-1]) if has_more else None,
+    })
+
+
+@api_bp.route('/stats/rollups')
+def get_stats_rollups():
+    """Daily/weekly summaries of snapshots older than raw retention, newest first
+
+    Query params:
+        period: 'day' or 'week' (default week); type, time_range: optional filters
+        limit: page size (max 200); before: only periods starting before this date
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Not authenticated"}), 401
+
+    period = request.args.get('period', 'week')
+    if period not in ('day', 'week'):
+        return jsonify({"error": "Invalid period. Must be 'day' or 'week'"}), 400
+
+    query = UserStatsRollup.query.filter_by(user_id=user_id, period=period)
+    if request.args.get('type'):
+        query = query.filter_by(data_type=request.args['type'])
+    if request.args.get('time_range'):
+        query = query.filter_by(time_range=request.args['time_range'])
+    if request.args.get('before'):
+        try:
+            before = datetime.fromisoformat(request.args['before']).date()
+        except ValueError:
+            return jsonify({"error": "Invalid before date"}), 400
+        query = query.filter(UserStatsRollup.period_start < before)
+
+    limit = max(1, min(request.args.get('limit', STATS_PAGE_SIZE, type=int), STATS_MAX_PAGE_SIZE))
+    rollups = query.order_by(UserStatsRollup.period_start.desc()).limit(limit).all()
+    return jsonify({'items': [rollup.to_dict() for rollup in rollups]})
@@ -1,28 +1,17 @@
 import os
 import secrets
-import requests
 from flask import Blueprint, request, redirect, session, jsonify, current_app, url_for
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
 from datetime import datetime, timedelta
 from database.models import db, User
 from app import limiter
+from app.cache import response_cache
+from app.jobs import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, job_queue
+from app.spotify import get_spotify_oauth, make_client
+from app.tokens import refresh_user_token
 
 auth_bp = Blueprint("auth", __name__)
 
 
-def get_spotify_oauth():
-    """Helper to create SpotifyOAuth object"""
-    return SpotifyOAuth(
-        client_id=current_app.config["SPOTIFY_CLIENT_ID"],
-        client_secret=current_app.config["SPOTIFY_CLIENT_SECRET"],
-        redirect_uri=current_app.config["SPOTIFY_REDIRECT_URI"],
-        scope="user-read-email user-read-private user-top-read user-read-recently-played",
-        show_dialog=True,
-        cache_path=None,
-    )
-
-
 @auth_bp.route("/login")
 @limiter.limit("10 per minute")
 def login():
@@ -63,13 +52,13 @@ def callback():
         return redirect("/error?message=Authorization%20failed")
 
     # Exchange authorization code for access token
-    token_info = sp_oauth.get_access_token(code)
+    token_info = sp_oauth.get_access_token(code, check_cache=False)
 
     if not token_info:
         return redirect("/error?message=Failed%20to%20get%20access%20token")
 
     # Use the access token to get user profile
-    sp = spotipy.Spotify(auth=token_info["access_token"])
+    sp = make_client(token_info["access_token"])
     user_profile = sp.current_user()
     current_app.logger.info(f"Spotify Auth Success: ID={user_profile['id']}, Name={user_profile.get('display_name')}")
 
@@ -79,11 +68,13 @@ def callback():
     # Calculate token expiration time
     expires_at = datetime.now() + timedelta(seconds=token_info["expires_in"])
 
+    is_new_user = user is None
     if user:
         # Update existing user
         user.access_token = token_info["access_token"]
         user.refresh_token = token_info.get("refresh_token", user.refresh_token)
         user.token_expiration = expires_at
+        user.token_scope = token_info.get("scope")
         user.display_name = user_profile.get("display_name")
         user.email = user_profile.get("email")
 
@@ -106,6 +97,7 @@ def callback():
             refresh_token=token_info.get("refresh_token"),
             token_expiration=expires_at,
         )
+        user.token_scope = token_info.get("scope")
         db.session.add(user)
 
     try:
@@ -115,6 +107,19 @@ def callback():
         current_app.logger.exception("Database commit failed during login")
         return redirect("/error?message=Login%20failed%20due%20to%20server%20error")
 
+    # A new login may come with a changed profile or scopes; don't serve responses cached before it
+    response_cache.invalidate(user.id)
+
+    # Queue the initial sync so the dashboard is warm by the time it loads;
+    # a first login also mirrors the whole library
+    try:
+        job_queue.enqueue('sync-top-items', user.id, priority=PRIORITY_HIGH)
+        job_queue.enqueue('ingest-recent-plays', user.id, priority=PRIORITY_NORMAL)
+        job_queue.enqueue('sync-library', user.id, payload={'full': is_new_user}, priority=PRIORITY_LOW)
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception("Failed to enqueue initial sync for user %s", user.id)
+
     # Regenerate session to prevent session fixation
     session.clear()
     session.permanent = True
@@ -149,17 +154,8 @@ def refresh_token():
     if not user or not user.refresh_token:
         return jsonify({"error": "Invalid user or missing refresh token"}), 400
 
-    sp_oauth = get_spotify_oauth()
-    token_info = sp_oauth.refresh_access_token(user.refresh_token)
-
-    # Update user's tokens
-    user.access_token = token_info["access_token"]
-    if token_info.get("refresh_token"):
-        user.refresh_token = token_info["refresh_token"]
-
-    # Calculate new expiration time
-    user.token_expiration = datetime.now() + timedelta(seconds=token_info["expires_in"])
-    db.session.commit()
+    # Explicit request: always refresh; the per-user lock still serialises it with the scheduler
+    refresh_user_token(user_id, force=True)
 
     return jsonify({"message": "Token refreshed successfully"})
 
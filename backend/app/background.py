@@ -0,0 +1,37 @@
+"""
+Daemon threads owned by the app's extensions (snapshot writer, token refresh
+scheduler, in-process job worker).
+
+Threads don't survive fork(), so a thread started in the gunicorn master (with
+`preload_app`) is gone in every worker. `BackgroundThread.ensure_running()` is
+called on each use and starts the thread again in any process that doesn't have
+it running yet.
+"""
+import os
+import threading
+
+
+class BackgroundThread:
+    """A daemon thread running `target`, started on demand once per process."""
+
+    def __init__(self, target, name):
+        self.target = target
+        self.name = name
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
+
+    def ensure_running(self):
+        """Start the thread unless it is already running in this process. Returns True if started."""
+        if self.is_running():
+            return False
+        with self._lock:
+            if self.is_running():
+                return False
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self.target, name=self.name, daemon=True)
+            self._thread.start()
+            return True
@@ -0,0 +1,214 @@
+"""
+Per-user TTL cache for Spotify API responses.
+
+Entries are keyed by (user_id, endpoint, time_range, limit) and expire after a
+per-endpoint TTL. Values are stored as JSON strings so every backend behaves the
+same and callers always get a fresh copy they are free to mutate.
+
+Backends:
+- ``memory``: in-process LRU bounded by ``CACHE_MAX_BYTES`` (default).
+- ``redis``: shared between gunicorn workers via ``CACHE_REDIS_URL``.
+- ``none``: disables caching entirely.
+
+`invalidate(user_id)` drops every entry of one user, e.g. when they log in again.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from app.metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# Seconds each endpoint's response stays fresh. Top lists change at most a few
+# times a day. Recently played is served from the local play history, so only
+# the marker that throttles polling Spotify for new plays lives here. Similar
+# users are computed locally but scan other users' postings, so they are reused briefly.
+DEFAULT_TTLS = {
+    'profile': 300,
+    'top:artists': 3600,
+    'top:tracks': 3600,
+    'top-genres': 3600,
+    'recently-played:polled': 60,
+    'similar': 600,
+}
+
+
+class MemoryBackend:
+    """In-process LRU store bounded by an approximate memory budget."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, raw)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, raw = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return raw
+
+    def set(self, key, raw, ttl):
+        size = len(raw)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, raw)
+            self._size += size
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, key):
+        _, raw = self._entries.pop(key)
+        self._size -= len(raw)
+
+
+class RedisBackend:
+    """Shared store so several workers (or hosts) reuse each other's entries."""
+
+    def __init__(self, url, prefix='statify:cache:'):
+        import redis  # only imported when this backend is configured
+
+        self.prefix = prefix
+        self.evictions = 0  # eviction is handled by Redis' own maxmemory policy
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        try:
+            raw = self._client.get(self.prefix + key)
+        except Exception:
+            logger.warning("Redis cache read failed for %s", key, exc_info=True)
+            return None
+        return raw.decode() if raw is not None else None
+
+    def set(self, key, raw, ttl):
+        try:
+            self._client.setex(self.prefix + key, int(ttl), raw)
+        except Exception:
+            logger.warning("Redis cache write failed for %s", key, exc_info=True)
+
+    def delete(self, key):
+        try:
+            self._client.delete(self.prefix + key)
+        except Exception:
+            logger.warning("Redis cache delete failed for %s", key, exc_info=True)
+
+    def delete_prefix(self, prefix):
+        try:
+            for key in self._client.scan_iter(match=self.prefix + prefix + '*'):
+                self._client.delete(key)
+        except Exception:
+            logger.warning("Redis cache delete failed for %s*", prefix, exc_info=True)
+
+    def clear(self):
+        for key in self._client.scan_iter(match=self.prefix + '*'):
+            self._client.delete(key)
+
+
+class ResponseCache:
+    """TTL cache in front of per-user Spotify calls, with hit/miss counters."""
+
+    def __init__(self):
+        self.backend = None
+        self.ttls = dict(DEFAULT_TTLS)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        backend = app.config.get('CACHE_BACKEND', 'memory')
+        max_bytes = app.config.get('CACHE_MAX_BYTES', 32 * 1024 * 1024)
+
+        if backend == 'none':
+            self.backend = None
+        elif backend == 'redis':
+            try:
+                self.backend = RedisBackend(app.config['CACHE_REDIS_URL'])
+            except Exception:
+                logger.error("Redis cache backend unavailable — falling back to in-process cache.", exc_info=True)
+                self.backend = MemoryBackend(max_bytes)
+        else:
+            self.backend = MemoryBackend(max_bytes)
+
+        self.ttls.update(app.config.get('CACHE_TTLS') or {})
+        app.extensions['response_cache'] = self
+
+    @staticmethod
+    def make_key(user_id, endpoint, time_range=None, limit=None):
+        return f"{user_id}:{endpoint}:{time_range or '-'}:{limit if limit is not None else '-'}"
+
+    def get(self, user_id, endpoint, time_range=None, limit=None):
+        """Return the cached value, or None on a miss."""
+        if self.backend is None:
+            return None
+        raw = self.backend.get(self.make_key(user_id, endpoint, time_range, limit))
+        CACHE_LOOKUPS.labels('response', 'miss' if raw is None else 'hit').inc()
+        with self._lock:
+            if raw is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(raw)
+
+    def set(self, user_id, endpoint, value, time_range=None, limit=None):
+        if self.backend is None:
+            return
+        ttl = self.ttls.get(endpoint, 60)
+        self.backend.set(self.make_key(user_id, endpoint, time_range, limit), json.dumps(value), ttl)
+
+    def delete(self, user_id, endpoint, time_range=None, limit=None):
+        if self.backend is not None:
+            self.backend.delete(self.make_key(user_id, endpoint, time_range, limit))
+
+    def invalidate(self, user_id):
+        """Drop every cached response of one user."""
+        if self.backend is not None:
+            self.backend.delete_prefix(f"{user_id}:")
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            'backend': type(self.backend).__name__ if self.backend else None,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0,
+            'evictions': getattr(self.backend, 'evictions', 0),
+        }
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,108 @@
+"""
+Maintenance commands, run with `flask --app run <command>` from backend/.
+"""
+import click
+from sqlalchemy import inspect
+
+from app import materialized
+from app.static_files import compress_build, static_files
+from database.compaction import backfill
+from database.encryption import primary_key_id
+from database.key_rotation import pending_users, reencrypt_users
+from database.retention import ensure_partitions, is_partitioned, prune, table_report
+from database.models import db, User
+
+
+def register_commands(app):
+    """Attach the maintenance CLI commands to the app"""
+
+    @app.cli.command('migrate')
+    def migrate():
+        """Create missing tables; run once per deploy when AUTO_CREATE_TABLES is off."""
+        before = set(inspect(db.engine).get_table_names())
+        db.create_all()
+        created = sorted(set(inspect(db.engine).get_table_names()) - before)
+        click.echo(f"Created tables: {', '.join(created)}." if created else "All tables exist.")
+        click.echo("Changes to existing tables are in database/migrations/*.sql.")
+
+    @app.cli.command('compact-stats')
+    @click.option('--batch-size', default=500, show_default=True, help='Rows compacted per commit.')
+    def compact_stats(batch_size):
+        """Move raw artists/tracks snapshots into compact item-id storage."""
+        total = backfill(batch_size=batch_size)
+        click.echo(f"Compacted {total} snapshots.")
+
+    @app.cli.command('rebuild-insights')
+    @click.option('--user-id', type=int, help='Only rebuild this user (default: everyone).')
+    def rebuild_insights(user_id):
+        """Recompute materialized user_insights rows and compare-index postings from stored snapshots and plays."""
+        user_ids = [user_id] if user_id else [uid for (uid,) in db.session.query(User.id)]
+        for uid in user_ids:
+            materialized.rebuild(uid)
+            db.session.commit()
+        click.echo(f"Rebuilt insights for {len(user_ids)} users.")
+
+    @app.cli.command('rotate-token-keys')
+    @click.option('--batch-size', default=500, show_default=True, help='Users re-encrypted per commit.')
+    @click.option('--enqueue', is_flag=True, help='Queue a background job instead of running here.')
+    def rotate_token_keys(batch_size, enqueue):
+        """Re-encrypt stored tokens with the first key in TOKEN_ENCRYPTION_KEYS."""
+        if primary_key_id() is None:
+            raise click.ClickException("No TOKEN_ENCRYPTION_KEYS / TOKEN_ENCRYPTION_KEY configured.")
+        if enqueue:
+            from app.jobs import PRIORITY_LOW, job_queue
+
+            job = job_queue.enqueue('reencrypt-tokens', payload={'batch_size': batch_size}, priority=PRIORITY_LOW)
+            click.echo(f"Queued job {job.id}.")
+            return
+        total, _ = reencrypt_users(batch_size=batch_size)
+        click.echo(f"Re-encrypted tokens for {total} users; {pending_users().count()} still pending.")
+
+    @app.cli.command('prune-stats')
+    @click.option('--raw-days', type=int, help='Keep raw snapshots this many days (default: STATS_RAW_RETENTION_DAYS).')
+    @click.option('--daily-days', type=int,
+                  help='Keep daily rollups this many days (default: STATS_DAILY_RETENTION_DAYS).')
+    @click.option('--batch-size', type=int, help='Rows per commit (default: STATS_RETENTION_BATCH_SIZE).')
+    def prune_stats(raw_days, daily_days, batch_size):
+        """Roll up old user_stats snapshots into daily/weekly summaries and remove them."""
+        summary = prune(
+            raw_days if raw_days is not None else app.config['STATS_RAW_RETENTION_DAYS'],
+            daily_days if daily_days is not None else app.config['STATS_DAILY_RETENTION_DAYS'],
+            batch_size=batch_size or app.config['STATS_RETENTION_BATCH_SIZE'],
+            keep_latest=app.config['STATS_KEEP_LATEST'],
+        )
+        if summary['partitions_dropped']:
+            click.echo(f"Rolled up and dropped partitions: {', '.join(summary['partitions_dropped'])}.")
+        click.echo(f"Rolled up and deleted {summary['deleted']} snapshots; "
+                   f"merged {summary['days_rolled_up']} daily rollups into weekly ones.")
+
+    @app.cli.command('partition-stats')
+    @click.option('--months-ahead', type=int, help='Months to create ahead (default: STATS_PARTITIONS_AHEAD).')
+    def partition_stats(months_ahead):
+        """Create upcoming monthly user_stats partitions (Postgres, after migration 012)."""
+        if not is_partitioned():
+            click.echo("user_stats is not partitioned; nothing to do.")
+            return
+        created = ensure_partitions(months_ahead if months_ahead is not None else app.config['STATS_PARTITIONS_AHEAD'])
+        click.echo(f"Created partitions: {', '.join(created)}." if created else "Partitions already exist.")
+
+    @app.cli.command('table-report')
+    def table_report_command():
+        """Print row counts and sizes of every table, largest first."""
+        def size(value):
+            return '-' if value is None else f"{value / 1024 / 1024:.1f} MB"
+
+        click.echo(f"{'table':<28} {'rows':>12} {'dead rows':>10} {'table':>10} {'indexes':>10} {'total':>10}")
+        for entry in table_report():
+            name = entry['table'] + (' (partitioned)' if entry['partitioned'] else '')
+            dead = '-' if entry['dead_rows'] is None else entry['dead_rows']
+            click.echo(f"{name:<28} {entry['rows'] if entry['rows'] is not None else '-':>12} {dead:>10} "
+                       f"{size(entry['table_bytes']):>10} {size(entry['index_bytes']):>10} {size(entry['total_bytes']):>10}")
+
+    @app.cli.command('compress-static')
+    @click.option('--min-size', default=1024, show_default=True, help='Skip files smaller than this many bytes.')
+    def compress_static(min_size):
+        """Write precompressed .br/.gz variants of the frontend build next to each file."""
+        written = compress_build(app.static_folder, min_size=min_size)
+        static_files.index()
+        click.echo(f"Wrote {written} compressed files.")
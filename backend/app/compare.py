@@ -0,0 +1,244 @@
+"""
+Comparing users' tastes through an inverted index, `user_items`.
+
+Each user's latest top artists, tracks and genres per time range are stored as
+a sparse vector: one posting per item, weighted by rank (1 / log2(rank + 1), so
+the top of a list counts most) or, for genres, by their share of the
+rank-weighted genre counts. `index_snapshot()` replaces a user's postings from
+`apply_snapshot()`, in the snapshot's own transaction, so reads never touch
+snapshot JSON.
+
+- `compare()` loads both users' postings (one indexed read each) and reports,
+  per item type, the shared items, their overlap, Jaccard index and weighted
+  similarity (cosine of the two vectors).
+- `similar_users()` only walks the posting lists of the user's own items, so its
+  cost grows with how many people share them rather than with the user base.
+
+Both only ever see users in `visible_to()`: those who opted in with
+`users.discoverable`, and friends (users who have added each other, see
+`add_friend()`). Anyone else is treated as if they did not exist.
+"""
+import math
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import aliased
+
+from database.models import db, Friendship, SpotifyItem, User, UserItem
+
+ITEM_TYPES = ('artists', 'tracks', 'genres')
+MAX_SHARED = 20  # shared items listed per type by compare()
+MAX_CANDIDATES = 1000  # users scored exactly by similar_users(), by raw overlap
+
+
+def _mutual_friends(user_id):
+    """Select of the ids of users who have added `user_id` back."""
+    back = aliased(Friendship)
+    return (
+        select(Friendship.friend_id)
+        .join(back, and_(back.user_id == Friendship.friend_id, back.friend_id == Friendship.user_id))
+        .where(Friendship.user_id == user_id)
+    )
+
+
+def visible_to(user_id):
+    """Select of the ids of the users `user_id` may compare with."""
+    return select(User.id).where(User.discoverable.is_(True), User.id != user_id).union(_mutual_friends(user_id))
+
+
+def can_compare(user_id, other_id):
+    """True if `other_id` is in `visible_to(user_id)`."""
+    return db.session.query(User.id).filter(User.id == other_id, User.id.in_(visible_to(user_id))).first() is not None
+
+
+def add_friend(user_id, friend_id):
+    """Add a friend link (idempotent). Caller commits."""
+    if friend_id != user_id and db.session.get(Friendship, (user_id, friend_id)) is None:
+        db.session.add(Friendship(user_id, friend_id))
+
+
+def remove_friend(user_id, friend_id):
+    """Remove a friend link, which ends the friendship both ways. Caller commits."""
+    Friendship.query.filter_by(user_id=user_id, friend_id=friend_id).delete(synchronize_session=False)
+
+
+def list_friends(user_id):
+    """{'friends': mutual, 'pending': added but not back, 'requests': added this user}, as public profiles."""
+    added = {friend_id for (friend_id,) in db.session.query(Friendship.friend_id).filter_by(user_id=user_id)}
+    added_me = {other for (other,) in db.session.query(Friendship.user_id).filter_by(friend_id=user_id)}
+    users = {user.id: user for user in User.query.filter(User.id.in_(added | added_me))}
+    groups = {'friends': added & added_me, 'pending': added - added_me, 'requests': added_me - added}
+    return {
+        name: sorted(
+            ({'spotify_id': users[other].spotify_id, 'display_name': users[other].display_name,
+              'profile_image': users[other].profile_image} for other in ids if other in users),
+            key=lambda profile: (profile['display_name'] or '', profile['spotify_id']),
+        )
+        for name, ids in groups.items()
+    }
+
+
+def rank_weight(rank):
+    return 1 / math.log2(rank + 1)
+
+
+def index_snapshot(user_id, data_type, time_range, items, genres=None):
+    """Replace the user's postings for a time range from a top artists/tracks list. Caller commits.
+
+    `genres` is the artists' genre distribution (see compute_genre_distribution),
+    indexed alongside them.
+    """
+    item_types = [data_type] + (['genres'] if genres is not None else [])
+    UserItem.query.filter(
+        UserItem.user_id == user_id,
+        UserItem.time_range == time_range,
+        UserItem.item_type.in_(item_types),
+    ).delete(synchronize_session=False)
+
+    postings = {}
+    for rank, item in enumerate(items, 1):
+        postings.setdefault((data_type, item['id']), (rank, rank_weight(rank)))
+    if genres is not None:
+        total = sum(genre['count'] for genre in genres['genres']) or 1
+        for rank, genre in enumerate(genres['genres'], 1):
+            postings[('genres', genre['name'][:128])] = (rank, genre['count'] / total)
+
+    db.session.add_all([
+        UserItem(time_range, item_type, item_id, user_id, rank, weight)
+        for (item_type, item_id), (rank, weight) in postings.items()
+    ])
+
+
+def load_vectors(user_id, time_range):
+    """{item_type: {item_id: (rank, weight)}} for one user."""
+    vectors = {item_type: {} for item_type in ITEM_TYPES}
+    rows = db.session.query(UserItem.item_type, UserItem.item_id, UserItem.rank, UserItem.weight).filter(
+        UserItem.user_id == user_id, UserItem.time_range == time_range,
+    )
+    for item_type, item_id, rank, weight in rows:
+        vectors.setdefault(item_type, {})[item_id] = (rank, weight)
+    return vectors
+
+
+def _cosine(dot, norm_a, norm_b):
+    return dot / math.sqrt(norm_a * norm_b) if norm_a and norm_b else 0.0
+
+
+def _score(similarities):
+    """Overall similarity: the mean over item types both users have postings for."""
+    present = [similarity for similarity in similarities if similarity is not None]
+    return sum(present) / len(present) if present else 0.0
+
+
+def _names(item_type, item_ids):
+    if item_type == 'genres' or not item_ids:
+        return {}
+    return {
+        item.id: item.data.get('name')
+        for item in SpotifyItem.query.filter(SpotifyItem.item_type == item_type, SpotifyItem.id.in_(item_ids))
+    }
+
+
+def compare(user_id, other_id, time_range):
+    """Overlap and similarity of two users' top lists, per item type and overall."""
+    mine = load_vectors(user_id, time_range)
+    theirs = load_vectors(other_id, time_range)
+
+    result = {}
+    similarities = []
+    for item_type in ITEM_TYPES:
+        a, b = mine[item_type], theirs[item_type]
+        shared = sorted(a.keys() & b.keys(), key=lambda item_id: (a[item_id][0] + b[item_id][0], item_id))
+        union = len(a) + len(b) - len(shared)
+        similarity = None
+        if a and b:
+            similarity = _cosine(
+                sum(a[item_id][1] * b[item_id][1] for item_id in shared),
+                sum(weight * weight for _, weight in a.values()),
+                sum(weight * weight for _, weight in b.values()),
+            )
+        similarities.append(similarity)
+
+        names = _names(item_type, shared[:MAX_SHARED])
+        result[item_type] = {
+            'overlap': len(shared),
+            'jaccard': len(shared) / union if union else 0.0,
+            'similarity': similarity or 0.0,
+            'shared': [
+                {'id': item_id, 'name': names.get(item_id, item_id), 'rank': a[item_id][0], 'other_rank': b[item_id][0]}
+                for item_id in shared[:MAX_SHARED]
+            ],
+        }
+    return {'time_range': time_range, 'score': _score(similarities), **result}
+
+
+def similar_users(user_id, time_range, limit=20):
+    """The users whose top lists are most similar to this user's, best first.
+
+    Candidates come from the posting lists of the user's own items (anyone with
+    no item in common scores 0 and is never read), restricted to `visible_to()`.
+    At most MAX_CANDIDATES of them, by raw weighted overlap, are then scored exactly.
+    """
+    mine = (
+        db.session.query(UserItem.item_type, UserItem.item_id, UserItem.weight)
+        .filter(UserItem.user_id == user_id, UserItem.time_range == time_range)
+        .subquery()
+    )
+    other = aliased(UserItem)
+    overlaps = (
+        db.session.query(other.user_id, other.item_type, func.count(), func.sum(other.weight * mine.c.weight))
+        .join(mine, and_(other.item_type == mine.c.item_type, other.item_id == mine.c.item_id))
+        .filter(other.time_range == time_range, other.user_id.in_(visible_to(user_id)))
+        .group_by(other.user_id, other.item_type)
+        .all()
+    )
+    if not overlaps:
+        return []
+
+    candidates = {}  # user id -> {item_type: (overlap, dot)}
+    for other_id, item_type, overlap, dot in overlaps:
+        candidates.setdefault(other_id, {})[item_type] = (overlap, dot)
+    if len(candidates) > MAX_CANDIDATES:
+        ranked = sorted(candidates, key=lambda other_id: -sum(dot for _, dot in candidates[other_id].values()))
+        candidates = {other_id: candidates[other_id] for other_id in ranked[:MAX_CANDIDATES]}
+
+    # Vector sizes and norms: the user's own plus every candidate's, in one grouped read
+    norms = {}
+    rows = (
+        db.session.query(UserItem.user_id, UserItem.item_type, func.count(), func.sum(UserItem.weight * UserItem.weight))
+        .filter(UserItem.time_range == time_range, UserItem.user_id.in_([user_id, *candidates]))
+        .group_by(UserItem.user_id, UserItem.item_type)
+    )
+    for other_id, item_type, size, norm in rows:
+        norms[(other_id, item_type)] = (size, norm)
+
+    scored = []
+    for other_id, overlaps_by_type in candidates.items():
+        similarities = []
+        details = {}
+        for item_type in ITEM_TYPES:
+            size_a, norm_a = norms.get((user_id, item_type), (0, 0.0))
+            size_b, norm_b = norms.get((other_id, item_type), (0, 0.0))
+            overlap, dot = overlaps_by_type.get(item_type, (0, 0.0))
+            union = size_a + size_b - overlap
+            similarity = _cosine(dot, norm_a, norm_b) if size_a and size_b else None
+            similarities.append(similarity)
+            details[item_type] = {
+                'overlap': overlap,
+                'jaccard': overlap / union if union else 0.0,
+                'similarity': similarity or 0.0,
+            }
+        scored.append((_score(similarities), other_id, details))
+    scored.sort(key=lambda entry: (-entry[0], entry[1]))
+    scored = scored[:limit]
+
+    users = {user.id: user for user in User.query.filter(User.id.in_([other_id for _, other_id, _ in scored]))}
+    return [
+        {
+            'spotify_id': users[other_id].spotify_id,
+            'display_name': users[other_id].display_name,
+            'profile_image': users[other_id].profile_image,
+            'score': score,
+            **details,
+        }
+        for score, other_id, details in scored if other_id in users
+    ]
@@ -0,0 +1,168 @@
+"""
+Shared audio-features store.
+
+Audio features belong to the track, not the user, and never change, so they are
+fetched from Spotify once and shared by everyone:
+
+1. an in-process LRU (`AUDIO_FEATURES_CACHE_SIZE` tracks) answers repeats for free,
+2. the `track_features` table answers anything any worker has fetched before,
+3. whatever is left is requested in batches of 100 ids (Spotify's maximum).
+
+Concurrent requests for the same track share one fetch: the first caller claims
+the id and the others wait on its Future. Tracks Spotify has no features for are
+stored as unavailable so they aren't requested again.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from app.metrics import CACHE_LOOKUPS
+from app.upstream import upstream
+from database.models import db, TrackFeatures
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100  # Spotify's maximum ids per audio-features request
+DB_CHUNK_SIZE = 500  # ids per IN (...) lookup
+
+
+class FeatureStore:
+    """LRU + table + batched upstream lookup of track audio features."""
+
+    def __init__(self, max_entries=50000):
+        self.max_entries = max_entries
+        self.fetched = 0
+        self._entries = OrderedDict()  # track id -> features dict, or None if unavailable
+        self._inflight = {}  # track id -> Future
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_entries = app.config.get('AUDIO_FEATURES_CACHE_SIZE', self.max_entries)
+        app.extensions['feature_store'] = self
+
+    def get_features(self, track_ids, get_client):
+        """Return {track_id: features or None} for `track_ids`.
+
+        `get_client` is only called if some tracks have to be fetched from Spotify.
+        """
+        wanted = list(dict.fromkeys(track_id for track_id in track_ids if track_id))
+        result = {}
+        missing = []
+        with self._lock:
+            for track_id in wanted:
+                if track_id in self._entries:
+                    self._entries.move_to_end(track_id)
+                    result[track_id] = self._entries[track_id]
+                else:
+                    missing.append(track_id)
+
+        CACHE_LOOKUPS.labels('audio_features', 'hit').inc(len(wanted) - len(missing))
+        if missing:
+            stored = self._load(missing)
+            result.update(stored)
+            missing = [track_id for track_id in missing if track_id not in stored]
+            CACHE_LOOKUPS.labels('audio_features', 'stored').inc(len(stored))
+
+        if missing:
+            CACHE_LOOKUPS.labels('audio_features', 'miss').inc(len(missing))
+            result.update(self._fetch(missing, get_client))
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, features):
+        with self._lock:
+            for track_id, values in features.items():
+                self._entries[track_id] = values
+                self._entries.move_to_end(track_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load(self, track_ids):
+        found = {}
+        for start in range(0, len(track_ids), DB_CHUNK_SIZE):
+            chunk = track_ids[start:start + DB_CHUNK_SIZE]
+            for row in TrackFeatures.query.filter(TrackFeatures.id.in_(chunk)):
+                found[row.id] = row.to_dict()
+        self._remember(found)
+        return found
+
+    def _fetch(self, track_ids, get_client):
+        # Claim ids nobody else is fetching; wait for the rest
+        claimed, waiting = [], {}
+        with self._lock:
+            for track_id in track_ids:
+                future = self._inflight.get(track_id)
+                if future is None:
+                    self._inflight[track_id] = Future()
+                    claimed.append(track_id)
+                else:
+                    waiting[track_id] = future
+
+        result = {}
+        try:
+            if claimed:
+                sp = get_client()
+                if sp is None:
+                    raise RuntimeError("Failed to create Spotify client")
+                for start in range(0, len(claimed), BATCH_SIZE):
+                    batch = claimed[start:start + BATCH_SIZE]
+                    fetched = self._fetch_batch(sp, batch)
+                    result.update(fetched)
+                    self._resolve(fetched)
+        except BaseException as exc:
+            self._fail([track_id for track_id in claimed if track_id not in result], exc)
+            raise
+
+        for track_id, future in waiting.items():
+            result[track_id] = future.result()
+        return result
+
+    def _fetch_batch(self, sp, batch):
+        response = upstream.call(
+            'audio-features:' + ','.join(batch),
+            lambda: sp.audio_features(batch)
+        ) or []
+        fetched = dict.fromkeys(batch)
+        for features in response:
+            if features and features.get('id') in fetched:
+                fetched[features['id']] = {name: features.get(name) for name in TrackFeatures.FEATURES}
+        self.fetched += len(batch)
+        self._store(fetched)
+        return fetched
+
+    def _store(self, fetched):
+        try:
+            for track_id, features in fetched.items():
+                row = TrackFeatures(track_id, features)
+                row.fetched_at = datetime.utcnow()
+                db.session.merge(row)
+            db.session.commit()
+        except IntegrityError:
+            # Another worker stored the same tracks first; theirs are just as good
+            db.session.rollback()
+        except Exception:
+            db.session.rollback()
+            logger.exception("Failed to store audio features for %d tracks", len(fetched))
+        self._remember(fetched)
+
+    def _resolve(self, fetched):
+        with self._lock:
+            futures = [self._inflight.pop(track_id) for track_id in fetched]
+        for future, values in zip(futures, fetched.values()):
+            future.set_result(values)
+
+    def _fail(self, track_ids, exc):
+        with self._lock:
+            futures = [self._inflight.pop(track_id) for track_id in track_ids]
+        for future in futures:
+            future.set_exception(exc)
+
+
+feature_store = FeatureStore()
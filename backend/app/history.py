@@ -0,0 +1,188 @@
+"""
+Local listening history built from Spotify's recently-played endpoint.
+
+Spotify only exposes the last 50 plays, so `ingest_recent_plays` polls with the
+`after` cursor (the newest play we already have) and appends anything new to the
+`plays` table. Plays are deduplicated on (user_id, track_id, played_at), track
+metadata goes into the shared `spotify_items` table and each batch is folded into
+the materialized `user_insights` row in the same transaction. `/api/recently-played` then
+reads from `plays` with cursor pagination instead of proxying Spotify, rebuilding
+Spotify's response shape (links, `next` and the `cursors` block) from what is stored.
+"""
+from urllib.parse import urlencode
+
+from datetime import datetime, timezone
+
+from sqlalchemy.exc import IntegrityError
+
+from app.cache import response_cache
+from app.materialized import apply_plays
+from app.upstream import upstream
+from database.compaction import store_items
+from database.models import db, Play, SpotifyItem
+
+PAGE_SIZE = 50  # Spotify's maximum for recently played
+MAX_PAGES = 20  # safety bound per ingestion pass
+API_URL = 'https://api.spotify.com/v1'
+OPEN_URL = 'https://open.spotify.com'
+
+
+def parse_played_at(value):
+    """Spotify timestamp ('2024-01-01T12:00:00.123Z') -> naive UTC datetime."""
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def to_millis(played_at):
+    return int(played_at.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def format_played_at(played_at):
+    return played_at.strftime('%Y-%m-%dT%H:%M:%S.') + f"{played_at.microsecond // 1000:03d}Z"
+
+
+def ingest_due(user_id):
+    """Whether enough time has passed since the last poll (shared across workers via the cache)."""
+    return response_cache.get(user_id, 'recently-played:polled') is None
+
+
+def ingest_recent_plays(sp, user_id):
+    """Append plays newer than the latest stored one. Returns the number of new plays."""
+    latest = db.session.query(db.func.max(Play.played_at)).filter_by(user_id=user_id).scalar()
+    after = to_millis(latest) if latest else None
+
+    items = []
+    for _ in range(MAX_PAGES):
+        page = upstream.call(
+            response_cache.make_key(user_id, 'recently-played:after', after),
+            lambda after=after: sp.current_user_recently_played(limit=PAGE_SIZE, after=after)
+        )
+        batch = page.get('items', [])
+        items.extend(batch)
+        next_after = (page.get('cursors') or {}).get('after')
+        if len(batch) < PAGE_SIZE or not next_after or after is None:
+            break  # without a starting cursor Spotify only returns the latest page
+        after = int(next_after)
+
+    response_cache.set(user_id, 'recently-played:polled', True)
+    if not items:
+        return 0
+
+    plays = {}
+    for item in items:
+        track = item.get('track') or {}
+        if not track.get('id') or not item.get('played_at'):
+            continue
+        played_at = parse_played_at(item['played_at'])
+        plays[(track['id'], played_at)] = (item.get('context') or {}).get('uri')
+    if not plays:
+        return 0  # e.g. only local files, which have no track id
+
+    # The `after` cursor is exclusive, but guard against overlap all the same
+    oldest = min(played_at for _, played_at in plays)
+    existing = set(
+        db.session.query(Play.track_id, Play.played_at)
+        .filter(Play.user_id == user_id, Play.played_at >= oldest)
+    )
+
+    new_plays = [
+        Play(user_id, track_id, played_at, context_uri)
+        for (track_id, played_at), context_uri in plays.items()
+        if (track_id, played_at) not in existing
+    ]
+    if not new_plays:
+        return 0
+
+    try:
+        tracks = [item.get('track') for item in items]
+        store_items('tracks', tracks)
+        db.session.add_all(new_plays)
+        apply_plays(user_id, new_plays, tracks={track['id']: track for track in tracks if track and track.get('id')})
+        db.session.commit()
+    except IntegrityError:
+        # Another worker ingested the same plays (or created the insights row) at the same moment
+        db.session.rollback()
+        return 0
+    return len(new_plays)
+
+
+def _with_links(item_type, item):
+    """Add the `type`, `href`, `external_urls` and `uri` Spotify puts on every object."""
+    item_id = item.get('id')
+    if not item_id:
+        return item
+    return {
+        **item,
+        'type': item_type,
+        'href': f"{API_URL}/{item_type}s/{item_id}",
+        'external_urls': {'spotify': f"{OPEN_URL}/{item_type}/{item_id}"},
+        'uri': item.get('uri') or f"spotify:{item_type}:{item_id}",
+    }
+
+
+def _track_payload(track):
+    track = _with_links('track', track)
+    if track.get('artists'):
+        track['artists'] = [_with_links('artist', artist) for artist in track['artists']]
+    if track.get('album'):
+        track['album'] = _with_links('album', track['album'])
+    track.setdefault('is_local', False)
+    return track
+
+
+def _context_payload(uri):
+    if not uri:
+        return None
+    parts = uri.split(':')
+    if len(parts) != 3:
+        return {'type': None, 'href': None, 'external_urls': {}, 'uri': uri}  # e.g. a user's collection
+    _, context_type, context_id = parts
+    return {
+        'type': context_type,
+        'href': f"{API_URL}/{context_type}s/{context_id}",
+        'external_urls': {'spotify': f"{OPEN_URL}/{context_type}/{context_id}"},
+        'uri': uri,
+    }
+
+
+def _page_url(limit, before=None):
+    params = {'limit': limit} if before is None else {'before': before, 'limit': limit}
+    return f"{API_URL}/me/player/recently-played?{urlencode(params)}"
+
+
+def load_recent_plays(user_id, limit, before=None):
+    """Read a page of stored plays (newest first) in Spotify's recently-played shape.
+
+    `before` is a millisecond timestamp cursor, as returned in `cursors.before`.
+    Tracks carry the fields kept in `spotify_items` plus the links Spotify adds.
+    """
+    query = Play.query.filter_by(user_id=user_id)
+    if before is not None:
+        query = query.filter(Play.played_at < datetime.fromtimestamp(before / 1000, timezone.utc).replace(tzinfo=None))
+    plays = query.order_by(Play.played_at.desc()).limit(limit + 1).all()
+    has_more = len(plays) > limit
+    plays = plays[:limit]
+
+    track_ids = list({play.track_id for play in plays})
+    tracks = {
+        row.id: row.data
+        for row in SpotifyItem.query.filter(SpotifyItem.item_type == 'tracks', SpotifyItem.id.in_(track_ids))
+    } if track_ids else {}
+
+    cursors = {
+        'after': str(to_millis(plays[0].played_at)),
+        'before': str(to_millis(plays[-1].played_at)),
+    } if plays else None
+    return {
+        'items': [
+            {
+                'track': _track_payload(tracks.get(play.track_id, {'id': play.track_id})),
+                'played_at': format_played_at(play.played_at),
+                'context': _context_payload(play.context_uri),
+            }
+            for play in plays
+        ],
+        'next': _page_url(limit, cursors['before']) if has_more else None,
+        'cursors': cursors,
+        'limit': limit,
+        'href': _page_url(limit, before),
+    }
@@ -0,0 +1,147 @@
+"""
+Listening-habit insights under /api/insights.
+
+`/summary` is one read of the materialized `user_insights` rows (see
+app/materialized.py). The other endpoints compute a single statistic over the
+user's stored plays (`source=plays`, optionally the last `days` days) or their
+latest top tracks (`source=top`) with the vectorised helpers in app/analytics.py.
+Hour and weekday counts for the whole history come from the materialized
+listening slots, shifted to the caller's `tz_offset`.
+"""
+import functools
+
+from flask import Blueprint, jsonify, request, session, current_app
+
+from app.analytics import (
+    WEEKDAYS, decade_histogram, genre_diversity, hour_histogram, latest_snapshot,
+    load_plays, load_top_tracks, top_albums, weekday_histogram,
+)
+from app.api import TIME_RANGES
+from app.materialized import listening_histograms, load_listening, load_summary
+
+insights_bp = Blueprint('insights', __name__)
+
+SOURCES = ('plays', 'top')
+MAX_TZ_OFFSET = 14 * 60  # minutes
+
+
+class InvalidParameter(ValueError):
+    pass
+
+
+def _time_range():
+    time_range = request.args.get('time_range', 'medium_term')
+    if time_range not in TIME_RANGES:
+        raise InvalidParameter(f"Invalid time_range. Must be one of: {', '.join(TIME_RANGES)}")
+    return time_range
+
+
+def _tz_offset():
+    tz_offset = request.args.get('tz_offset', 0, type=int)
+    if abs(tz_offset) > MAX_TZ_OFFSET:
+        raise InvalidParameter("Invalid tz_offset. Must be minutes east of UTC")
+    return tz_offset
+
+
+def _load_frame(user_id):
+    """Plays (optionally the last `days` days) or the latest top tracks, per `source`."""
+    source = request.args.get('source', 'plays')
+    if source not in SOURCES:
+        raise InvalidParameter(f"Invalid source. Must be one of: {', '.join(SOURCES)}")
+    if source == 'top':
+        return load_top_tracks(user_id, _time_range())
+    return load_plays(user_id, days=request.args.get('days', type=int))
+
+
+def insight(view):
+    """Authenticate and map parameter/internal errors to JSON responses."""
+    @functools.wraps(view)
+    def wrapper():
+        user_id = session.get('user_id')
+        if not user_id:
+            return jsonify({"error": "Not authenticated"}), 401
+        try:
+            return jsonify(view(user_id))
+        except InvalidParameter as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception:
+            current_app.logger.exception("Failed to compute insight %s", view.__name__)
+            return jsonify({"error": "An internal error occurred"}), 500
+
+    return wrapper
+
+
+def _listening(user_id):
+    """(hours, weekdays, total plays): materialized for the whole history, computed for `days`."""
+    tz_offset = _tz_offset()
+    days = request.args.get('days', type=int)
+    if not days:
+        row = load_listening(user_id)
+        if row is None or not row.listening_slots:
+            return [0] * 24, [0] * 7, 0
+        hours, weekdays = listening_histograms(row.listening_slots, tz_offset)
+        return hours, weekdays, row.play_count
+
+    plays = load_plays(user_id, days=days)
+    return hour_histogram(plays, tz_offset), weekday_histogram(plays, tz_offset), len(plays)
+
+
+@insights_bp.route('/summary')
+@insight
+def get_summary(user_id):
+    """Precomputed genres, albums, decades, rank changes and listening habits"""
+    return load_summary(user_id, _time_range(), _tz_offset())
+
+
+@insights_bp.route('/hours')
+@insight
+def get_hours(user_id):
+    """Plays per hour of day from the stored listening history"""
+    counts, _, total = _listening(user_id)
+    return {
+        "hours": [{"hour": hour, "count": int(count)} for hour, count in enumerate(counts)],
+        "total_plays": total,
+    }
+
+
+@insights_bp.route('/weekdays')
+@insight
+def get_weekdays(user_id):
+    """Plays per day of week from the stored listening history"""
+    _, counts, total = _listening(user_id)
+    return {
+        "weekdays": [{"day": day, "count": int(count)} for day, count in zip(WEEKDAYS, counts)],
+        "total_plays": total,
+    }
+
+
+@insights_bp.route('/eras')
+@insight
+def get_eras(user_id):
+    """Release decades of played tracks (source=plays) or top tracks (source=top)"""
+    frame = _load_frame(user_id)
+    decades, counts = decade_histogram(frame)
+    return {
+        "decades": [{"decade": int(decade), "count": int(count)} for decade, count in zip(decades, counts)],
+        "total_tracks_sampled": len(frame),
+    }
+
+
+@insights_bp.route('/genre-diversity')
+@insight
+def get_genre_diversity(user_id):
+    """How varied the genres across the user's latest top artists are"""
+    artists = latest_snapshot(user_id, 'artists', _time_range()) or {}
+    return genre_diversity(artists)
+
+
+@insights_bp.route('/top-albums')
+@insight
+def get_top_albums(user_id):
+    """Albums ranked by plays (source=plays) or by top-track ranking (source=top)"""
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    frame = _load_frame(user_id)
+    return {
+        "albums": [{**frame.albums[album_id], "count": count} for album_id, count in top_albums(frame, limit)],
+        "total_tracks_sampled": len(frame),
+    }
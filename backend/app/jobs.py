@@ -0,0 +1,306 @@
+"""
+Database-backed job queue for Spotify work that shouldn't run in a request.
+
+`job_queue.enqueue()` inserts a row into `jobs`; `worker.py` (or, with
+`JOBS_RUN_IN_PROCESS`, a thread inside the web process) claims runnable jobs
+highest priority first and runs the handler registered for the job's kind.
+
+- Dedup: a job with a `dedupe_key` (by default kind + user) is not enqueued
+  again while an earlier one is still queued or running; the existing job is
+  returned instead. A partial unique index on `dedupe_key` for queued/running
+  jobs settles concurrent enqueues: the one that loses the race gets an
+  IntegrityError and returns the winner's job.
+- Claiming is a conditional UPDATE (`... WHERE status = 'queued'`), so several
+  workers can poll the same table without running a job twice.
+- Retries: a failed attempt is re-queued with exponential backoff (or after
+  Spotify's Retry-After when throttled) until `max_attempts`.
+- While a job runs, a heartbeat thread stamps `heartbeat_at` every
+  `JOB_HEARTBEAT_INTERVAL`. A job whose heartbeat is older than `JOB_TIMEOUT`
+  (its worker died) is re-queued, or failed once it has used `max_attempts`,
+  so a job that keeps crashing its worker is not retried forever.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from app.background import BackgroundThread
+from app.upstream import UpstreamThrottled
+from database.models import db, Job
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = -10
+
+_handlers = {}
+
+
+def handler(kind):
+    """Register the function that runs jobs of `kind`: fn(job) -> JSON-serialisable result."""
+    def register(fn):
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+def _client_for(job):
+    from app.api import get_spotify_client  # the API blueprint imports this module
+
+    # Not `active`: a job is not the user being online, and must not start the refresh scheduler in worker.py
+    sp = get_spotify_client(job.user_id, active=False)
+    if sp is None:
+        raise RuntimeError("Failed to create Spotify client")
+    return sp
+
+
+@handler('sync-top-items')
+def sync_top_items(job):
+    """Fetch top artists and tracks for each time range (snapshotting them) and derive genres."""
+    from app.api import MAX_TOP_LIMIT, TIME_RANGES, aggregate_top_genres, fetch_top_items
+
+    sp = _client_for(job)
+    time_ranges = (job.payload or {}).get('time_ranges') or TIME_RANGES
+    for time_range in time_ranges:
+        artists = fetch_top_items(sp, job.user_id, 'artists', time_range, MAX_TOP_LIMIT)
+        fetch_top_items(sp, job.user_id, 'tracks', time_range, MAX_TOP_LIMIT)
+        aggregate_top_genres(job.user_id, time_range, MAX_TOP_LIMIT, artists=artists)
+    return {'time_ranges': list(time_ranges)}
+
+
+@handler('ingest-recent-plays')
+def ingest_plays(job):
+    from app.history import ingest_recent_plays
+
+    return {'new_plays': ingest_recent_plays(_client_for(job), job.user_id)}
+
+
+@handler('sync-library')
+def sync_library(job):
+    from app.library import library_sync, sync_states
+
+    library_sync.run(job.user_id, lambda: _client_for(job), full=(job.payload or {}).get('full', False))
+    states = sync_states(job.user_id)
+    failed = [state for state in states if state['status'] == 'failed']
+    if failed:
+        # Retrying resumes from the checkpoints in sync_states
+        raise RuntimeError('; '.join(f"{state['kind']}: {state['error']}" for state in failed))
+    return {'states': states}
+
+
+@handler('reencrypt-tokens')
+def reencrypt_tokens(job):
+    """Re-encrypt stored tokens under the primary key. Safe to retry: finished rows are skipped."""
+    from database.key_rotation import reencrypt_users
+
+    payload = job.payload or {}
+    total, last_id = reencrypt_users(batch_size=payload.get('batch_size', 500), after_id=payload.get('after_id', 0))
+    return {'reencrypted': total, 'last_id': last_id}
+
+
+class JobQueue:
+    """Enqueue API plus the worker loop that drains `jobs`."""
+
+    def __init__(self):
+        self.app = None
+        self.poll_interval = 1.0
+        self.timeout = 15 * 60
+        self.heartbeat_interval = 60
+        self.retry_backoff = 30
+        self.run_in_process = False
+        self._thread = BackgroundThread(self.work, 'job-worker')
+
+    def init_app(self, app):
+        self.app = app
+        self.poll_interval = app.config.get('JOB_POLL_INTERVAL', self.poll_interval)
+        self.timeout = app.config.get('JOB_TIMEOUT', self.timeout)
+        self.heartbeat_interval = app.config.get('JOB_HEARTBEAT_INTERVAL', self.heartbeat_interval)
+        self.retry_backoff = app.config.get('JOB_RETRY_BACKOFF', self.retry_backoff)
+        self.run_in_process = app.config.get('JOBS_RUN_IN_PROCESS', False)
+        app.extensions['job_queue'] = self
+
+    @property
+    def worker_id(self):
+        # Per process: a preloaded app is forked into several workers
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def enqueue(self, kind, user_id=None, payload=None, priority=PRIORITY_NORMAL, max_attempts=3,
+                dedupe_key='default'):
+        """Queue a job and return it, or return the equivalent job already queued/running.
+
+        `dedupe_key` defaults to "<kind>:<user_id>"; pass None to always enqueue.
+        """
+        if kind not in _handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if dedupe_key == 'default':
+            dedupe_key = f"{kind}:{user_id}"
+
+        for attempt in range(2):
+            if dedupe_key is not None:
+                existing = self.active_job(dedupe_key)
+                if existing is not None:
+                    if priority > existing.priority and existing.status == 'queued':
+                        existing.priority = priority
+                        db.session.commit()
+                    return existing
+
+            job = Job(kind, user_id=user_id, payload=payload, priority=priority,
+                      max_attempts=max_attempts, dedupe_key=dedupe_key)
+            db.session.add(job)
+            try:
+                db.session.commit()
+                break
+            except IntegrityError:
+                # A concurrent enqueue inserted the same dedupe key first; return its job
+                db.session.rollback()
+                if dedupe_key is None or attempt:
+                    raise
+
+        if self.run_in_process:
+            self._thread.ensure_running()
+        return job
+
+    @staticmethod
+    def active_job(dedupe_key):
+        """The queued or running job holding `dedupe_key`, if any."""
+        return Job.query.filter(Job.dedupe_key == dedupe_key, Job.status.in_(('queued', 'running'))).first()
+
+    def claim(self):
+        """Take the next runnable job for this worker, or return None."""
+        now = datetime.utcnow()
+        candidates = (
+            db.session.query(Job.id)
+            .filter(Job.status == 'queued', Job.run_at <= now)
+            .order_by(Job.priority.desc(), Job.run_at, Job.id)
+            .limit(5)
+            .all()
+        )
+        for (job_id,) in candidates:
+            # Only one worker's UPDATE can match while the job is still queued
+            claimed = (
+                Job.query
+                .filter(Job.id == job_id, Job.status == 'queued')
+                .update({'status': 'running', 'locked_by': self.worker_id, 'locked_at': now,
+                         'heartbeat_at': now, 'attempts': Job.attempts + 1, 'updated_at': now},
+                        synchronize_session=False)
+            )
+            db.session.commit()
+            if claimed:
+                return db.session.get(Job, job_id)
+        return None
+
+    def run_job(self, job):
+        """Run a claimed job and record the outcome (success, retry or failure)."""
+        fn = _handlers.get(job.kind)
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job.id, stop), name='job-heartbeat', daemon=True)
+        heartbeat.start()
+        try:
+            if fn is None:
+                raise ValueError(f"Unknown job kind: {job.kind}")
+            result = fn(job)
+        except Exception as exc:
+            db.session.rollback()
+            job = db.session.get(Job, job.id)
+            job.error = f"{type(exc).__name__}: {exc}"[:1000]
+            job.locked_by = None
+            if job.attempts < job.max_attempts:
+                if isinstance(exc, UpstreamThrottled):
+                    delay = exc.retry_after
+                else:
+                    delay = self.retry_backoff * 2 ** (job.attempts - 1)
+                job.status = 'queued'
+                job.run_at = datetime.utcnow() + timedelta(seconds=delay)
+                logger.warning("Job %s (%s) failed, retrying in %ss: %s", job.id, job.kind, delay, exc)
+            else:
+                job.status = 'failed'
+                logger.exception("Job %s (%s) failed permanently", job.id, job.kind)
+            db.session.commit()
+            return False
+        finally:
+            stop.set()
+            heartbeat.join()
+
+        job.status = 'succeeded'
+        job.result = result
+        job.error = None
+        job.locked_by = None
+        db.session.commit()
+        return True
+
+    def beat(self, job_id):
+        """Record that this worker is still running the job."""
+        now = datetime.utcnow()
+        Job.query.filter(Job.id == job_id, Job.status == 'running', Job.locked_by == self.worker_id).update(
+            {'heartbeat_at': now}, synchronize_session=False)
+        db.session.commit()
+
+    def _heartbeat(self, job_id, stop):
+        while not stop.wait(self.heartbeat_interval):
+            with self.app.app_context():
+                try:
+                    self.beat(job_id)
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("Heartbeat for job %s failed", job_id)
+
+    def requeue_stale(self):
+        """Put back jobs whose worker stopped reporting (crashed or was killed).
+
+        Jobs that have already used all their attempts are failed instead. Returns
+        the number re-queued.
+        """
+        now = datetime.utcnow()
+        stale = (
+            Job.status == 'running',
+            func.coalesce(Job.heartbeat_at, Job.locked_at) < now - timedelta(seconds=self.timeout),
+        )
+        failed = (
+            Job.query
+            .filter(*stale, Job.attempts >= Job.max_attempts)
+            .update({'status': 'failed', 'locked_by': None, 'updated_at': now,
+                     'error': 'Worker stopped responding on the last attempt'}, synchronize_session=False)
+        )
+        count = (
+            Job.query
+            .filter(*stale)
+            .update({'status': 'queued', 'locked_by': None, 'updated_at': now}, synchronize_session=False)
+        )
+        db.session.commit()
+        if failed:
+            logger.error("Failed %d jobs whose worker stopped responding on their last attempt", failed)
+        if count:
+            logger.warning("Re-queued %d stale jobs", count)
+        return count
+
+    def work(self, stop_event=None, burst=False):
+        """Claim and run jobs until `stop_event` is set (or the queue is empty, with `burst`)."""
+        last_sweep = 0.0
+        while stop_event is None or not stop_event.is_set():
+            with self.app.app_context():
+                try:
+                    if time.monotonic() - last_sweep > 60:
+                        self.requeue_stale()
+                        last_sweep = time.monotonic()
+                    job = self.claim()
+                    if job is not None:
+                        self.run_job(job)
+                        continue
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("Job worker iteration failed")
+            if burst:
+                return
+            if stop_event is not None:
+                stop_event.wait(self.poll_interval)
+            else:
+                time.sleep(self.poll_interval)
+
+
+job_queue = JobQueue()
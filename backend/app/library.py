@@ -0,0 +1,479 @@
+"""
+Library sync: the user's saved tracks and playlists, mirrored into the database.
+
+Libraries can run to tens of thousands of items, so a sync never holds one in
+memory. `iter_pages()` is a generator that walks Spotify's offset pagination
+and yields pages in order; each page is upserted and committed together with
+the sync's checkpoint in `sync_states` before the next one is consumed. Walks
+that read every page keep up to `LIBRARY_SYNC_CONCURRENCY` pages in flight;
+incremental ones, which usually stop after the first page, fetch one at a time.
+
+- Saved tracks: the first sync (or `full=True`) walks everything, resuming from
+  the checkpointed offset if it was interrupted. Tracks the user removed are
+  pruned only after a full pass that ran start to finish while the list stayed
+  the same length: the list is newest first, so once it shifts, offsets no
+  longer line up and a track missed by the walk would look removed. Later
+  syncs are incremental — they stop at the first track not newer than the last
+  sync's high-water `added_at`.
+- Playlists: the playlist list is always refreshed (it is small), but a
+  playlist's tracks are only re-fetched when its `snapshot_id` changed, so an
+  interrupted sync resumes by skipping every playlist already stored. Tracks
+  are fetched into a new `version` of the list, invisible to readers until the
+  playlist is switched to it in one transaction.
+
+Syncs run as `sync-library` jobs on the job worker (see app.jobs), never
+inside a request. A user whose token lacks the library scopes (granted before
+they were requested) is marked `needs_consent` instead of being retried; the
+next login grants them.
+"""
+import base64
+import logging
+import secrets
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import islice
+
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+
+from app.cache import response_cache
+from app.history import parse_played_at, to_millis
+from app.spotify import LIBRARY_SCOPES, missing_scopes
+from app.upstream import upstream
+from database.compaction import store_items
+from database.models import db, Playlist, PlaylistTrack, SavedTrack, SpotifyItem, SyncState, User, UserPlaylist
+
+logger = logging.getLogger(__name__)
+
+KINDS = ('saved_tracks', 'playlists')
+SAVED_TRACKS_PAGE = 50  # Spotify's maximums per request
+PLAYLISTS_PAGE = 50
+PLAYLIST_ITEMS_PAGE = 100
+# Only what compact_item keeps, so playlist pages stay small
+PLAYLIST_ITEM_FIELDS = (
+    'total,items(added_at,track(id,type,name,duration_ms,popularity,explicit,uri,'
+    'artists(id,name),album(id,name,images,release_date,release_date_precision)))'
+)
+STALE_VERSION_AGE = 24 * 60 * 60  # seconds before an unfinished playlist tracks version is removed
+NEEDS_CONSENT_ERROR = "Spotify has not granted the library scopes; log in again to allow library sync"
+
+
+def iter_pages(fetch, start=0, page_size=50, concurrency=4):
+    """Yield (offset, page) for every page from `start`, in order.
+
+    `fetch(offset, limit)` returns one Spotify paging object. The first page is
+    fetched alone to learn `total`; after that up to `concurrency` pages are
+    requested ahead while the caller processes the current one. Closing the
+    generator early cancels whatever hasn't started. With `concurrency=0`
+    nothing is fetched before the caller asks for it, for walks that usually
+    stop early.
+    """
+    first = fetch(start, page_size)
+    offsets = iter(range(start + page_size, first.get('total') or 0, page_size))
+    yield start, first
+
+    if concurrency < 1:
+        for offset in offsets:
+            yield offset, fetch(offset, page_size)
+        return
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix='library-page') as executor:
+        pending = deque((offset, executor.submit(fetch, offset, page_size))
+                        for offset in islice(offsets, max(concurrency, 1)))
+        try:
+            while pending:
+                offset, future = pending.popleft()
+                page = future.result()
+                following = next(offsets, None)
+                if following is not None:
+                    pending.append((following, executor.submit(fetch, following, page_size)))
+                yield offset, page
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def _state(user_id, kind):
+    state = (
+        SyncState.query
+        .filter_by(user_id=user_id, kind=kind)
+        .with_for_update()
+        .populate_existing()
+        .first()
+    )
+    if state is None:
+        state = SyncState(user_id, kind)
+        db.session.add(state)
+    return state
+
+
+def _store_saved_page(user_id, items, synced_at):
+    added = {}
+    for item in items:
+        track = item.get('track') or {}
+        if track.get('id') and item.get('added_at'):
+            added[track['id']] = parse_played_at(item['added_at'])
+    if not added:
+        return
+
+    store_items('tracks', [item.get('track') for item in items])
+    existing = {
+        row.track_id: row for row in
+        SavedTrack.query.filter(SavedTrack.user_id == user_id, SavedTrack.track_id.in_(list(added)))
+    }
+    new_rows = []
+    for track_id, added_at in added.items():
+        row = existing.get(track_id)
+        if row is None:
+            new_rows.append(SavedTrack(user_id, track_id, added_at, synced_at))
+        else:
+            row.added_at = added_at
+            row.synced_at = synced_at
+    db.session.add_all(new_rows)
+
+
+def sync_saved_tracks(sp, user_id, full=False, concurrency=4):
+    """Mirror the user's saved tracks. Returns the number of tracks written."""
+    state = _state(user_id, 'saved_tracks')
+    full = full or state.high_water is None
+    resumed = bool(full and state.cursor)
+    if not resumed:
+        state.cursor = 0
+        state.started_at = datetime.utcnow()
+    state.status = 'running'
+    state.error = None
+    high_water, started_at = state.high_water, state.started_at
+    db.session.commit()
+
+    def fetch(offset, limit):
+        return upstream.call(
+            response_cache.make_key(user_id, 'library:saved-tracks', offset, limit),
+            lambda: sp.current_user_saved_tracks(limit=limit, offset=offset)
+        )
+
+    written = 0
+    totals = set()  # `total` as of each page; more than one means the list changed mid-walk
+    unstored = 0  # items with no track id (e.g. local files), which a full pass never stores
+    pages = iter_pages(fetch, state.cursor if full else 0, SAVED_TRACKS_PAGE, concurrency if full else 0)
+    for offset, page in pages:
+        items = page.get('items', [])
+        newer = items if full else [
+            item for item in items
+            if item.get('added_at') and parse_played_at(item['added_at']) > high_water
+        ]
+        _store_saved_page(user_id, newer, started_at)
+        written += len(newer)
+        totals.add(page.get('total'))
+        unstored += sum(1 for item in newer if not ((item.get('track') or {}).get('id') and item.get('added_at')))
+
+        state = _state(user_id, 'saved_tracks')
+        state.total = page.get('total')
+        if full:
+            state.cursor = offset + len(items)
+        db.session.commit()
+        if len(newer) < len(items):
+            break  # reached tracks the last sync already stored
+
+    state = _state(user_id, 'saved_tracks')
+    if full and not resumed and len(totals) == 1:
+        seen = SavedTrack.query.filter(SavedTrack.user_id == user_id, SavedTrack.synced_at >= started_at).count()
+        if seen + unstored == totals.pop():
+            # The walk saw every track, so anything it didn't see was removed from the library
+            SavedTrack.query.filter(SavedTrack.user_id == user_id, SavedTrack.synced_at < started_at) \
+                .delete(synchronize_session=False)
+        else:
+            logger.info("Saved tracks of user %s changed during the sync; not pruning", user_id)
+    state.high_water = db.session.query(db.func.max(SavedTrack.added_at)).filter_by(user_id=user_id).scalar()
+    state.cursor = 0
+    state.status = 'complete'
+    db.session.commit()
+    return written
+
+
+def _store_playlists_page(user_id, items, offset, synced_at):
+    playlists = {item['id']: item for item in items if item and item.get('id')}
+    if not playlists:
+        return
+    existing = {row.id: row for row in Playlist.query.filter(Playlist.id.in_(list(playlists)))}
+    memberships = {
+        row.playlist_id: row for row in
+        UserPlaylist.query.filter(UserPlaylist.user_id == user_id, UserPlaylist.playlist_id.in_(list(playlists)))
+    }
+    for position, (playlist_id, item) in enumerate(playlists.items(), offset):
+        playlist = existing.get(playlist_id)
+        if playlist is None:
+            playlist = Playlist(playlist_id)
+            db.session.add(playlist)
+        playlist.name = item.get('name')
+        playlist.owner_id = (item.get('owner') or {}).get('id')
+        playlist.image_url = ((item.get('images') or [{}])[0] or {}).get('url')
+        playlist.tracks_total = (item.get('tracks') or {}).get('total')
+        playlist.snapshot_id = item.get('snapshot_id')
+
+        membership = memberships.get(playlist_id)
+        if membership is None:
+            db.session.add(UserPlaylist(user_id, playlist_id, position, synced_at))
+        else:
+            membership.position = position
+            membership.synced_at = synced_at
+
+
+def _new_version():
+    # Starts with the zero-padded time, so unfinished versions can be found by age
+    return f"{int(time.time()):010d}{secrets.token_hex(4)}"
+
+
+def _sync_playlist_tracks(sp, playlist, concurrency):
+    """Replace a playlist's stored tracks with its current contents.
+
+    Pages are stored under a new version as they arrive; the playlist is only
+    switched to it, and the previous version deleted, in one transaction once
+    every page is in. Readers never see a partial list, and a failed fetch leaves
+    the previous one in place. Returns False if another sync of the same (shared)
+    playlist switched it first, in which case that sync's tracks are kept.
+    """
+    # Plain values: pages are fetched on other threads, away from the session
+    playlist_id, snapshot_id, live = playlist.id, playlist.snapshot_id, playlist.tracks_version
+    version = _new_version()
+    # Versions left behind by syncs that died before switching
+    abandoned = PlaylistTrack.query.filter(
+        PlaylistTrack.playlist_id == playlist_id,
+        PlaylistTrack.version < f"{int(time.time()) - STALE_VERSION_AGE:010d}",
+    )
+    if live is not None:
+        abandoned = abandoned.filter(PlaylistTrack.version != live)
+    abandoned.delete(synchronize_session=False)
+    db.session.commit()
+
+    def fetch(offset, limit):
+        return upstream.call(
+            f"playlist:{playlist_id}:{snapshot_id}:{offset}:{limit}",
+            lambda: sp.playlist_items(playlist_id, fields=PLAYLIST_ITEM_FIELDS, limit=limit,
+                                      offset=offset, additional_types=('track',))
+        )
+
+    try:
+        for offset, page in iter_pages(fetch, 0, PLAYLIST_ITEMS_PAGE, concurrency):
+            items = page.get('items', [])
+            tracks = [item.get('track') for item in items
+                      if item.get('track') and item['track'].get('type', 'track') == 'track']
+            store_items('tracks', tracks)
+            db.session.add_all([
+                PlaylistTrack(
+                    playlist_id, version, position, (item.get('track') or {}).get('id'),
+                    parse_played_at(item['added_at']) if item.get('added_at') else None,
+                )
+                for position, item in enumerate(items, offset)
+            ])
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        PlaylistTrack.query.filter_by(playlist_id=playlist_id, version=version).delete(synchronize_session=False)
+        db.session.commit()
+        raise
+
+    # Switch only from the version this sync started from, so concurrent syncs can't mix their pages
+    switched = (
+        Playlist.query
+        .filter(Playlist.id == playlist_id,
+                (Playlist.tracks_version == live) if live is not None else Playlist.tracks_version.is_(None))
+        .update({'tracks_version': version, 'synced_snapshot_id': snapshot_id}, synchronize_session=False)
+    )
+    PlaylistTrack.query.filter_by(playlist_id=playlist_id, version=live if switched else version) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return bool(switched)
+
+
+def sync_playlists(sp, user_id, full=False, concurrency=4):
+    """Mirror the user's playlists and the tracks of those that changed. Returns playlists re-synced."""
+    state = _state(user_id, 'playlists')
+    state.cursor = 0
+    state.started_at = started_at = datetime.utcnow()
+    state.status = 'running'
+    state.error = None
+    db.session.commit()
+
+    def fetch(offset, limit):
+        return upstream.call(
+            response_cache.make_key(user_id, 'library:playlists', offset, limit),
+            lambda: sp.current_user_playlists(limit=limit, offset=offset)
+        )
+
+    for offset, page in iter_pages(fetch, 0, PLAYLISTS_PAGE, concurrency):
+        _store_playlists_page(user_id, page.get('items', []), offset, started_at)
+        db.session.commit()
+    UserPlaylist.query.filter(UserPlaylist.user_id == user_id, UserPlaylist.synced_at < started_at) \
+        .delete(synchronize_session=False)
+    state = _state(user_id, 'playlists')
+    state.total = UserPlaylist.query.filter_by(user_id=user_id).count()
+    db.session.commit()
+
+    # Playlists stored at their current snapshot are skipped, which is also what
+    # makes an interrupted sync resume where it stopped
+    playlist_ids = [
+        playlist_id for (playlist_id,) in
+        db.session.query(UserPlaylist.playlist_id).filter_by(user_id=user_id).order_by(UserPlaylist.position)
+    ]
+    synced = 0
+    for done, playlist_id in enumerate(playlist_ids, 1):
+        playlist = db.session.get(Playlist, playlist_id)
+        if full or playlist.synced_snapshot_id != playlist.snapshot_id:
+            try:
+                if _sync_playlist_tracks(sp, playlist, concurrency):
+                    synced += 1
+                else:
+                    logger.info("Playlist %s was synced elsewhere meanwhile", playlist_id)
+            except IntegrityError:
+                # Another user's sync stored the same tracks in spotify_items first
+                db.session.rollback()
+                logger.info("Playlist %s is being synced elsewhere, skipping", playlist_id)
+        state = _state(user_id, 'playlists')
+        state.cursor = done
+        db.session.commit()
+
+    state = _state(user_id, 'playlists')
+    state.cursor = 0
+    state.status = 'complete'
+    db.session.commit()
+    return synced
+
+
+class LibrarySync:
+    """Runs a user's library sync; scheduled as a `sync-library` job (see app.jobs)."""
+
+    def __init__(self):
+        self.app = None
+        self.concurrency = 4
+
+    def init_app(self, app):
+        self.app = app
+        self.concurrency = app.config.get('LIBRARY_SYNC_CONCURRENCY', self.concurrency)
+        app.extensions['library_sync'] = self
+
+    def run(self, user_id, get_client, full=False):
+        """Sync every kind for the user on the calling thread, recording failures in `sync_states`.
+
+        Kinds the user's token has no scope for (known from the stored scope, or
+        from Spotify answering 403) are marked `needs_consent` rather than failed,
+        so the job is not retried until the user logs in again.
+        """
+        with self.app.app_context():
+            user = db.session.get(User, user_id)
+            missing = missing_scopes(user.token_scope if user else None, LIBRARY_SCOPES)
+            db.session.commit()
+            for kind, sync in (('saved_tracks', sync_saved_tracks), ('playlists', sync_playlists)):
+                if missing:
+                    logger.info("Skipping library sync of %s for user %s: missing scopes %s",
+                                kind, user_id, ' '.join(sorted(missing)))
+                    self._record(user_id, kind, 'needs_consent', NEEDS_CONSENT_ERROR)
+                    continue
+                try:
+                    sp = get_client()
+                    if sp is None:
+                        raise RuntimeError("Failed to create Spotify client")
+                    sync(sp, user_id, full=full, concurrency=self.concurrency)
+                except Exception as exc:
+                    db.session.rollback()
+                    if getattr(exc, 'http_status', None) == 403:
+                        logger.warning("Library sync of %s refused by Spotify for user %s: %s", kind, user_id, exc)
+                        self._record(user_id, kind, 'needs_consent', NEEDS_CONSENT_ERROR)
+                        continue
+                    logger.exception("Library sync of %s failed for user %s", kind, user_id)
+                    self._record(user_id, kind, 'failed', str(exc)[:500])
+
+    @staticmethod
+    def _record(user_id, kind, status, error):
+        state = _state(user_id, kind)
+        state.status = status
+        state.error = error
+        db.session.commit()
+
+
+def sync_states(user_id):
+    return [state.to_dict() for state in SyncState.query.filter_by(user_id=user_id).order_by(SyncState.kind)]
+
+
+def _encode_cursor(saved):
+    raw = f"{to_millis(saved.added_at)}|{saved.track_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    """Return (added_at, track_id) from a cursor. Raises ValueError if malformed."""
+    try:
+        millis, track_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromtimestamp(int(millis) / 1000, timezone.utc).replace(tzinfo=None), track_id
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+def _tracks_by_id(track_ids):
+    track_ids = [track_id for track_id in set(track_ids) if track_id]
+    if not track_ids:
+        return {}
+    return {
+        row.id: row.data for row in
+        SpotifyItem.query.filter(SpotifyItem.item_type == 'tracks', SpotifyItem.id.in_(track_ids))
+    }
+
+
+def load_saved_tracks(user_id, limit, cursor=None):
+    """One page of saved tracks, newest first, with an opaque `next_cursor`."""
+    query = SavedTrack.query.filter_by(user_id=user_id)
+    if cursor:
+        added_at, track_id = _decode_cursor(cursor)
+        query = query.filter(or_(
+            SavedTrack.added_at < added_at,
+            and_(SavedTrack.added_at == added_at, SavedTrack.track_id < track_id),
+        ))
+    rows = query.order_by(SavedTrack.added_at.desc(), SavedTrack.track_id.desc()).limit(limit + 1).all()
+    page = rows[:limit]
+    tracks = _tracks_by_id(row.track_id for row in page)
+    return {
+        'items': [
+            {'added_at': row.added_at.isoformat() + 'Z', 'track': tracks.get(row.track_id, {'id': row.track_id})}
+            for row in page
+        ],
+        'next_cursor': _encode_cursor(page[-1]) if len(rows) > limit else None,
+    }
+
+
+def load_playlists(user_id):
+    rows = (
+        db.session.query(Playlist)
+        .join(UserPlaylist, UserPlaylist.playlist_id == Playlist.id)
+        .filter(UserPlaylist.user_id == user_id)
+        .order_by(UserPlaylist.position)
+    )
+    return {'items': [playlist.to_dict() for playlist in rows]}
+
+
+def load_playlist_tracks(user_id, playlist_id, limit, after=None):
+    """One page of a playlist's stored tracks after position `after`, or None if
+    the playlist isn't in the user's library."""
+    if db.session.get(UserPlaylist, (user_id, playlist_id)) is None:
+        return None
+    version = db.session.query(Playlist.tracks_version).filter_by(id=playlist_id).scalar()
+    query = PlaylistTrack.query.filter_by(playlist_id=playlist_id, version=version)
+    if after is not None:
+        query = query.filter(PlaylistTrack.position > after)
+    rows = query.order_by(PlaylistTrack.position).limit(limit + 1).all()
+    page = rows[:limit]
+    tracks = _tracks_by_id(row.track_id for row in page)
+    return {
+        'items': [
+            {
+                'position': row.position,
+                'added_at': row.added_at.isoformat() + 'Z' if row.added_at else None,
+                'track': tracks.get(row.track_id, {'id': row.track_id}) if row.track_id else None,
+            }
+            for row in page
+        ],
+        'next_after': page[-1].position if len(rows) > limit else None,
+    }
+
+
+library_sync = LibrarySync()
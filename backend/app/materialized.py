@@ -0,0 +1,241 @@
+"""
+Materialized insights in `user_insights`, one row per (user, time_range).
+
+Rows are never recomputed from the full history on a read. Instead:
+
+- every top artists/tracks snapshot written by `SnapshotWriter` calls
+  `apply_snapshot()` in the same transaction, which replaces that time range's
+  top genres, top albums and decades and diffs the new ranking against the
+  previous one to produce rank deltas, and replaces the user's postings in
+  the compare index (app/compare.py);
+- every batch of plays stored by `ingest_recent_plays` calls `apply_plays()`,
+  which adds the batch's counts to the `all` row's listening slots, album and
+  decade tallies. The album tally keeps the `ALBUM_TALLY_SIZE` most played
+  albums; `album_tail` records the highest count dropped from it, which bounds
+  how far a dropped album that is played again is undercounted.
+
+Reads (`load_summary`) are a primary-key lookup. `rebuild()` recomputes a
+user's rows from stored snapshots and plays, for backfills (`flask rebuild-insights`).
+"""
+import heapq
+
+import numpy as np
+
+from app.analytics import EPOCH_WEEKDAY, WEEKDAYS, TrackFrame, compute_genre_distribution, decade_histogram, top_albums
+from app.compare import index_snapshot
+from database.compaction import compact_item, rehydrate
+from database.models import db, Play, UserInsights, UserItem, UserStats
+
+PLAYS_RANGE = 'all'  # time_range of the row maintained from plays
+SLOT_MINUTES = 15  # fine enough to shift by any real UTC offset
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+SLOTS_PER_WEEK = 7 * SLOTS_PER_DAY
+MAX_ALBUMS = 50
+ALBUM_TALLY_SIZE = 1000  # albums kept in `album_plays`; trimmed once it holds twice that
+REBUILD_BATCH_SIZE = 5000
+
+
+def _get_row(user_id, time_range):
+    """Lock (or create) the insights row for an incremental update. Caller commits."""
+    row = (
+        UserInsights.query
+        .filter_by(user_id=user_id, time_range=time_range)
+        .with_for_update()
+        .populate_existing()
+        .first()
+    )
+    if row is None:
+        row = UserInsights(user_id, time_range)
+        db.session.add(row)
+    return row
+
+
+def rank_deltas(previous_ids, items):
+    """Compare a ranking with the previous one. `change` is positive when an item moved up."""
+    previous = {item_id: rank for rank, item_id in enumerate(previous_ids or [], 1)}
+    deltas = []
+    for rank, item in enumerate(items, 1):
+        previous_rank = previous.get(item.get('id'))
+        deltas.append({
+            'id': item.get('id'),
+            'name': item.get('name'),
+            'rank': rank,
+            'previous_rank': previous_rank,
+            'change': previous_rank - rank if previous_rank is not None else None,
+        })
+    return deltas
+
+
+def _most_played(album_plays, n):
+    """The `n` most played (album_id, count) pairs, ties broken by id."""
+    return heapq.nsmallest(n, album_plays.items(), key=lambda entry: (-entry[1], entry[0]))
+
+
+def _decades(decades, counts):
+    return [{'decade': int(decade), 'count': int(count)} for decade, count in zip(decades, counts)]
+
+
+def apply_snapshot(user_id, data_type, time_range, payload):
+    """Update a time range's row from a new top artists/tracks payload. Caller commits."""
+    if data_type not in ('artists', 'tracks'):
+        return
+    items = [item for item in payload.get('items', []) if item and item.get('id')]
+    ids = [item['id'] for item in items]
+    row = _get_row(user_id, time_range)
+
+    if data_type == 'artists':
+        row.top_genres = compute_genre_distribution({'items': items}, len(items))
+        row.artist_deltas = rank_deltas(row.artist_ids, items)
+        row.artist_ids = ids
+        index_snapshot(user_id, data_type, time_range, items, genres=row.top_genres)
+    else:
+        # higher-ranked tracks contribute more
+        tracks = {item['id']: compact_item('tracks', item) for item in items}
+        frame = TrackFrame(ids, np.arange(len(ids), 0, -1), tracks=tracks)
+        row.top_albums = [{**frame.albums[album_id], 'count': count}
+                          for album_id, count in top_albums(frame, MAX_ALBUMS)]
+        row.decades = _decades(*decade_histogram(frame))
+        row.track_deltas = rank_deltas(row.track_ids, items)
+        row.track_ids = ids
+        index_snapshot(user_id, data_type, time_range, items)
+
+
+def slot_of_week(played_at):
+    """UTC 15-minute slot of the week (Monday 00:00 = 0) for a datetime64 array."""
+    minutes = played_at.astype('datetime64[m]').astype(np.int64)
+    weekday = (minutes // (24 * 60) + EPOCH_WEEKDAY) % 7
+    return weekday * SLOTS_PER_DAY + (minutes % (24 * 60)) // SLOT_MINUTES
+
+
+def apply_plays(user_id, plays, tracks=None):
+    """Add a batch of newly stored plays to the user's `all` row. Caller commits.
+
+    `tracks` maps track id -> track object for the batch; missing metadata is
+    looked up in `spotify_items`.
+    """
+    if not plays:
+        return
+    if tracks is not None:
+        tracks = {track_id: compact_item('tracks', track) for track_id, track in tracks.items()}
+    played_at = np.array([play.played_at for play in plays], dtype='datetime64[s]')
+    frame = TrackFrame([play.track_id for play in plays], np.ones(len(plays), dtype=np.int64),
+                       played_at=played_at, tracks=tracks)
+    row = _get_row(user_id, PLAYS_RANGE)
+
+    slots = np.bincount(slot_of_week(played_at), minlength=SLOTS_PER_WEEK)
+    if row.listening_slots:
+        slots = slots + np.asarray(row.listening_slots, dtype=np.int64)
+    row.listening_slots = slots.tolist()
+
+    album_plays = dict(row.album_plays or {})
+    for album_id, count in top_albums(frame, None):
+        album_plays[album_id] = album_plays.get(album_id, 0) + count
+    if len(album_plays) > 2 * ALBUM_TALLY_SIZE:
+        kept = _most_played(album_plays, ALBUM_TALLY_SIZE + 1)
+        row.album_tail = max(row.album_tail or 0, kept.pop()[1])
+        album_plays = dict(kept)
+    row.album_plays = album_plays
+
+    # Only albums in this batch changed count, so any album entering the top list
+    # is in the batch and its metadata is at hand
+    metadata = {album['id']: album for album in row.top_albums or []}
+    metadata.update(frame.albums)
+    row.top_albums = [{**metadata.get(album_id, {'id': album_id}), 'count': count}
+                      for album_id, count in _most_played(album_plays, MAX_ALBUMS)]
+
+    decades = {entry['decade']: entry['count'] for entry in row.decades or []}
+    for decade, count in zip(*decade_histogram(frame)):
+        decades[int(decade)] = decades.get(int(decade), 0) + int(count)
+    row.decades = [{'decade': decade, 'count': decades[decade]} for decade in sorted(decades)]
+
+    row.play_count = (row.play_count or 0) + len(plays)
+    latest = max(play.played_at for play in plays)
+    row.last_played_at = max(row.last_played_at, latest) if row.last_played_at else latest
+
+
+def listening_histograms(slots, tz_offset=0):
+    """Hour-of-day and day-of-week counts from UTC slots, shifted to `tz_offset` minutes east of UTC."""
+    local = np.roll(np.asarray(slots, dtype=np.int64), int(round(tz_offset / SLOT_MINUTES)))
+    hours = local.reshape(7, 24, SLOTS_PER_DAY // 24).sum(axis=(0, 2))
+    weekdays = local.reshape(7, SLOTS_PER_DAY).sum(axis=1)
+    return hours, weekdays
+
+
+def load_listening(user_id):
+    """The user's plays row, or None if no plays have been ingested."""
+    return db.session.get(UserInsights, (user_id, PLAYS_RANGE))
+
+
+def load_summary(user_id, time_range, tz_offset=0):
+    """Everything materialized for a time range plus the listening habits, in one indexed read."""
+    rows = {
+        row.time_range: row
+        for row in UserInsights.query.filter(
+            UserInsights.user_id == user_id,
+            UserInsights.time_range.in_((time_range, PLAYS_RANGE)),
+        )
+    }
+    top = rows.get(time_range)
+    plays = rows.get(PLAYS_RANGE)
+
+    listening = None
+    if plays is not None and plays.listening_slots:
+        hours, weekdays = listening_histograms(plays.listening_slots, tz_offset)
+        listening = {
+            'hours': [{'hour': hour, 'count': int(count)} for hour, count in enumerate(hours)],
+            'weekdays': [{'day': day, 'count': int(count)} for day, count in zip(WEEKDAYS, weekdays)],
+            'top_albums': plays.top_albums or [],
+            'decades': plays.decades or [],
+            'play_count': plays.play_count,
+            'last_played_at': plays.last_played_at.isoformat() if plays.last_played_at else None,
+        }
+
+    updated = [row.updated_at for row in rows.values() if row.updated_at]
+    return {
+        'time_range': time_range,
+        'top_genres': top.top_genres if top else None,
+        'top_albums': top.top_albums if top else None,
+        'decades': top.decades if top else None,
+        'artist_deltas': top.artist_deltas if top else None,
+        'track_deltas': top.track_deltas if top else None,
+        'listening': listening,
+        'updated_at': max(updated).isoformat() if updated else None,
+    }
+
+
+def rebuild(user_id):
+    """Recompute a user's rows from stored snapshots and plays. Caller commits."""
+    UserInsights.query.filter_by(user_id=user_id).delete()
+    UserItem.query.filter_by(user_id=user_id).delete()
+
+    # Replay the two newest snapshots per key so rank deltas are restored too
+    for data_type in ('artists', 'tracks'):
+        time_ranges = [tr for (tr,) in db.session.query(UserStats.time_range).filter_by(
+            user_id=user_id, data_type=data_type).distinct()]
+        for time_range in time_ranges:
+            snapshots = (
+                UserStats.query
+                .filter_by(user_id=user_id, data_type=data_type, time_range=time_range)
+                .order_by(UserStats.created_at.desc())
+                .limit(2)
+                .all()
+            )
+            payloads = rehydrate(snapshots)
+            for snapshot in reversed(snapshots):
+                apply_snapshot(user_id, data_type, time_range, payloads[snapshot.id])
+                db.session.flush()
+
+    last_id = 0
+    while True:
+        batch = (
+            Play.query
+            .filter(Play.user_id == user_id, Play.id > last_id)
+            .order_by(Play.id)
+            .limit(REBUILD_BATCH_SIZE)
+            .all()
+        )
+        if not batch:
+            break
+        apply_plays(user_id, batch)
+        db.session.flush()
+        last_id = batch[-1].id
@@ -0,0 +1,182 @@
+"""
+Prometheus instrumentation, served at `/metrics`.
+
+- Every request: latency by endpoint, method and status, plus how many SQL
+  queries it ran and how long they took.
+- Every SQL query (requests and background threads alike): count and duration,
+  via SQLAlchemy engine events.
+- Every HTTP call to Spotify: latency by normalised path and status, via a
+  response hook on the shared session in app/spotify.py. Latency is time to
+  response headers, as measured by requests.
+- Token refreshes and decryption, response/token/audio-features cache lookups,
+  and upstream coalescing and throttling, counted where they happen.
+
+Metrics are per process unless `PROMETHEUS_MULTIPROC_DIR` is set (gunicorn.conf.py
+prepares it), in which case `/metrics` aggregates every worker's files.
+
+With `PROFILE_SAMPLE_RATE` > 0 that fraction of requests also runs under cProfile;
+the profile is written to `PROFILE_DIR` if set, otherwise its top functions are logged.
+cProfile follows the OS thread, which gevent greenlets share, so a sampled request
+would also be charged for every other request the worker switched to; profiling
+is skipped when gevent has patched the process.
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import time
+from urllib.parse import urlsplit
+
+from flask import Response, g, has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+REQUEST_LATENCY = Histogram(
+    'statify_http_request_duration_seconds', 'Request latency', ('endpoint', 'method', 'status'),
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_QUERIES = Histogram(
+    'statify_http_request_db_queries', 'SQL queries per request', ('endpoint',),
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 250),
+)
+REQUEST_DB_TIME = Histogram(
+    'statify_http_request_db_seconds', 'Time spent in SQL per request', ('endpoint',),
+    buckets=LATENCY_BUCKETS,
+)
+DB_QUERIES = Counter('statify_db_queries_total', 'SQL queries executed')
+DB_QUERY_LATENCY = Histogram('statify_db_query_duration_seconds', 'SQL query latency', buckets=QUERY_BUCKETS)
+SPOTIFY_LATENCY = Histogram(
+    'statify_spotify_request_duration_seconds', 'Spotify HTTP call latency', ('host', 'path', 'status'),
+    buckets=LATENCY_BUCKETS,
+)
+SPOTIFY_COALESCED = Counter('statify_spotify_coalesced_total', 'Spotify calls served by an identical in-flight call')
+SPOTIFY_THROTTLED = Counter('statify_spotify_throttled_total', 'Spotify 429 responses')
+TOKEN_REFRESHES = Counter('statify_token_refreshes_total', 'Access token refreshes', ('outcome',))
+TOKEN_DECRYPT = Histogram('statify_token_decrypt_seconds', 'Decrypting an access token', buckets=QUERY_BUCKETS)
+CACHE_LOOKUPS = Counter('statify_cache_lookups_total', 'Cache lookups', ('cache', 'result'))
+
+# Path segments following these are Spotify ids, collapsed to keep label cardinality bounded
+_ID_PARENTS = {'users', 'playlists', 'artists', 'albums', 'tracks', 'shows', 'episodes',
+               'audio-features', 'audio-analysis'}
+_VERSION = re.compile(r'^v\d+$')
+
+
+def spotify_path(url):
+    """/v1/playlists/37i9dQZF1DXcBWIGoYBM5M/tracks -> /v1/playlists/{id}/tracks"""
+    segments = urlsplit(url).path.split('/')
+    for i in range(1, len(segments)):
+        if segments[i - 1] in _ID_PARENTS and segments[i] and not _VERSION.match(segments[i]):
+            segments[i] = '{id}'
+    return '/'.join(segments)
+
+
+def record_spotify_response(response, *args, **kwargs):
+    """requests response hook for the shared Spotify session."""
+    SPOTIFY_LATENCY.labels(
+        host=urlsplit(response.url).hostname or '-',
+        path=spotify_path(response.url),
+        status=str(response.status_code),
+    ).observe(response.elapsed.total_seconds())
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    DB_QUERIES.inc()
+    DB_QUERY_LATENCY.observe(elapsed)
+    if has_request_context() and 'metrics_started' in g:
+        g.db_queries += 1
+        g.db_seconds += elapsed
+
+
+def _greenlets():
+    """True once gevent has patched threading, i.e. requests share one OS thread."""
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('threading')
+
+
+class Metrics:
+    """Request hooks, the sampled profiler and the /metrics view."""
+
+    def __init__(self):
+        self.profile_sample_rate = 0.0
+        self.profile_dir = None
+        self.token = None
+
+    def init_app(self, app):
+        self.profile_sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0.0)
+        self.profile_dir = app.config.get('PROFILE_DIR')
+        self.token = app.config.get('METRICS_TOKEN')
+        if self.profile_sample_rate and _greenlets():
+            logger.warning("PROFILE_SAMPLE_RATE ignored: cProfile can't separate gevent greenlets")
+            self.profile_sample_rate = 0.0
+        if self.profile_dir:
+            os.makedirs(self.profile_dir, exist_ok=True)
+
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+        app.extensions['metrics'] = self
+
+    def _start(self):
+        g.metrics_started = time.perf_counter()
+        g.db_queries = 0
+        g.db_seconds = 0.0
+        if self.profile_sample_rate and random.random() < self.profile_sample_rate:
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    def _finish(self, response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        elapsed = time.perf_counter() - started
+        REQUEST_LATENCY.labels(endpoint, request.method, str(response.status_code)).observe(elapsed)
+        REQUEST_QUERIES.labels(endpoint).observe(g.db_queries)
+        REQUEST_DB_TIME.labels(endpoint).observe(g.db_seconds)
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            self._report(profiler, endpoint, elapsed)
+        return response
+
+    def _report(self, profiler, endpoint, elapsed):
+        if self.profile_dir:
+            name = f"{endpoint}-{int(time.time() * 1000)}-{os.getpid()}.prof"
+            profiler.dump_stats(os.path.join(self.profile_dir, name))
+            return
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(25)
+        logger.info("Profile of %s %s (%.1f ms):\n%s", request.method, request.path, elapsed * 1000, out.getvalue())
+
+    def view(self):
+        """Prometheus text exposition of this process' (or, in multiprocess mode, every worker's) metrics"""
+        if self.token and request.headers.get('Authorization') != f"Bearer {self.token}":
+            return Response("Unauthorized\n", status=401, content_type='text/plain')
+        registry = REGISTRY
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+metrics = Metrics()
@@ -0,0 +1,189 @@
+"""
+Rate-limit storage backends for flask-limiter, selected by `RATELIMIT_STORAGE_URI`.
+
+- ``memory://``: per process (each gunicorn worker counts separately).
+- ``sqlite:///path/to/file.db``: one counter table shared by every worker on
+  the host (stdlib sqlite3 in WAL mode, no extra service).
+- ``redis://host:port``: limits' own Redis storage, shared across hosts
+  (needs the optional ``redis`` package).
+
+Prefixing any of them with ``batched+`` (e.g. ``batched+sqlite:///...``) keeps
+a local tally per fixed window and only syncs it with the shared store every
+`sync_interval` seconds (`RATELIMIT_STORAGE_OPTIONS`), so most checks never
+leave the process. The first hit on a key in each window always syncs. The
+trade-off is that a limit may be overshot by what other workers count between
+syncs.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from limits.storage import Storage, storage_from_string
+
+SWEEP_INTERVAL = 60  # seconds between purges of expired counters
+
+
+class SQLiteStorage(Storage):
+    """Fixed-window counters in a local SQLite file."""
+
+    STORAGE_SCHEME = ['sqlite']
+
+    def __init__(self, uri, wrap_exceptions=False, timeout=5, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        # sqlite:///relative.db or sqlite:////absolute.db, as in SQLAlchemy URLs
+        self.path = uri.split('://', 1)[1][1:] or ':memory:'
+        self.timeout = float(timeout)
+        self._connection = None
+        self._pid = None
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _execute(self, sql, params=()):
+        # One connection per process (connections don't survive fork()); queries are
+        # microseconds, so serialising them is cheaper than a connection per thread
+        with self._lock:
+            if self._connection is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._connection = sqlite3.connect(
+                    self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False
+                )
+                self._connection.execute('PRAGMA journal_mode=WAL')
+                self._connection.execute(
+                    'CREATE TABLE IF NOT EXISTS ratelimit '
+                    '(key TEXT PRIMARY KEY, count INTEGER NOT NULL, expiry REAL NOT NULL)'
+                )
+            return self._connection.execute(sql, params).fetchall()
+
+    def incr(self, key, expiry, amount=1):
+        now = time.time()
+        if now >= self._next_sweep:
+            self._next_sweep = now + SWEEP_INTERVAL
+            self._execute('DELETE FROM ratelimit WHERE expiry <= ?', (now,))
+        rows = self._execute(
+            'INSERT INTO ratelimit (key, count, expiry) VALUES (:key, :amount, :expiry) '
+            'ON CONFLICT(key) DO UPDATE SET '
+            'count = CASE WHEN expiry <= :now THEN :amount ELSE count + :amount END, '
+            'expiry = CASE WHEN expiry <= :now THEN :expiry ELSE expiry END '
+            'RETURNING count',
+            {'key': key, 'amount': amount, 'expiry': now + expiry, 'now': now},
+        )
+        return rows[0][0]
+
+    def get(self, key):
+        rows = self._execute('SELECT count FROM ratelimit WHERE key = ? AND expiry > ?', (key, time.time()))
+        return rows[0][0] if rows else 0
+
+    def get_expiry(self, key):
+        now = time.time()
+        rows = self._execute('SELECT expiry FROM ratelimit WHERE key = ? AND expiry > ?', (key, now))
+        return rows[0][0] if rows else now
+
+    def check(self):
+        try:
+            self._execute('SELECT 1')
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        count = self._execute('SELECT COUNT(*) FROM ratelimit')[0][0]
+        self._execute('DELETE FROM ratelimit')
+        return count
+
+    def clear(self, key):
+        self._execute('DELETE FROM ratelimit WHERE key = ?', (key,))
+
+
+class _Window:
+    __slots__ = ('shared', 'pending', 'expires_at', 'synced_at')
+
+    def __init__(self, expires_at):
+        self.shared = 0  # count in the shared store as of the last sync
+        self.pending = 0  # hits counted here since then
+        self.expires_at = expires_at
+        self.synced_at = 0.0
+
+
+class BatchedStorage(Storage):
+    """Counts hits locally per fixed window and syncs them to another storage periodically."""
+
+    STORAGE_SCHEME = ['batched+memory', 'batched+sqlite', 'batched+redis', 'batched+rediss']
+
+    def __init__(self, uri, wrap_exceptions=False, sync_interval=1.0, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.storage = storage_from_string(uri.split('+', 1)[1], wrap_exceptions=wrap_exceptions, **options)
+        self.sync_interval = float(sync_interval)
+        self._windows = {}
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def base_exceptions(self):
+        return self.storage.base_exceptions
+
+    def _window(self, key, expiry, now):
+        """The key's current local window, starting a new one if it ended. Caller holds the lock."""
+        if now >= self._next_sweep:
+            self._next_sweep = now + SWEEP_INTERVAL
+            for stale in [k for k, window in self._windows.items() if window.expires_at <= now]:
+                del self._windows[stale]
+        window = self._windows.get(key)
+        if window is None or window.expires_at <= now:
+            window = self._windows[key] = _Window(now + expiry)
+        return window
+
+    def incr(self, key, expiry, amount=1):
+        now = time.time()
+        with self._lock:
+            window = self._window(key, expiry, now)
+            window.pending += amount
+            if now - window.synced_at < self.sync_interval:
+                return window.shared + window.pending
+            flushed, window.pending = window.pending, 0
+            window.synced_at = now
+
+        try:
+            shared = self.storage.incr(key, expiry, amount=flushed)
+            expires_at = self.storage.get_expiry(key)
+        except Exception:
+            with self._lock:
+                window.pending += flushed  # try again on the next sync
+            raise
+        with self._lock:
+            window.shared = shared
+            window.expires_at = expires_at
+            return window.shared + window.pending
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None and window.expires_at > now and now - window.synced_at < self.sync_interval:
+                return window.shared + window.pending
+            pending = window.pending if window is not None and window.expires_at > now else 0
+        return self.storage.get(key) + pending
+
+    def get_expiry(self, key):
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None and window.expires_at > time.time():
+                return window.expires_at
+        return self.storage.get_expiry(key)
+
+    def check(self):
+        return self.storage.check()
+
+    def reset(self):
+        with self._lock:
+            self._windows.clear()
+        return self.storage.reset()
+
+    def clear(self, key):
+        with self._lock:
+            self._windows.pop(key, None)
+        self.storage.clear(key)
@@ -0,0 +1,188 @@
+"""
+Snapshot policy for `user_stats` rows.
+
+Snapshots are only worth keeping when something changed, so `record()` drops a
+snapshot if its content hash matches the previous one for the same
+(user, data_type, time_range), or if that key was already snapshotted within
+`SNAPSHOT_MIN_INTERVAL` seconds. The last hash is remembered for the
+`SNAPSHOT_DEDUPE_KEYS` most recently snapshotted keys, once its write has
+committed. That in-process check only saves work: the writer applies the same
+policy against the newest stored row, so other workers' snapshots count too.
+Accepted snapshots are queued and written in
+batches by a background thread, keeping the commit off the request path. Each
+written snapshot also updates the materialized `user_insights` row for its time
+range in the same transaction.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from app.background import BackgroundThread
+from app.materialized import apply_snapshot
+from database.compaction import COMPACT_TYPES, compact_snapshot
+from database.models import db, UserStats
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(data):
+    """Stable SHA-256 of a JSON-serialisable payload."""
+    encoded = json.dumps(data, sort_keys=True, separators=(',', ':')).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class SnapshotWriter:
+    """Deduplicating, batched writer for `UserStats` snapshots."""
+
+    def __init__(self):
+        self.app = None
+        self.min_interval = 6 * 60 * 60
+        self.batch_size = 100
+        self.flush_interval = 2.0
+        self.synchronous = False
+        self.written = 0
+        self.skipped = 0
+        self.max_keys = 100000
+        self._queue = queue.Queue()
+        self._last = OrderedDict()  # (user_id, data_type, time_range) -> (hash, monotonic time), LRU
+        self._atexit_registered = False
+        self._lock = threading.Lock()
+        self._thread = BackgroundThread(self._run, 'snapshot-writer')
+
+    def init_app(self, app):
+        self.app = app
+        self.min_interval = app.config.get('SNAPSHOT_MIN_INTERVAL', self.min_interval)
+        self.batch_size = app.config.get('SNAPSHOT_BATCH_SIZE', self.batch_size)
+        self.flush_interval = app.config.get('SNAPSHOT_FLUSH_INTERVAL', self.flush_interval)
+        self.synchronous = app.config.get('SNAPSHOT_SYNCHRONOUS', False)
+        self.max_keys = app.config.get('SNAPSHOT_DEDUPE_KEYS', self.max_keys)
+        app.extensions['snapshot_writer'] = self
+        if not self._atexit_registered:
+            # One instance serves every app created in the process; flush it once
+            atexit.register(self.flush)
+            self._atexit_registered = True
+
+    def record(self, user_id, data_type, time_range, data):
+        """Queue a snapshot unless the policy says it is redundant. Returns True if queued."""
+        digest = content_hash(data)
+        key = (user_id, data_type, time_range)
+        now = time.monotonic()
+
+        with self._lock:
+            last = self._last.get(key)
+            if last and (last[0] == digest or now - last[1] < self.min_interval):
+                self._last.move_to_end(key)
+                self.skipped += 1
+                return False
+
+        snapshot = (user_id, data_type, time_range, data, digest)
+        if self.synchronous:
+            self._write([snapshot])
+        else:
+            self._thread.ensure_running()
+            self._queue.put(snapshot)
+        return True
+
+    def flush(self):
+        """Write everything queued so far on the calling thread."""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write(batch)
+
+    def _remember(self, stored):
+        """Record {key: (hash, created_at or None for now)} of committed snapshots."""
+        now = time.monotonic()
+        utcnow = datetime.utcnow()
+        with self._lock:
+            for key, (digest, created_at) in stored.items():
+                age = (utcnow - created_at).total_seconds() if created_at else 0
+                self._last[key] = (digest, now - max(age, 0))
+                self._last.move_to_end(key)
+            while len(self._last) > self.max_keys:
+                self._last.popitem(last=False)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception:
+                logger.exception("Failed to write %d stats snapshots", len(batch))
+
+    def _write(self, batch, retry=True):
+        # Keep only the newest snapshot per key within the batch
+        latest = {}
+        for user_id, data_type, time_range, data, digest in batch:
+            latest[(user_id, data_type, time_range)] = (data, digest)
+
+        stored = {}
+        with self.app.app_context():
+            try:
+                window_start = datetime.utcnow() - timedelta(seconds=self.min_interval)
+                for key, (data, digest) in latest.items():
+                    user_id, data_type, time_range = key
+                    # Another worker may have stored the same content, or any snapshot, within the window
+                    previous = (
+                        db.session.query(UserStats.content_hash, UserStats.created_at)
+                        .filter_by(user_id=user_id, data_type=data_type, time_range=time_range)
+                        .order_by(UserStats.created_at.desc())
+                        .first()
+                    )
+                    if previous is not None and (
+                        previous.content_hash == digest
+                        or (previous.created_at is not None and previous.created_at >= window_start)
+                    ):
+                        stored[key] = (previous.content_hash, previous.created_at)
+                        self.skipped += 1
+                        continue
+                    snapshot = UserStats(
+                        user_id=user_id,
+                        time_range=time_range,
+                        data_type=data_type,
+                        data=data,
+                        content_hash=digest,
+                    )
+                    if data_type in COMPACT_TYPES:
+                        compact_snapshot(snapshot)
+                    db.session.add(snapshot)
+                    apply_snapshot(user_id, data_type, time_range, data)
+                    stored[key] = (digest, None)
+                    self.written += 1
+                db.session.commit()
+            except IntegrityError:
+                # Another worker inserted one of the same spotify_items (or the
+                # same user_insights row) first; retrying sees its row and
+                # updates instead of inserting.
+                db.session.rollback()
+                if retry:
+                    return self._write(batch, retry=False)
+                raise
+            except Exception:
+                db.session.rollback()
+                raise
+        self._remember(stored)
+
+
+snapshot_writer = SnapshotWriter()
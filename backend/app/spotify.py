@@ -0,0 +1,144 @@
+"""
+Shared HTTP plumbing for Spotify API and OAuth clients.
+
+All spotipy clients in a process share one `requests.Session`, so TCP/TLS
+connections to api.spotify.com and accounts.spotify.com are kept alive and
+reused across requests instead of being re-established every time. Per-user
+clients are thin wrappers that only carry the user's access token.
+
+spotipy and requests (which pulls in redis through spotipy) are the slowest
+imports in the app, so they are imported on first use rather than at boot.
+"""
+import functools
+import threading
+
+from flask import current_app
+
+from app.metrics import record_spotify_response
+
+OAUTH_SCOPE = (
+    "user-read-email user-read-private user-top-read user-read-recently-played "
+    "user-library-read playlist-read-private playlist-read-collaborative"
+)
+# Needed by library sync; tokens granted before they were requested lack them
+LIBRARY_SCOPES = frozenset({"user-library-read", "playlist-read-private", "playlist-read-collaborative"})
+
+_session = None
+_oauth = None
+_lock = threading.Lock()
+
+
+@functools.cache
+def _null_cache_handler():
+    from spotipy.cache_handler import CacheHandler
+
+    class NullCacheHandler(CacheHandler):
+        """Token cache that stores nothing.
+
+        The shared SpotifyOAuth serves every user, so it must never hand one user's
+        cached token to another — and tokens should not be written to disk either.
+        """
+
+        def get_cached_token(self):
+            return None
+
+        def save_token_to_cache(self, token_info):
+            pass
+
+    return NullCacheHandler()
+
+
+@functools.cache
+def _client_class():
+    import spotipy
+
+    class PooledSpotify(spotipy.Spotify):
+        """spotipy client that leaves the shared session open when garbage collected."""
+
+        def __del__(self):
+            # spotipy closes its session here, which would drop every pooled
+            # connection each time a per-request client goes away
+            pass
+
+    return PooledSpotify
+
+
+def get_http_session():
+    """Return the process-wide pooled session, creating it on first use."""
+    global _session
+    if _session is not None:
+        return _session
+
+    with _lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            config = current_app.config
+            retry = Retry(
+                total=config.get('SPOTIFY_HTTP_RETRIES', 2),
+                backoff_factor=config.get('SPOTIFY_HTTP_BACKOFF', 0.3),
+                status_forcelist=(500, 502, 503, 504),
+                allowed_methods=frozenset(['GET']),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=config.get('SPOTIFY_HTTP_POOL_CONNECTIONS', 4),
+                pool_maxsize=config.get('SPOTIFY_HTTP_POOL_MAXSIZE', 32),
+                max_retries=retry,
+            )
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.hooks['response'].append(record_spotify_response)
+            _session = session
+    return _session
+
+
+def make_client(access_token):
+    """Build a per-user Spotify client on top of the shared session."""
+    client = _client_class()(
+        auth=access_token,
+        requests_session=get_http_session(),
+        requests_timeout=current_app.config.get('SPOTIFY_HTTP_TIMEOUT', 5),
+    )
+    prefix = current_app.config.get('SPOTIFY_API_PREFIX')
+    if prefix:
+        client.prefix = prefix
+    return client
+
+
+def get_spotify_oauth():
+    """Return the process-wide SpotifyOAuth helper."""
+    global _oauth
+    if _oauth is not None:
+        return _oauth
+
+    session = get_http_session()
+    from spotipy.oauth2 import SpotifyOAuth
+
+    with _lock:
+        if _oauth is None:
+            _oauth = SpotifyOAuth(
+                client_id=current_app.config["SPOTIFY_CLIENT_ID"],
+                client_secret=current_app.config["SPOTIFY_CLIENT_SECRET"],
+                redirect_uri=current_app.config["SPOTIFY_REDIRECT_URI"],
+                scope=OAUTH_SCOPE,
+                show_dialog=True,
+                cache_handler=_null_cache_handler(),
+                requests_session=session,
+                requests_timeout=current_app.config.get('SPOTIFY_HTTP_TIMEOUT', 5),
+            )
+    return _oauth
+
+
+def missing_scopes(granted, required):
+    """Scopes in `required` that the space-separated `granted` string lacks.
+
+    `granted` is None for tokens stored before scopes were recorded, which are
+    not known to lack anything.
+    """
+    if granted is None:
+        return set()
+    return set(required) - set(granted.split())
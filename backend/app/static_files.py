@@ -0,0 +1,129 @@
+"""
+Serving the React build from `app/static`.
+
+The build directory is indexed once at startup (`static_files.init_app`), so a
+request is a dict lookup rather than filesystem probes. For each file the index
+keeps its MIME type, a content hash used as the ETag and any precompressed
+siblings (`<file>.br`, `<file>.gz`, written by `flask compress-static`), which
+are sent as-is to clients that accept them.
+
+Vite puts a content hash in the names of the files it emits under `assets/`
+(`assets/index-B6dLNWjt.js`), so those are cached for a year as immutable. Files
+copied from `public/` keep their own names and are never treated as hashed. Everything else, `index.html` in
+particular, must be revalidated so a deploy is picked up immediately; the ETag
+makes that a 304.
+"""
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+
+from flask import request, send_file
+
+logger = logging.getLogger(__name__)
+
+HASHED_NAME = re.compile(r'^assets/(?:[^/]+/)*[^/]+-[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$')  # build-relative path
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))  # in order of preference
+COMPRESSIBLE = {'.js', '.css', '.html', '.json', '.svg', '.txt', '.map', '.xml', '.ico', '.webmanifest'}
+
+
+class StaticFile:
+    __slots__ = ('path', 'mimetype', 'etag', 'mtime', 'hashed', 'variants')
+
+    def __init__(self, path, hashed):
+        self.path = path
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.mtime = os.path.getmtime(path)
+        self.hashed = hashed
+        with open(path, 'rb') as f:
+            self.etag = hashlib.md5(f.read(), usedforsecurity=False).hexdigest()
+        self.variants = {
+            encoding: path + suffix
+            for encoding, suffix in ENCODINGS
+            if os.path.isfile(path + suffix) and os.path.getmtime(path + suffix) >= self.mtime
+        }
+
+
+class StaticFiles:
+    """Startup index of the frontend build plus the view that serves it."""
+
+    def __init__(self):
+        self.root = None
+        self.files = {}
+
+    def init_app(self, app):
+        self.root = app.static_folder
+        self.index()
+        app.extensions['static_files'] = self
+
+    def index(self):
+        """(Re)build the index of servable files under the static folder."""
+        files = {}
+        if self.root and os.path.isdir(self.root):
+            for directory, _, names in os.walk(self.root):
+                for name in names:
+                    path = os.path.join(directory, name)
+                    if name.endswith(('.br', '.gz')) and os.path.isfile(path[:-3]):
+                        continue  # served as a variant of the original
+                    relative = os.path.relpath(path, self.root).replace(os.sep, '/')
+                    files[relative] = StaticFile(path, bool(HASHED_NAME.match(relative)))
+        self.files = files
+        logger.info("Indexed %d static files", len(files))
+        return len(files)
+
+    def serve(self, path):
+        """Send `path` from the build, or index.html for client-side routes."""
+        entry = self.files.get(path) or self.files.get('index.html')
+        if entry is None:
+            return "Frontend build not found", 404
+
+        filename, etag = entry.path, entry.etag
+        encoding = next((name for name, _ in ENCODINGS
+                         if name in entry.variants and request.accept_encodings[name]), None)
+        if encoding is not None:
+            # A different representation needs its own strong ETag
+            filename, etag = entry.variants[encoding], f"{entry.etag}-{encoding}"
+
+        response = send_file(filename, mimetype=entry.mimetype, etag=etag,
+                             last_modified=entry.mtime, conditional=True)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        if entry.variants:
+            response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = IMMUTABLE if entry.hashed else REVALIDATE
+        return response
+
+
+def compress_build(root, min_size=1024):
+    """Write .br (if `brotli` is installed) and .gz siblings for compressible files. Returns files written."""
+    try:
+        import brotli  # optional dependency, only needed to build .br variants
+    except ImportError:
+        brotli = None
+        logger.warning("brotli is not installed; writing .gz variants only")
+
+    written = 0
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            if os.path.splitext(name)[1] not in COMPRESSIBLE or os.path.getsize(path) < min_size:
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                variants['.br'] = brotli.compress(data, quality=11)
+            for suffix, compressed in variants.items():
+                if len(compressed) >= len(data) * 0.9:
+                    continue  # not worth a Content-Encoding
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
+                written += 1
+    return written
+
+
+static_files = StaticFiles()
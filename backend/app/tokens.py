@@ -0,0 +1,211 @@
+"""
+Spotify access-token refresh.
+
+Every refresh goes through `refresh_user_token`, which is single-flight per
+user: a per-process lock keeps threads from refreshing the same user twice, and
+a claim on the user row does the same across workers. The claim is a
+conditional UPDATE of `users.token_refreshing_until`, committed before the OAuth
+round trip, so no row lock or transaction is held while Spotify answers. The
+new tokens are written by a second conditional UPDATE that only matches while
+the claim is still ours. A worker that finds the row claimed waits for the
+holder and then sees the new expiry, skipping the round trip; a claim left by a
+worker that died lapses after `REFRESH_CLAIM`. The in-process locks are a fixed
+set of stripes picked by user id, so they don't grow with the number of users.
+
+`TokenRefreshScheduler` refreshes tokens for recently active users ahead of
+expiry from a background thread, so request handlers normally find a fresh token
+and only refresh inline when a user returns after their token has lapsed.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+
+from app.background import BackgroundThread
+from app.metrics import TOKEN_REFRESHES
+from app.spotify import get_spotify_oauth
+from database.models import db, User
+
+logger = logging.getLogger(__name__)
+
+# Tokens closer than this to expiry are refreshed before use
+REFRESH_MARGIN = timedelta(seconds=60)
+# How long a worker's claim on a user's refresh lasts, covering the OAuth round trip
+REFRESH_CLAIM = timedelta(seconds=30)
+CLAIM_POLL_INTERVAL = 0.1  # seconds between checks while another worker holds the claim
+
+LOCK_STRIPES = 64
+_user_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+
+def _lock_for(user_id):
+    # Users sharing a stripe only wait for each other's refresh round trip
+    return _user_locks[hash(user_id) % LOCK_STRIPES]
+
+
+def refresh_user_token(user_id, min_validity=REFRESH_MARGIN, force=False):
+    """Refresh the user's access token unless it is still valid for `min_validity`
+    (always, with `force`).
+
+    Returns the up-to-date User, or None if the user has no refresh token.
+    OAuth errors are raised to the caller.
+    """
+    with _lock_for(user_id):
+        try:
+            seen_expiration = None
+            while True:
+                user = db.session.get(User, user_id, populate_existing=True)
+                if user is None or not user.refresh_token:
+                    db.session.rollback()
+                    return None
+
+                fresh = user.token_expiration and user.token_expiration >= datetime.now() + min_validity
+                refreshed_meanwhile = seen_expiration is not None and user.token_expiration != seen_expiration
+                if (fresh and not force) or refreshed_meanwhile:
+                    db.session.commit()  # refreshed by another thread or worker meanwhile
+                    TOKEN_REFRESHES.labels('skipped').inc()
+                    return user
+
+                refresh_token = user.refresh_token
+                seen_expiration = user.token_expiration or datetime.min
+                claim = _claim(user_id)
+                if claim is not None:
+                    break
+                time.sleep(CLAIM_POLL_INTERVAL)  # another worker is refreshing this user
+        except Exception:
+            db.session.rollback()
+            TOKEN_REFRESHES.labels('failed').inc()
+            raise
+
+        try:
+            token_info = get_spotify_oauth().refresh_access_token(refresh_token)
+        except Exception:
+            _release(user_id, claim)
+            TOKEN_REFRESHES.labels('failed').inc()
+            raise
+
+        try:
+            # Clearing our claim locks the row until the commit; no match means the
+            # claim lapsed and another worker took over, whose tokens win
+            if not _release(user_id, claim, commit=False):
+                db.session.rollback()
+                TOKEN_REFRESHES.labels('skipped').inc()
+                logger.warning("Token refresh claim for user %s lapsed, discarding the new token", user_id)
+                return db.session.get(User, user_id, populate_existing=True)
+            user = db.session.get(User, user_id, populate_existing=True)
+            user.access_token = token_info["access_token"]
+            if token_info.get("refresh_token"):
+                user.refresh_token = token_info["refresh_token"]
+            user.token_expiration = datetime.now() + timedelta(seconds=token_info["expires_in"])
+            if token_info.get("scope"):
+                user.token_scope = token_info["scope"]
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            TOKEN_REFRESHES.labels('failed').inc()
+            raise
+
+    TOKEN_REFRESHES.labels('refreshed').inc()
+    logger.info("Refreshed token for user %s", user_id)
+    return user
+
+
+def _claim(user_id):
+    """Claim the user's refresh for this worker. Returns the claim, or None if another worker holds one."""
+    now = datetime.now()
+    claim = now + REFRESH_CLAIM
+    claimed = (
+        User.query
+        .filter(User.id == user_id,
+                or_(User.token_refreshing_until.is_(None), User.token_refreshing_until <= now))
+        .update({User.token_refreshing_until: claim}, synchronize_session=False)
+    )
+    db.session.commit()
+    return claim if claimed else None
+
+
+def _release(user_id, claim, commit=True):
+    """Clear the claim if it is still ours. Returns whether it was."""
+    try:
+        released = (
+            User.query
+            .filter(User.id == user_id, User.token_refreshing_until == claim)
+            .update({User.token_refreshing_until: None}, synchronize_session=False)
+        )
+        if commit:
+            db.session.commit()
+        return bool(released)
+    except Exception:
+        db.session.rollback()
+        if not commit:
+            raise
+        logger.exception("Failed to release the token refresh claim for user %s", user_id)
+        return False
+
+
+class TokenRefreshScheduler:
+    """Background thread that refreshes tokens of recently active users before they expire."""
+
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.interval = 60
+        self.lead_time = timedelta(minutes=10)
+        self.active_window = 30 * 60
+        self._active = {}  # user_id -> monotonic time last seen
+        self._lock = threading.Lock()
+        self._thread = BackgroundThread(self._run, 'token-refresh')
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('TOKEN_REFRESH_SCHEDULER', True)
+        self.interval = app.config.get('TOKEN_REFRESH_INTERVAL', self.interval)
+        self.lead_time = timedelta(seconds=app.config.get('TOKEN_REFRESH_LEAD_TIME', 600))
+        self.active_window = app.config.get('TOKEN_REFRESH_ACTIVE_WINDOW', self.active_window)
+        app.extensions['token_refresh_scheduler'] = self
+
+    def touch(self, user_id):
+        """Mark a user as active so their token is kept fresh."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._active[user_id] = time.monotonic()
+        self._thread.ensure_running()
+
+    def refresh_due(self):
+        """Refresh every active user whose token expires within the lead time."""
+        cutoff = time.monotonic() - self.active_window
+        with self._lock:
+            self._active = {uid: seen for uid, seen in self._active.items() if seen >= cutoff}
+            active = list(self._active)
+        if not active:
+            return
+
+        with self.app.app_context():
+            due = [
+                user_id for (user_id,) in
+                db.session.query(User.id)
+                .filter(User.id.in_(active))
+                .filter(or_(
+                    User.token_expiration.is_(None),
+                    User.token_expiration < datetime.now() + self.lead_time,
+                ))
+            ]
+            for user_id in due:
+                try:
+                    refresh_user_token(user_id, min_validity=self.lead_time)
+                except Exception:
+                    logger.exception("Background token refresh failed for user %s", user_id)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.refresh_due()
+            except Exception:
+                logger.exception("Token refresh scheduler pass failed")
+
+
+token_refresh_scheduler = TokenRefreshScheduler()
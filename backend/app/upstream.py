@@ -0,0 +1,192 @@
+"""
+Central scheduler for calls to the Spotify Web API.
+
+Every upstream call made on behalf of a request goes through
+`upstream.call(key, fn)`, which:
+
+- coalesces identical in-flight calls (same key) so they share one response,
+- spends from a token bucket so we don't burst past `SPOTIFY_RATE_LIMIT`
+  requests per second. With `SPOTIFY_RATE_STORAGE_URI` pointing at a shared
+  limiter storage (see app/ratelimit.py) the budget is shared by every process
+  using it; with `memory://` each process has its own, so N gunicorn workers
+  and `worker.py` together may send (N + 1) x `SPOTIFY_RATE_LIMIT`,
+- honours Spotify's `Retry-After` on 429s: the whole process backs off, and the
+  call is retried with jitter if the wait fits in `SPOTIFY_MAX_WAIT`,
+- otherwise raises `UpstreamThrottled`, which the API turns into a 503 with a
+  `Retry-After` header instead of a generic 500.
+"""
+import copy
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+from limits.storage import storage_from_string
+
+from app.metrics import SPOTIFY_COALESCED, SPOTIFY_THROTTLED
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamThrottled(Exception):
+    """Spotify is rate limiting us and the wait is longer than we're willing to block."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Spotify rate limit, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout):
+        """Take one token, waiting up to `timeout` seconds. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class SharedTokenBucket:
+    """Budget of `capacity` calls per `capacity / rate` seconds, counted in a limiter storage.
+
+    A fixed window rather than a refilling bucket, since that is what the
+    storages count. Fails open if the storage is unreachable: Spotify's own
+    429s still apply.
+    """
+
+    KEY = 'spotify-upstream'
+
+    def __init__(self, storage, rate, capacity):
+        self.storage = storage
+        self.rate = rate
+        self.capacity = capacity
+        self.window = capacity / rate
+
+    def acquire(self, timeout):
+        """Take one call from the window, waiting up to `timeout` seconds. Returns False on timeout."""
+        deadline = time.time() + timeout
+        while True:
+            try:
+                if self.storage.incr(self.KEY, self.window) <= self.capacity:
+                    return True
+                resets_at = self.storage.get_expiry(self.KEY)
+            except Exception:
+                logger.warning("Spotify rate budget storage failed, not limiting this call", exc_info=True)
+                return True
+            if resets_at > deadline:
+                return False
+            # Jitter so the processes waiting on this window don't all retry at once
+            time.sleep(max(0.0, resets_at - time.time()) + random.uniform(0, 0.05 * self.window))
+
+
+class UpstreamScheduler:
+    """Rate-limit aware, coalescing gateway for Spotify API calls."""
+
+    def __init__(self):
+        self.bucket = TokenBucket(rate=10, capacity=20)
+        self.max_wait = 5.0
+        self.max_retries = 2
+        self.coalesced = 0
+        self.throttled = 0
+        self._blocked_until = 0.0
+        self._inflight = {}  # key -> Future
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        rate = app.config.get('SPOTIFY_RATE_LIMIT', 10)
+        capacity = app.config.get('SPOTIFY_RATE_BURST', 20)
+        storage_uri = app.config.get('SPOTIFY_RATE_STORAGE_URI', 'memory://')
+        if storage_uri == 'memory://':
+            self.bucket = TokenBucket(rate=rate, capacity=capacity)
+        else:
+            self.bucket = SharedTokenBucket(storage_from_string(storage_uri), rate=rate, capacity=capacity)
+        self.max_wait = app.config.get('SPOTIFY_MAX_WAIT', self.max_wait)
+        self.max_retries = app.config.get('SPOTIFY_429_RETRIES', self.max_retries)
+        app.extensions['upstream'] = self
+
+    def call(self, key, fn):
+        """Run `fn()` against Spotify, sharing the result with identical concurrent calls."""
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+                SPOTIFY_COALESCED.inc()
+
+        if not leader:
+            # Callers may mutate what they get back, so followers get their own copy
+            return copy.deepcopy(future.result())
+
+        try:
+            result = self._call_with_backoff(fn)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _call_with_backoff(self, fn):
+        from spotipy.exceptions import SpotifyException  # deferred like the rest of spotipy, see app/spotify.py
+
+        attempt = 0
+        while True:
+            self._wait_for_budget()
+            try:
+                return fn()
+            except SpotifyException as exc:
+                if exc.http_status != 429:
+                    raise
+                retry_after = self._retry_after(exc)
+                SPOTIFY_THROTTLED.inc()
+                with self._lock:
+                    self.throttled += 1
+                    self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+                logger.warning("Spotify returned 429, backing off for %ss", retry_after)
+
+                if attempt >= self.max_retries or retry_after > self.max_wait:
+                    raise UpstreamThrottled(retry_after) from exc
+                attempt += 1
+
+    def _wait_for_budget(self):
+        blocked_for = self._blocked_until - time.monotonic()
+        if blocked_for > self.max_wait:
+            raise UpstreamThrottled(int(blocked_for) + 1)
+        if blocked_for > 0:
+            # Jitter so callers released by the same Retry-After don't stampede
+            time.sleep(blocked_for + random.uniform(0, 0.25 * blocked_for + 0.1))
+        if not self.bucket.acquire(self.max_wait):
+            raise UpstreamThrottled(1)
+
+    @staticmethod
+    def _retry_after(exc):
+        try:
+            return max(1, int((exc.headers or {}).get('Retry-After', 1)))
+        except (TypeError, ValueError):
+            return 1
+
+
+upstream = UpstreamScheduler()
@@ -0,0 +1,73 @@
+"""
+Saved reports for the benchmarks in bench/ and the comparison against them.
+
+A baseline is a report saved as bench/baselines/NAME<suffix>.json. Comparing
+only makes sense like for like, so the reports record the machine and the
+options they were run with and a mismatch is warned about.
+"""
+import json
+import os
+import platform
+import sys
+
+BASELINES = os.path.join(os.path.dirname(__file__), 'baselines')
+# Options that choose what to do with a report rather than how it was measured
+REPORT_OPTIONS = ('save', 'compare', 'threshold')
+
+
+def add_arguments(parser, suffix=''):
+    """Add --save, --compare and --threshold to a benchmark's argument parser."""
+    parser.add_argument('--save', metavar='NAME', help=f'Save the report as bench/baselines/NAME{suffix}.json.')
+    parser.add_argument('--compare', metavar='NAME', help=f'Compare against bench/baselines/NAME{suffix}.json.')
+    parser.add_argument('--threshold', type=float, default=0.15, help='Relative change counted as a regression.')
+
+
+def machine():
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def options(args, exclude=()):
+    """The options a report was measured with."""
+    return {key: value for key, value in vars(args).items() if key not in REPORT_OPTIONS + tuple(exclude)}
+
+
+def metric(report, name):
+    """A report value by dotted name, e.g. 'latency_ms.p95'."""
+    value = report
+    for part in name.split('.'):
+        value = value[part]
+    return value
+
+
+def compare(report, baseline, compared, threshold):
+    """Print each (name, higher_is_better) metric against the baseline. Returns the names that regressed."""
+    regressions = []
+    for name, higher_is_better in compared:
+        old, new = metric(baseline, name), metric(report, name)
+        change = (new - old) / old if old else 0.0
+        worse = -change if higher_is_better else change
+        flag = ''
+        if worse > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"  {name:<28} {old:>10} -> {new:>10}  ({change:+.1%}){flag}")
+    return regressions
+
+
+def finish(report, args, compared, suffix=''):
+    """Print the report, then save it and/or compare it as asked. Exits with 1 on a regression."""
+    print(json.dumps(report, indent=2))
+
+    if args.save:
+        os.makedirs(BASELINES, exist_ok=True)
+        with open(os.path.join(BASELINES, f'{args.save}{suffix}.json'), 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+    if args.compare:
+        with open(os.path.join(BASELINES, f'{args.compare}{suffix}.json')) as f:
+            baseline = json.load(f)
+        print(f"\nAgainst baseline '{args.compare}' ({baseline['recorded_at']}):")
+        if baseline['options'] != report['options']:
+            print("  warning: options differ from the baseline's, so the comparison is not like for like")
+        if compare(report, baseline, compared, args.threshold):
+            sys.exit(1)
@@ -0,0 +1,200 @@
+"""
+Local stand-in for the parts of the Spotify Web API the app calls.
+
+Responses are deterministic per user (the bearer token is the user's key) and
+per time range, with tunable latency, 429 injection and payload size, so
+benchmark runs are comparable without touching real Spotify.
+
+    python bench/fake_spotify.py --port 8999 --latency-ms 80
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+GENRES = [f'genre-{i}' for i in range(40)]
+ARTIST_POOL = 500
+TRACK_POOL = 2000
+PLAY_INTERVAL = 180  # seconds between synthetic plays
+
+
+class FakeSpotify:
+    """Response generator plus counters, shared by the request handler threads."""
+
+    def __init__(self, latency_ms=50, jitter_ms=0, error_rate=0.0, retry_after=1, items=50, markets=180,
+                 seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.items = items
+        self.markets = ['XX'] * markets  # real payloads list ~180 markets per track and album
+        self.seed = seed
+        self.requests = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def artist(self, i):
+        rng = random.Random(f'{self.seed}:artist:{i}')
+        return {
+            'id': f'artist{i:018d}', 'name': f'Artist {i}', 'type': 'artist', 'uri': f'spotify:artist:artist{i:018d}',
+            'genres': rng.sample(GENRES, rng.randint(1, 4)), 'popularity': rng.randint(0, 100),
+            'followers': {'href': None, 'total': rng.randint(0, 10 ** 6)},
+            'images': [{'url': f'https://i.scdn.co/image/a{i}-{size}', 'height': size, 'width': size}
+                       for size in (640, 320, 160)],
+            'external_urls': {'spotify': f'https://open.spotify.com/artist/artist{i:018d}'},
+            'href': f'https://api.spotify.com/v1/artists/artist{i:018d}',
+        }
+
+    def track(self, i):
+        rng = random.Random(f'{self.seed}:track:{i}')
+        artist = rng.randrange(ARTIST_POOL)
+        album = i // 10
+        return {
+            'id': f'track{i:019d}', 'name': f'Track {i}', 'type': 'track', 'uri': f'spotify:track:track{i:019d}',
+            'duration_ms': rng.randint(90, 420) * 1000, 'popularity': rng.randint(0, 100),
+            'explicit': rng.random() < 0.2, 'available_markets': self.markets,
+            'artists': [{'id': f'artist{artist:018d}', 'name': f'Artist {artist}', 'type': 'artist'}],
+            'album': {
+                'id': f'album{album:019d}', 'name': f'Album {album}', 'album_type': 'album',
+                'release_date': f'{1960 + album % 65}-01-01', 'release_date_precision': 'day',
+                'images': [{'url': f'https://i.scdn.co/image/al{album}-{size}', 'height': size, 'width': size}
+                           for size in (640, 300, 64)],
+                'artists': [{'id': f'artist{artist:018d}', 'name': f'Artist {artist}'}],
+                'available_markets': self.markets,
+            },
+            'external_urls': {'spotify': f'https://open.spotify.com/track/track{i:019d}'},
+        }
+
+    def top(self, token, item_type, time_range, limit):
+        pool = ARTIST_POOL if item_type == 'artists' else TRACK_POOL
+        ids = random.Random(f'{self.seed}:{token}:{item_type}:{time_range}').sample(range(pool), self.items)
+        make = self.artist if item_type == 'artists' else self.track
+        items = [make(i) for i in ids[:limit]]
+        return {'items': items, 'total': self.items, 'limit': limit, 'offset': 0, 'next': None, 'previous': None}
+
+    def recently_played(self, token, limit, after=None):
+        """One play every PLAY_INTERVAL seconds, so new plays keep arriving during a run."""
+        rng = random.Random(f'{self.seed}:{token}:plays')
+        tracks = rng.sample(range(TRACK_POOL), 200)
+        newest = int(time.time()) // PLAY_INTERVAL
+        if after is None:
+            slots = range(newest, newest - limit, -1)
+        else:
+            first = int(after) // 1000 // PLAY_INTERVAL + 1
+            slots = range(min(newest, first + limit - 1), first - 1, -1)
+        items = [{
+            'track': self.track(tracks[slot % len(tracks)]),
+            'played_at': datetime.fromtimestamp(slot * PLAY_INTERVAL, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            'context': None,
+        } for slot in slots]
+        millis = [slot * PLAY_INTERVAL * 1000 for slot in slots]
+        cursors = {'after': str(max(millis)), 'before': str(min(millis))} if millis else None
+        return {'items': items, 'cursors': cursors, 'limit': limit, 'next': None}
+
+    def profile(self, token):
+        return {'id': f'user-{token}', 'display_name': f'User {token}', 'email': None, 'images': [],
+                'followers': {'total': 0}, 'country': 'GB', 'product': 'premium', 'type': 'user'}
+
+    def audio_features(self, ids):
+        features = []
+        for track_id in ids:
+            rng = random.Random(f'{self.seed}:features:{track_id}')
+            features.append({'id': track_id, 'danceability': rng.random(), 'energy': rng.random(),
+                             'valence': rng.random(), 'acousticness': rng.random(),
+                             'instrumentalness': rng.random(), 'speechiness': rng.random(),
+                             'liveness': rng.random(), 'loudness': -rng.random() * 20,
+                             'tempo': 60 + rng.random() * 120})
+        return {'audio_features': features}
+
+    def handle(self, method, path, query, token):
+        """(status, body, headers) for a request."""
+        with self._lock:
+            self.requests += 1
+            throttle = self.error_rate and random.random() < self.error_rate
+            if throttle:
+                self.throttled += 1
+        delay = self.latency_ms + (random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay:
+            time.sleep(delay / 1000)
+        if throttle:
+            return 429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}}, {'Retry-After': str(self.retry_after)}
+
+        if method == 'POST' and path == '/api/token':
+            return 200, {'access_token': f'refreshed-{int(time.time())}', 'token_type': 'Bearer',
+                         'expires_in': 3600, 'scope': ''}, {}
+        if token is None:
+            return 401, {'error': {'status': 401, 'message': 'No token provided'}}, {}
+
+        limit = int(query.get('limit', ['20'])[0])
+        if path == '/v1/me':
+            return 200, self.profile(token), {}
+        if path in ('/v1/me/top/artists', '/v1/me/top/tracks'):
+            return 200, self.top(token, path.rsplit('/', 1)[1], query.get('time_range', ['medium_term'])[0], limit), {}
+        if path == '/v1/me/player/recently-played':
+            return 200, self.recently_played(token, limit, query.get('after', [None])[0]), {}
+        if path == '/v1/audio-features':
+            return 200, self.audio_features(query.get('ids', [''])[0].split(',')), {}
+        return 404, {'error': {'status': 404, 'message': 'Not found'}}, {}
+
+
+def serve(fake, host='127.0.0.1', port=0):
+    """Start `fake` on a background thread. Returns (server, base url)."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive, so the app's connection pool is exercised
+
+        def _respond(self, method):
+            url = urlsplit(self.path)
+            if method == 'POST':
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            auth = self.headers.get('Authorization', '')
+            token = auth[len('Bearer '):] if auth.startswith('Bearer ') else None
+            status, body, headers = fake.handle(method, url.path, parse_qs(url.query), token)
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            self._respond('GET')
+
+        def do_POST(self):
+            self._respond('POST')
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='fake-spotify', daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8999)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 429.')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--items', type=int, default=50, help='Top items available per user and time range.')
+    parser.add_argument('--markets', type=int, default=180, help='available_markets entries per track/album.')
+    args = parser.parse_args()
+
+    server, url = serve(FakeSpotify(args.latency_ms, args.jitter_ms, args.error_rate, args.retry_after,
+                                    args.items, args.markets), args.host, args.port)
+    print(f"Fake Spotify API at {url}/v1/ (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
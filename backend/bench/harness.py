@@ -0,0 +1,223 @@
+"""
+Offline benchmark: `create_app('testing')` against the fake Spotify API.
+
+Synthetic users are created with valid tokens, then `--concurrency` threads
+replay a weighted dashboard traffic mix through Flask test clients (in process,
+so the numbers are the app's own cost plus upstream latency, not the network).
+The report covers throughput, p50/p95/p99 latency overall and per route, SQL
+queries per request (from app.metrics), upstream calls per request and peak RSS
+of the process, i.e. of one worker.
+
+    python bench/harness.py --users 50 --requests 2000 --save default
+    python bench/harness.py --users 50 --requests 2000 --compare default
+
+`--compare` exits with status 1 if a metric regressed by more than `--threshold`.
+Baselines are JSON files in bench/baselines/ and only compare like for like:
+same machine and the same options.
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Add the parent directory to sys.path to make imports work, as in run.py
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND)
+os.environ.setdefault('SECRET_KEY', 'bench-only-insecure-key')
+
+from bench import baseline  # noqa: E402
+from bench.fake_spotify import FakeSpotify, serve  # noqa: E402
+
+TIME_RANGES = ('short_term', 'medium_term', 'long_term')
+
+# route name -> (weight, path template); roughly what the dashboard pages request
+MIXES = {
+    'dashboard': {
+        'dashboard': (3, '/api/dashboard?time_range={time_range}'),
+        'top-artists': (4, '/api/top/artists?time_range={time_range}&limit=20'),
+        'top-tracks': (4, '/api/top/tracks?time_range={time_range}&limit=20'),
+        'top-genres': (2, '/api/top-genres?time_range={time_range}'),
+        'recently-played': (3, '/api/recently-played?limit=20'),
+        'stats': (1, '/api/stats?limit=50'),
+    },
+    'top': {
+        'top-artists': (1, '/api/top/artists?time_range={time_range}&limit=50'),
+        'top-tracks': (1, '/api/top/tracks?time_range={time_range}&limit=50'),
+        'top-genres': (1, '/api/top-genres?time_range={time_range}'),
+    },
+    'history': {
+        'recently-played': (3, '/api/recently-played?limit=50'),
+        'stats': (1, '/api/stats?limit=50'),
+    },
+}
+
+# (metric, higher is better)
+COMPARED = (
+    ('throughput_rps', True),
+    ('latency_ms.p50', False),
+    ('latency_ms.p95', False),
+    ('latency_ms.p99', False),
+    ('db_queries_per_request', False),
+    ('upstream_calls_per_request', False),
+    ('peak_rss_mb', False),
+)
+
+
+def build_app(args, api_url, db_path):
+    from config.config import TestingConfig
+
+    TestingConfig.SQLALCHEMY_DATABASE_URI = f'sqlite:///{db_path}'
+    TestingConfig.SPOTIFY_API_PREFIX = f'{api_url}/v1/'
+    TestingConfig.RATELIMIT_ENABLED = False  # every synthetic user shares one IP
+    TestingConfig.JOBS_RUN_IN_PROCESS = False
+    TestingConfig.SPOTIFY_RATE_LIMIT = args.spotify_rate
+    TestingConfig.SPOTIFY_RATE_BURST = max(int(args.spotify_rate * 2), 1)
+
+    from app import create_app
+    return create_app('testing')
+
+
+def create_users(app, count):
+    from database.models import db, User
+
+    with app.app_context():
+        users = [
+            User(spotify_id=f'bench-{i}', display_name=f'Bench {i}', access_token=f'bench-{i}',
+                 refresh_token=f'refresh-{i}', token_expiration=datetime.now() + timedelta(days=1))
+            for i in range(count)
+        ]
+        db.session.add_all(users)
+        db.session.commit()
+        return [user.id for user in users]
+
+
+def run_load(app, user_ids, mix, requests, concurrency, seed):
+    """Issue `requests` requests from `concurrency` threads. Returns [(route, status, seconds)]."""
+    routes = list(mix)
+    weights = [mix[route][0] for route in routes]
+    results = []
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        clients = {}
+        local = []
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            user_id = rng.choice(user_ids)
+            client = clients.get(user_id)
+            if client is None:
+                client = clients[user_id] = app.test_client()
+                with client.session_transaction() as session:
+                    session['user_id'] = user_id
+            route = rng.choices(routes, weights)[0]
+            path = mix[route][1].format(time_range=rng.choice(TIME_RANGES))
+            started = time.perf_counter()
+            response = client.get(path)
+            local.append((route, response.status_code, time.perf_counter() - started))
+        with lock:
+            results.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def percentiles(seconds):
+    values = np.percentile(np.asarray(seconds) * 1000, [50, 95, 99])
+    return {'p50': round(float(values[0]), 2), 'p95': round(float(values[1]), 2), 'p99': round(float(values[2]), 2)}
+
+
+def db_queries():
+    """(queries, requests) recorded by app.metrics so far."""
+    from app.metrics import REQUEST_QUERIES
+
+    total = count = 0.0
+    for metric in REQUEST_QUERIES.collect():
+        for sample in metric.samples:
+            if sample.name.endswith('_sum'):
+                total += sample.value
+            elif sample.name.endswith('_count'):
+                count += sample.value
+    return total, count
+
+
+def benchmark(args):
+    fake = FakeSpotify(args.latency_ms, args.jitter_ms, args.error_rate, args.retry_after, args.items, args.markets)
+    server, api_url = serve(fake)
+    with tempfile.TemporaryDirectory() as tmp:
+        app = build_app(args, api_url, os.path.join(tmp, 'bench.db'))
+        user_ids = create_users(app, args.users)
+        mix = MIXES[args.mix]
+
+        if args.warmup:
+            run_load(app, user_ids, mix, args.warmup, args.concurrency, args.seed + 1000)
+
+        queries_before, counted_before = db_queries()
+        upstream_before, throttled_before = fake.requests, fake.throttled
+        started = time.perf_counter()
+        results = run_load(app, user_ids, mix, args.requests, args.concurrency, args.seed)
+        elapsed = time.perf_counter() - started
+        queries, counted = db_queries()
+        server.shutdown()
+
+    by_route = defaultdict(list)
+    for route, _, seconds in results:
+        by_route[route].append(seconds)
+    statuses = Counter(str(status) for _, status, _ in results)
+    return {
+        'recorded_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'machine': baseline.machine(),
+        'options': baseline.options(args),
+        'requests': len(results),
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(len(results) / elapsed, 2),
+        'latency_ms': percentiles([seconds for _, _, seconds in results]),
+        'routes': {route: {'requests': len(values), **percentiles(values)} for route, values in sorted(by_route.items())},
+        'statuses': dict(sorted(statuses.items())),
+        'db_queries_per_request': round((queries - queries_before) / max(counted - counted_before, 1), 2),
+        'upstream_calls_per_request': round((fake.requests - upstream_before) / max(len(results), 1), 3),
+        'upstream_throttled': fake.throttled - throttled_before,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),  # KiB on Linux
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=200, help='Requests issued before measuring.')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--mix', choices=sorted(MIXES), default='dashboard')
+    parser.add_argument('--latency-ms', type=float, default=80, help='Fake Spotify latency per call.')
+    parser.add_argument('--jitter-ms', type=float, default=40)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of upstream calls answered with 429.')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--items', type=int, default=50, help='Top items per user and time range.')
+    parser.add_argument('--markets', type=int, default=180, help='available_markets entries per track/album.')
+    parser.add_argument('--spotify-rate', type=float, default=1000.0,
+                        help="App's upstream budget in requests/second (SPOTIFY_RATE_LIMIT).")
+    parser.add_argument('--seed', type=int, default=1)
+    baseline.add_arguments(parser)
+    args = parser.parse_args()
+
+    baseline.finish(benchmark(args), args, COMPARED)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Startup benchmark: how long a fresh process takes to become ready to serve.
+
+Each run is a new interpreter (as a gunicorn worker or a Render cold start is)
+that imports the app, calls `create_app()` and serves a first request through
+the test client. The report gives the median and worst of each phase over
+`--runs`, the peak RSS, which heavy modules were already imported once the app
+was ready (they should only appear after the first request that needs them) and,
+with `--top`, the slowest imports from `python -X importtime`.
+
+    python bench/startup.py --runs 10 --save default
+    python bench/startup.py --runs 10 --compare default
+    python bench/startup.py --no-create-tables --top 15
+
+`--compare` exits with status 1 if a phase got slower by more than `--threshold`.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND)
+
+from bench import baseline  # noqa: E402
+
+# Imports that app code defers until they are needed
+HEAVY_MODULES = ('spotipy', 'requests', 'redis', 'cryptography.fernet')
+PHASES = ('interpreter_ms', 'import_ms', 'create_app_ms', 'first_request_ms', 'total_ms')
+# (metric, higher is better): each phase's median and the peak RSS
+COMPARED = tuple((f'{phase}.median', False) for phase in PHASES) + (('peak_rss_mb', False),)
+
+# Runs in the child process; prints one JSON line
+CHILD = r'''
+import json, os, resource, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {backend!r})
+from config.config import TestingConfig
+TestingConfig.SQLALCHEMY_DATABASE_URI = {database!r}
+import app
+imported = time.perf_counter()
+flask_app = app.create_app('testing')
+created = time.perf_counter()
+ready_modules = [name for name in {heavy!r} if name in sys.modules]
+response = flask_app.test_client().get({path!r})
+served = time.perf_counter()
+print(json.dumps({{
+    'started': started,
+    'import_ms': (imported - started) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (served - created) * 1000,
+    'status': response.status_code,
+    'heavy_modules_at_ready': ready_modules,
+    'modules': len(sys.modules),
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}}))
+'''
+
+
+def run_once(args, database, importtime=False):
+    env = {**os.environ, 'SECRET_KEY': os.environ.get('SECRET_KEY', 'bench-only-insecure-key'),
+           'AUTO_CREATE_TABLES': 'false' if args.no_create_tables else 'true'}
+    code = CHILD.format(backend=BACKEND, database=database, heavy=HEAVY_MODULES, path=args.path)
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', code]
+    launched = time.perf_counter()
+    result = subprocess.run(command, env=env, cwd=BACKEND, capture_output=True, text=True, check=True)
+    finished = time.perf_counter()
+    sample = json.loads(result.stdout.strip().splitlines()[-1])
+    # perf_counter is system-wide on Linux, so the child's start is comparable with ours
+    sample['interpreter_ms'] = (sample.pop('started') - launched) * 1000
+    sample['total_ms'] = (finished - launched) * 1000
+    return sample, result.stderr
+
+
+def slowest_imports(stderr, top):
+    """[(package, cumulative ms)] of the slowest packages in `-X importtime` output.
+
+    A package's cumulative time is that of its first import, wherever in the tree
+    it happened, so nested packages are counted in their parent as well.
+    """
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        if '.' not in name:
+            packages[name] = max(packages.get(name, 0), round(int(cumulative) / 1000, 1))
+    return sorted(packages.items(), key=lambda entry: -entry[1])[:top]
+
+
+def benchmark(args):
+    samples = []
+    with tempfile.TemporaryDirectory() as tmp:
+        database = f"sqlite:///{os.path.join(tmp, 'startup.db')}"
+        for _ in range(args.warmup + args.runs):
+            samples.append(run_once(args, database)[0])
+        samples = samples[args.warmup:]
+        imports = slowest_imports(run_once(args, database, importtime=True)[1], args.top) if args.top else None
+
+    report = {
+        'recorded_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'machine': baseline.machine(),
+        'options': baseline.options(args, exclude=('top',)),
+        'runs': len(samples),
+        'status': samples[-1]['status'],
+    }
+    for phase in PHASES:
+        values = np.array([sample[phase] for sample in samples])
+        report[phase] = {'median': round(float(np.median(values)), 1), 'max': round(float(values.max()), 1)}
+    report['peak_rss_mb'] = round(max(sample['peak_rss_mb'] for sample in samples), 1)
+    report['modules'] = samples[-1]['modules']
+    report['heavy_modules_at_ready'] = samples[-1]['heavy_modules_at_ready']
+    if imports is not None:
+        report['slowest_imports_ms'] = dict(imports)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=1, help='Runs discarded first (cold disk cache, .pyc writes).')
+    parser.add_argument('--path', default='/api/similar', help='First request to serve.')
+    parser.add_argument('--no-create-tables', action='store_true',
+                        help='Boot with AUTO_CREATE_TABLES=false (tables made by `flask migrate`).')
+    parser.add_argument('--top', type=int, default=0, help='Also list the N slowest top-level imports.')
+    baseline.add_arguments(parser, suffix='-startup')
+    args = parser.parse_args()
+
+    baseline.finish(benchmark(args), args, COMPARED, suffix='-startup')
+
+
+if __name__ == '__main__':
+    main()
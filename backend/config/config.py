@@ -1,5 +1,4 @@
 import os
-import logging
 from dotenv import load_dotenv
 
 # Load environment variables from backend/.env explicitly
@@ -13,32 +12,114 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     # Load all sensitive values from environment variables with no fallbacks
     SECRET_KEY = os.environ.get('SECRET_KEY')
+    REQUIRE_SECRET_KEY = False  # create_app refuses to start without SECRET_KEY if set
+    INSECURE_SECRET_KEY = None  # fallback used (with a warning) when SECRET_KEY is unset
+    # db.create_all() on startup. With it off, schema changes are applied once per
+    # deploy by `flask migrate` instead of by every worker as it boots.
+    AUTO_CREATE_TABLES = os.environ.get('AUTO_CREATE_TABLES', 'true').lower() == 'true'
     SPOTIFY_CLIENT_ID = os.environ.get('SPOTIFY_CLIENT_ID')
     SPOTIFY_CLIENT_SECRET = os.environ.get('SPOTIFY_CLIENT_SECRET')
     SPOTIFY_REDIRECT_URI = os.environ.get('SPOTIFY_REDIRECT_URI')
     FRONTEND_URL = os.environ.get('FRONTEND_URL', 'http://127.0.0.1:3000')
     CORS_ORIGINS = os.environ.get('CORS_ORIGINS', 'http://localhost:3000,http://127.0.0.1:3000')
     TOKEN_ENCRYPTION_KEY = os.environ.get('TOKEN_ENCRYPTION_KEY')
+    # Comma-separated, newest first; takes precedence over TOKEN_ENCRYPTION_KEY (see database/encryption.py)
+    TOKEN_ENCRYPTION_KEYS = os.environ.get('TOKEN_ENCRYPTION_KEYS')
     SESSION_COOKIE_SECURE = False
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'Lax'
     SESSION_COOKIE_DOMAIN = os.environ.get('SESSION_COOKIE_DOMAIN')
     SESSION_COOKIE_NAME = 'statify_session'
+    # Database connection pool; SQLAlchemy's defaults unless DB_POOL_SIZE is set
+    # (gunicorn.conf.py sets it, like the other pool sizes below, for gevent workers)
+    if os.environ.get('DB_POOL_SIZE'):
+        SQLALCHEMY_ENGINE_OPTIONS = {
+            'pool_size': int(os.environ['DB_POOL_SIZE']),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+            'pool_pre_ping': True,
+        }
+    # Web API base URL; only overridden to point at a stand-in (see bench/fake_spotify.py)
+    SPOTIFY_API_PREFIX = os.environ.get('SPOTIFY_API_PREFIX', 'https://api.spotify.com/v1/')
+    # Shared keep-alive HTTP pool for all Spotify API/OAuth calls (see app/spotify.py)
+    SPOTIFY_HTTP_POOL_CONNECTIONS = int(os.environ.get('SPOTIFY_HTTP_POOL_CONNECTIONS', 4))
+    SPOTIFY_HTTP_POOL_MAXSIZE = int(os.environ.get('SPOTIFY_HTTP_POOL_MAXSIZE', 32))
+    SPOTIFY_HTTP_TIMEOUT = float(os.environ.get('SPOTIFY_HTTP_TIMEOUT', 5))
+    SPOTIFY_HTTP_RETRIES = int(os.environ.get('SPOTIFY_HTTP_RETRIES', 2))
+    SPOTIFY_HTTP_BACKOFF = float(os.environ.get('SPOTIFY_HTTP_BACKOFF', 0.3))
+    # Upstream request budget and 429 handling (see app/upstream.py). The budget
+    # is per process with memory://; a limiter storage URI (sqlite:///<file> per
+    # host, redis://<host> across hosts) shares it. Don't use batched+ storages
+    # here, they let each process overshoot between syncs.
+    SPOTIFY_RATE_LIMIT = float(os.environ.get('SPOTIFY_RATE_LIMIT', 10))  # requests per second
+    SPOTIFY_RATE_BURST = int(os.environ.get('SPOTIFY_RATE_BURST', 20))
+    SPOTIFY_RATE_STORAGE_URI = os.environ.get('SPOTIFY_RATE_STORAGE_URI', 'memory://')
+    SPOTIFY_MAX_WAIT = float(os.environ.get('SPOTIFY_MAX_WAIT', 5))  # longest a request may block for budget
+    SPOTIFY_429_RETRIES = int(os.environ.get('SPOTIFY_429_RETRIES', 2))
+    # Rate limiter counters (see app/ratelimit.py): memory:// counts per worker;
+    # batched+sqlite:///<file> shares them between workers on one host and
+    # batched+redis://<host> across hosts. Batched storages sync every
+    # RATELIMIT_STORAGE_OPTIONS['sync_interval'] seconds (default 1).
+    RATELIMIT_STORAGE_URI = os.environ.get('RATELIMIT_STORAGE_URI', 'memory://')
+    RATELIMIT_STORAGE_OPTIONS = {}
+    # Spotify response cache: 'memory' (per process), 'redis' (shared) or 'none'
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+    CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    CACHE_TTLS = {}  # per-endpoint overrides of app.cache.DEFAULT_TTLS, in seconds
+    # Audio features (shared by all users) kept in process memory, in tracks
+    AUDIO_FEATURES_CACHE_SIZE = int(os.environ.get('AUDIO_FEATURES_CACHE_SIZE', 50000))
+    # Background library sync (see app/library.py)
+    LIBRARY_SYNC_CONCURRENCY = int(os.environ.get('LIBRARY_SYNC_CONCURRENCY', 4))  # pages in flight per sync
+    # Background jobs (app/jobs.py): drained by `python worker.py`, or by a
+    # thread in each web process when JOBS_RUN_IN_PROCESS is set
+    JOBS_RUN_IN_PROCESS = os.environ.get('JOBS_RUN_IN_PROCESS', 'false').lower() == 'true'
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1.0))  # seconds between polls when idle
+    JOB_TIMEOUT = 15 * 60  # seconds before a 'running' job whose worker stopped reporting is re-queued
+    JOB_HEARTBEAT_INTERVAL = 60  # seconds between a running job's heartbeats; well under JOB_TIMEOUT
+    JOB_RETRY_BACKOFF = 30  # seconds before the first retry; doubles per attempt
+    # Instrumentation (see app/metrics.py): bearer token required by /metrics if set,
+    # and the fraction of requests run under cProfile (written to PROFILE_DIR or logged;
+    # ignored under gevent, where cProfile mixes up concurrent requests)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')
+    # Threads shared by /api/dashboard requests for concurrent Spotify calls
+    DASHBOARD_MAX_WORKERS = int(os.environ.get('DASHBOARD_MAX_WORKERS', 8))
+    # At most one user_stats snapshot per (user, data_type, time_range) per window
+    SNAPSHOT_MIN_INTERVAL = int(os.environ.get('SNAPSHOT_MIN_INTERVAL', 6 * 60 * 60))
+    SNAPSHOT_BATCH_SIZE = 100
+    SNAPSHOT_FLUSH_INTERVAL = 2.0  # seconds the background writer waits to fill a batch
+    SNAPSHOT_SYNCHRONOUS = False
+    SNAPSHOT_DEDUPE_KEYS = int(os.environ.get('SNAPSHOT_DEDUPE_KEYS', 100000))  # (user, type, range) hashes kept in memory
+    # Snapshot retention (`flask prune-stats`, see database/retention.py): raw rows are
+    # rolled up into daily summaries after this many days, daily ones into weekly
+    STATS_RAW_RETENTION_DAYS = int(os.environ.get('STATS_RAW_RETENTION_DAYS', 90))
+    STATS_DAILY_RETENTION_DAYS = int(os.environ.get('STATS_DAILY_RETENTION_DAYS', 365))
+    STATS_RETENTION_BATCH_SIZE = 1000
+    STATS_KEEP_LATEST = 2  # newest snapshots per (user, data_type, time_range) kept however old
+    STATS_PARTITIONS_AHEAD = 3  # months of user_stats partitions created in advance (Postgres)
+    # Decrypted access tokens kept in process memory only (0 disables)
+    TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL', 3000))
+    TOKEN_CACHE_MAX_ENTRIES = 10000
+    # Background refresh of active users' tokens ahead of expiry
+    TOKEN_REFRESH_SCHEDULER = os.environ.get('TOKEN_REFRESH_SCHEDULER', 'true').lower() == 'true'
+    TOKEN_REFRESH_INTERVAL = 60  # seconds between scheduler passes
+    TOKEN_REFRESH_LEAD_TIME = 600  # refresh tokens expiring within this many seconds
+    TOKEN_REFRESH_ACTIVE_WINDOW = 30 * 60  # users seen within this many seconds count as active
 
 
 class DevelopmentConfig(Config):
     """Development configuration"""
     DEBUG = True
-    if not Config.SECRET_KEY:
-        SECRET_KEY = 'dev-only-insecure-key-do-not-use-in-prod'
-        logging.getLogger(__name__).warning(
-            "SECRET_KEY not set — using insecure dev default. Set SECRET_KEY in .env for production."
-        )
+    JOBS_RUN_IN_PROCESS = os.environ.get('JOBS_RUN_IN_PROCESS', 'true').lower() == 'true'
+    INSECURE_SECRET_KEY = 'dev-only-insecure-key-do-not-use-in-prod'
 
 class TestingConfig(Config):
     """Testing configuration"""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///test.db'
+    SNAPSHOT_SYNCHRONOUS = True
+    TOKEN_REFRESH_SCHEDULER = False
 
 
 class ProductionConfig(Config):
@@ -47,12 +128,13 @@ class ProductionConfig(Config):
     SESSION_COOKIE_SECURE = True
     SESSION_COOKIE_SAMESITE = 'Lax'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///statify.db'
-
-    if not Config.SECRET_KEY:
-        raise RuntimeError(
-            "SECRET_KEY must be set in production. "
-            "Add SECRET_KEY to your environment variables or .env file."
-        )
+    # gunicorn runs several workers per host; share their limiter counters
+    RATELIMIT_STORAGE_URI = os.environ.get('RATELIMIT_STORAGE_URI', 'batched+sqlite:////tmp/statify-ratelimit.db')
+    # ...and their Spotify budget, so it doesn't grow with the worker count
+    SPOTIFY_RATE_STORAGE_URI = os.environ.get('SPOTIFY_RATE_STORAGE_URI', 'sqlite:////tmp/statify-spotify-rate.db')
+    # Checked by create_app rather than here, so importing this module never fails
+    REQUIRE_SECRET_KEY = True
+    AUTO_CREATE_TABLES = os.environ.get('AUTO_CREATE_TABLES', 'false').lower() == 'true'
 
 
 config = {
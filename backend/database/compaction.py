@@ -0,0 +1,141 @@
+"""
+Compact storage for top artist/track snapshots.
+
+Raw Spotify payloads repeat image URLs, market lists and hrefs in every
+snapshot. Instead, each item is trimmed to the fields the app uses and stored
+once in `spotify_items`, and a snapshot keeps only the ordered list of item ids.
+`rehydrate()` rebuilds the original response shape from those two pieces.
+"""
+from database.models import db, SpotifyItem, UserStats
+
+COMPACT_TYPES = ('artists', 'tracks')
+
+
+def _first_image(images):
+    if not images:
+        return []
+    image = images[0]
+    return [{'url': image.get('url'), 'height': image.get('height'), 'width': image.get('width')}]
+
+
+def compact_item(item_type, item):
+    """Trim a Spotify artist/track object down to the fields we display or analyse."""
+    if item_type == 'artists':
+        return {
+            'id': item.get('id'),
+            'name': item.get('name'),
+            'genres': item.get('genres', []),
+            'popularity': item.get('popularity'),
+            'followers': {'total': (item.get('followers') or {}).get('total')},
+            'images': _first_image(item.get('images')),
+            'uri': item.get('uri'),
+        }
+
+    album = item.get('album') or {}
+    return {
+        'id': item.get('id'),
+        'name': item.get('name'),
+        'duration_ms': item.get('duration_ms'),
+        'popularity': item.get('popularity'),
+        'explicit': item.get('explicit'),
+        'artists': [{'id': a.get('id'), 'name': a.get('name')} for a in item.get('artists', [])],
+        'album': {
+            'id': album.get('id'),
+            'name': album.get('name'),
+            'images': _first_image(album.get('images')),
+            'release_date': album.get('release_date'),
+            'release_date_precision': album.get('release_date_precision'),
+        },
+        'uri': item.get('uri'),
+    }
+
+
+def store_items(item_type, items):
+    """Upsert trimmed items into `spotify_items` (caller commits). Returns their ids in order."""
+    compacted = {}
+    for item in items:
+        if item and item.get('id'):
+            compacted[item['id']] = compact_item(item_type, item)
+
+    if compacted:
+        existing = {
+            row.id: row
+            for row in SpotifyItem.query.filter(
+                SpotifyItem.item_type == item_type, SpotifyItem.id.in_(list(compacted))
+            )
+        }
+        for item_id, data in compacted.items():
+            row = existing.get(item_id)
+            if row is None:
+                db.session.add(SpotifyItem(item_type, item_id, data))
+            elif row.data != data:
+                row.data = data  # popularity, follower counts etc. drift over time
+
+    return [item['id'] for item in items if item and item.get('id')]
+
+
+def compact_snapshot(snapshot, payload=None):
+    """Move a snapshot's raw payload into `spotify_items` + `item_ids` (caller commits)."""
+    payload = payload if payload is not None else snapshot.data
+    snapshot.item_ids = store_items(snapshot.data_type, payload.get('items', []))
+    snapshot.item_total = payload.get('total', len(snapshot.item_ids))
+    snapshot.data = None
+
+
+def rehydrate(snapshots):
+    """Return {snapshot.id: payload} in the original Spotify response shape.
+
+    Items for all compacted snapshots are loaded with one query per item type.
+    """
+    wanted = {item_type: set() for item_type in COMPACT_TYPES}
+    for snapshot in snapshots:
+        if snapshot.item_ids is not None:
+            wanted[snapshot.data_type].update(snapshot.item_ids)
+
+    items = {}
+    for item_type, ids in wanted.items():
+        if ids:
+            for row in SpotifyItem.query.filter(SpotifyItem.item_type == item_type, SpotifyItem.id.in_(list(ids))):
+                items[(item_type, row.id)] = row.data
+
+    payloads = {}
+    for snapshot in snapshots:
+        if snapshot.item_ids is None:
+            payloads[snapshot.id] = snapshot.data
+            continue
+        page = [items[(snapshot.data_type, i)] for i in snapshot.item_ids if (snapshot.data_type, i) in items]
+        payloads[snapshot.id] = {
+            'items': page,
+            'total': snapshot.item_total,
+            'limit': len(snapshot.item_ids),
+            'offset': 0,
+        }
+    return payloads
+
+
+def backfill(batch_size=500):
+    """Compact every raw artists/tracks snapshot, one committed batch at a time.
+
+    Safe to interrupt and re-run: only rows that still hold raw data are picked up.
+    Returns the number of rows compacted.
+    """
+    total = 0
+    last_id = 0
+    while True:
+        batch = (
+            UserStats.query
+            .filter(UserStats.id > last_id)
+            .filter(UserStats.data_type.in_(COMPACT_TYPES))
+            .filter(UserStats.item_ids.is_(None))
+            .order_by(UserStats.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            return total
+        for snapshot in batch:
+            if snapshot.data is not None:
+                compact_snapshot(snapshot)
+                total += 1
+        last_id = batch[-1].id
+        db.session.commit()
@@ -1,67 +1,159 @@
 """
 Token encryption/decryption helpers using Fernet symmetric encryption.
 Tokens are encrypted before being stored in the database and decrypted on read.
+
+Keys come from `TOKEN_ENCRYPTION_KEYS` (comma-separated, newest first) or the
+single `TOKEN_ENCRYPTION_KEY`, read from the app config (falling back to the
+environment outside an app context). New tokens are always encrypted with the first
+key; older keys are only used to decrypt. Each key is identified by a short
+fingerprint, stored per user in `users.token_key_id`, so reads go straight to
+the right key. To rotate, put the new key first, deploy, then re-encrypt the
+remaining rows with `flask rotate-token-keys` before dropping the old key.
 """
+import hashlib
 import os
 import logging
-from cryptography.fernet import Fernet, InvalidToken
 
 logger = logging.getLogger(__name__)
 
-_fernet = None
+FERNET_PREFIX = 'gAAAAA'  # every Fernet token starts with version byte 0x80, base64-encoded
+
+_keys = None  # [(key id, Fernet)], primary first
+_multi = None
 _encryption_available = False
+_warned = set()
+
+
+class TokenDecryptError(Exception):
+    """A stored token that looks encrypted but none of the configured keys can decrypt."""
+
+
+def key_id_for(key):
+    """Short, stable fingerprint of a key (safe to store; reveals nothing about it)."""
+    return hashlib.sha256(key.encode() if isinstance(key, str) else key).hexdigest()[:12]
+
+
+def _warn_once(kind, message):
+    # Warning on every read of a legacy token would flood the logs on the hot path
+    if kind not in _warned:
+        _warned.add(kind)
+        logger.warning(message)
+
+
+def _configured_keys():
+    from flask import current_app, has_app_context
+
+    config = current_app.config if has_app_context() else {}
+    for source in (config, os.environ):
+        raw = source.get('TOKEN_ENCRYPTION_KEYS') or source.get('TOKEN_ENCRYPTION_KEY')
+        if raw:
+            return [key.strip() for key in raw.split(',') if key.strip()]
+    return []
 
 
-def _get_fernet():
-    """Lazily initialise and cache the Fernet instance."""
-    global _fernet, _encryption_available
-    if _fernet is not None:
-        return _fernet
+def _get_keys():
+    """Lazily initialise and cache the configured keys."""
+    global _keys, _multi, _encryption_available
+    if _keys is not None:
+        return _keys
+    from cryptography.fernet import Fernet, MultiFernet  # only needed once tokens are touched
 
-    key = os.environ.get('TOKEN_ENCRYPTION_KEY')
-    if not key:
+    raw = _configured_keys()
+    if not raw:
         logger.warning(
             "TOKEN_ENCRYPTION_KEY is not set — tokens will be stored in PLAINTEXT. "
             "Generate one with: python3 -c \"from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())\""
         )
         _encryption_available = False
-        return None
+        _keys = []
+        return _keys
 
     try:
-        _fernet = Fernet(key.encode() if isinstance(key, str) else key)
-        _encryption_available = True
+        keys = [(key_id_for(key), Fernet(key.encode())) for key in raw]
     except Exception:
-        logger.error("TOKEN_ENCRYPTION_KEY is invalid — tokens will be stored in PLAINTEXT.")
+        logger.error("TOKEN_ENCRYPTION_KEY(S) invalid — tokens will be stored in PLAINTEXT.")
         _encryption_available = False
-        return None
+        _keys = []
+        return _keys
 
-    return _fernet
+    _multi = MultiFernet([fernet for _, fernet in keys])
+    _encryption_available = True
+    _keys = keys
+    return _keys
+
+
+def reset_keys():
+    """Forget the cached keys so the configuration is read again (tests, key reloads)."""
+    global _keys, _multi
+    _keys = None
+    _multi = None
+    _warned.clear()
+
+
+def primary_key_id():
+    """Id of the key new tokens are encrypted with, or None if encryption is unavailable."""
+    keys = _get_keys()
+    return keys[0][0] if keys else None
 
 
 def encrypt_token(plaintext):
-    """Encrypt a token string. Returns the encrypted string, or the original if encryption is unavailable."""
+    """Encrypt a token string with the primary key. Returns the original if encryption is unavailable."""
     if not plaintext:
         return plaintext
 
-    f = _get_fernet()
-    if f is None:
+    keys = _get_keys()
+    if not keys:
         return plaintext
 
-    return f.encrypt(plaintext.encode()).decode()
+    return keys[0][1].encrypt(plaintext.encode()).decode()
+
+
+def encrypt_token_with_id(plaintext):
+    """Encrypt like `encrypt_token`, also returning the id of the key used (None if unencrypted)."""
+    keys = _get_keys()
+    if not keys:
+        return plaintext, None
+    key_id, fernet = keys[0]
+    return (fernet.encrypt(plaintext.encode()).decode() if plaintext else plaintext), key_id
 
 
-def decrypt_token(ciphertext):
-    """Decrypt a token string. Falls back to returning the raw value if decryption fails (e.g. legacy plaintext)."""
+def decrypt_token(ciphertext, key_id=None, strict=False):
+    """Decrypt a token string, trying the key `key_id` names first.
+
+    Without a (known) key id every key is tried. Values that aren't Fernet tokens
+    are legacy plaintext and returned as-is until they are re-encrypted. A token
+    no configured key can decrypt is returned as-is too, unless `strict` is set,
+    in which case TokenDecryptError is raised: re-encrypting must never wrap that
+    ciphertext under a new key.
+    """
     if not ciphertext:
         return ciphertext
 
-    f = _get_fernet()
-    if f is None:
+    keys = _get_keys()
+    if not keys:
+        if strict and ciphertext.startswith(FERNET_PREFIX):
+            raise TokenDecryptError("No token encryption key is configured.")
         return ciphertext
 
+    from cryptography.fernet import InvalidToken
+
+    if not ciphertext.startswith(FERNET_PREFIX):
+        _warn_once('plaintext', "Found a legacy plaintext token; run `flask rotate-token-keys` to encrypt stored tokens.")
+        return ciphertext
+
+    token = ciphertext.encode()
+    if key_id is not None:
+        for candidate_id, fernet in keys:
+            if candidate_id == key_id:
+                try:
+                    return fernet.decrypt(token).decode()
+                except InvalidToken:
+                    break  # stale marker; fall back to trying every key
+
     try:
-        return f.decrypt(ciphertext.encode()).decode()
+        return _multi.decrypt(token).decode()
     except InvalidToken:
-        # Legacy plaintext token — return as-is (user will re-encrypt on next login)
-        logger.warning("Failed to decrypt token — likely a legacy plaintext value. Will re-encrypt on next write.")
+        if strict:
+            raise TokenDecryptError("No configured key decrypts this token.") from None
+        _warn_once('undecryptable', "Failed to decrypt a token with any configured key — was a key removed too early?")
         return ciphertext
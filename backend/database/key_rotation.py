@@ -0,0 +1,51 @@
+"""
+Re-encrypting stored tokens with the primary key after a key rotation.
+
+Rows are walked in primary-key order, one committed batch at a time, and each
+batch's rows are locked only while they are rewritten (`SKIP LOCKED` on
+Postgres, so a user whose token is being refreshed is simply picked up by a
+later run). Requests keep working throughout: a row not yet re-encrypted is
+still read with its old key.
+"""
+from sqlalchemy import or_
+
+from database.encryption import primary_key_id
+from database.models import db, User
+
+
+def pending_users(key_id=None):
+    """Query for users whose tokens are not (known to be) under the primary key."""
+    key_id = key_id or primary_key_id()
+    return User.query.filter(or_(User.token_key_id.is_(None), User.token_key_id != key_id))
+
+
+def reencrypt_users(batch_size=500, after_id=0):
+    """Move every user's tokens to the primary key, one committed batch at a time.
+
+    Safe to interrupt and re-run: only rows not yet under the primary key are
+    picked up. Returns (rows re-encrypted, last id seen).
+    """
+    key_id = primary_key_id()
+    if key_id is None:
+        return 0, after_id
+
+    total = 0
+    last_id = after_id
+    while True:
+        batch = (
+            pending_users(key_id)
+            .filter(User.id > last_id)
+            .order_by(User.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+            .populate_existing()
+            .all()
+        )
+        if not batch:
+            db.session.rollback()
+            return total, last_id
+        for user in batch:
+            if user.reencrypt_tokens():
+                total += 1
+        last_id = batch[-1].id
+        db.session.commit()
@@ -0,0 +1,3 @@
+-- Adds the content hash used to skip identical user_stats snapshots.
+-- db.create_all() only creates missing tables, so existing databases need this once.
+ALTER TABLE user_stats ADD COLUMN content_hash VARCHAR(64);
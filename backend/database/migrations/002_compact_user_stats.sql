@@ -0,0 +1,15 @@
+-- Compact snapshot storage: deduplicated item table plus ordered id arrays.
+-- Run once on existing databases, then backfill old rows with:
+--   flask --app run compact-stats
+-- On SQLite, which can't drop NOT NULL, run 002_compact_user_stats.sqlite.sql instead.
+CREATE TABLE IF NOT EXISTS spotify_items (
+    item_type VARCHAR(16) NOT NULL,
+    id VARCHAR(64) NOT NULL,
+    data JSON NOT NULL,
+    updated_at TIMESTAMP,
+    PRIMARY KEY (item_type, id)
+);
+
+ALTER TABLE user_stats ADD COLUMN item_ids JSON;
+ALTER TABLE user_stats ADD COLUMN item_total INTEGER;
+ALTER TABLE user_stats ALTER COLUMN data DROP NOT NULL;
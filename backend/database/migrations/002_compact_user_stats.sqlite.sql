@@ -0,0 +1,34 @@
+-- SQLite version of 002_compact_user_stats.sql (run this one instead of it):
+--   sqlite3 instance/statify.db < database/migrations/002_compact_user_stats.sqlite.sql
+-- SQLite can't drop NOT NULL from user_stats.data in place, so the table is
+-- rebuilt with the new columns and its rows copied over, in one transaction.
+-- Expects 001 to have been applied. Then backfill with `flask --app run compact-stats`.
+PRAGMA foreign_keys = OFF;
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS spotify_items (
+    item_type VARCHAR(16) NOT NULL,
+    id VARCHAR(64) NOT NULL,
+    data JSON NOT NULL,
+    updated_at TIMESTAMP,
+    PRIMARY KEY (item_type, id)
+);
+
+CREATE TABLE user_stats_new (
+    id INTEGER NOT NULL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    time_range VARCHAR(16) NOT NULL,
+    data_type VARCHAR(16) NOT NULL,
+    data JSON,
+    item_ids JSON,
+    item_total INTEGER,
+    content_hash VARCHAR(64),
+    created_at DATETIME
+);
+INSERT INTO user_stats_new (id, user_id, time_range, data_type, data, content_hash, created_at)
+    SELECT id, user_id, time_range, data_type, data, content_hash, created_at FROM user_stats;
+DROP TABLE user_stats;
+ALTER TABLE user_stats_new RENAME TO user_stats;
+
+COMMIT;
+PRAGMA foreign_keys = ON;
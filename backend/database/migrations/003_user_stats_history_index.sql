@@ -0,0 +1,4 @@
+-- Composite index for /api/stats keyset pagination and latest-snapshot lookups.
+-- On PostgreSQL, CONCURRENTLY avoids locking writes while it builds (drop it on SQLite).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_stats_user_type_range_created
+    ON user_stats (user_id, data_type, time_range, created_at);
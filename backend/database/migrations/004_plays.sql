@@ -0,0 +1,12 @@
+-- Local listening history ingested from Spotify's recently-played endpoint.
+-- New deployments get this table from db.create_all(); run this on existing ones.
+CREATE TABLE IF NOT EXISTS plays (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    track_id VARCHAR(64) NOT NULL,
+    played_at TIMESTAMP NOT NULL,
+    context_uri VARCHAR(128),
+    CONSTRAINT uq_plays_user_track_played UNIQUE (user_id, track_id, played_at)
+);
+
+CREATE INDEX IF NOT EXISTS ix_plays_user_played ON plays (user_id, played_at);
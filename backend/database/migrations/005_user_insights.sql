@@ -0,0 +1,20 @@
+-- Materialized per-(user, time_range) insights, maintained incrementally by the app.
+-- New deployments get this table from db.create_all(); run this on existing ones,
+-- then `flask --app run rebuild-insights` to backfill from stored snapshots and plays.
+CREATE TABLE IF NOT EXISTS user_insights (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    time_range VARCHAR(16) NOT NULL,
+    top_genres JSON,
+    top_albums JSON,
+    decades JSON,
+    artist_ids JSON,
+    track_ids JSON,
+    artist_deltas JSON,
+    track_deltas JSON,
+    listening_slots JSON,
+    album_plays JSON,
+    play_count INTEGER DEFAULT 0,
+    last_played_at TIMESTAMP,
+    updated_at TIMESTAMP,
+    PRIMARY KEY (user_id, time_range)
+);
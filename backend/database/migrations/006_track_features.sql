@@ -0,0 +1,20 @@
+-- Audio features per track, shared by every user.
+-- New deployments get this table from db.create_all(); run this on existing ones.
+CREATE TABLE IF NOT EXISTS track_features (
+    id VARCHAR(64) PRIMARY KEY,
+    available BOOLEAN NOT NULL DEFAULT TRUE,
+    danceability DOUBLE PRECISION,
+    energy DOUBLE PRECISION,
+    valence DOUBLE PRECISION,
+    acousticness DOUBLE PRECISION,
+    instrumentalness DOUBLE PRECISION,
+    speechiness DOUBLE PRECISION,
+    liveness DOUBLE PRECISION,
+    loudness DOUBLE PRECISION,
+    tempo DOUBLE PRECISION,
+    key INTEGER,
+    mode INTEGER,
+    time_signature INTEGER,
+    duration_ms INTEGER,
+    fetched_at TIMESTAMP
+);
@@ -0,0 +1,50 @@
+-- Library sync: saved tracks, playlists and per-user sync checkpoints.
+-- New deployments get these tables from db.create_all(); run this on existing ones.
+CREATE TABLE IF NOT EXISTS saved_tracks (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    track_id VARCHAR(64) NOT NULL,
+    added_at TIMESTAMP NOT NULL,
+    synced_at TIMESTAMP,
+    PRIMARY KEY (user_id, track_id)
+);
+CREATE INDEX IF NOT EXISTS ix_saved_tracks_user_added ON saved_tracks (user_id, added_at);
+
+CREATE TABLE IF NOT EXISTS playlists (
+    id VARCHAR(64) PRIMARY KEY,
+    name VARCHAR(256),
+    owner_id VARCHAR(64),
+    image_url TEXT,
+    tracks_total INTEGER,
+    snapshot_id VARCHAR(128),
+    synced_snapshot_id VARCHAR(128),
+    updated_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS user_playlists (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    playlist_id VARCHAR(64) NOT NULL REFERENCES playlists(id),
+    position INTEGER NOT NULL,
+    synced_at TIMESTAMP,
+    PRIMARY KEY (user_id, playlist_id)
+);
+
+CREATE TABLE IF NOT EXISTS playlist_tracks (
+    playlist_id VARCHAR(64) NOT NULL REFERENCES playlists(id),
+    position INTEGER NOT NULL,
+    track_id VARCHAR(64),
+    added_at TIMESTAMP,
+    PRIMARY KEY (playlist_id, position)
+);
+
+CREATE TABLE IF NOT EXISTS sync_states (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    kind VARCHAR(32) NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'idle',
+    cursor INTEGER NOT NULL DEFAULT 0,
+    total INTEGER,
+    high_water TIMESTAMP,
+    started_at TIMESTAMP,
+    updated_at TIMESTAMP,
+    error TEXT,
+    PRIMARY KEY (user_id, kind)
+);
@@ -0,0 +1,22 @@
+-- Background job queue drained by worker.py.
+-- New deployments get this table from db.create_all(); run this on existing ones.
+CREATE TABLE IF NOT EXISTS jobs (
+    id SERIAL PRIMARY KEY,
+    kind VARCHAR(32) NOT NULL,
+    user_id INTEGER REFERENCES users(id),
+    payload JSON,
+    status VARCHAR(16) NOT NULL DEFAULT 'queued',
+    priority INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    dedupe_key VARCHAR(128),
+    run_at TIMESTAMP NOT NULL,
+    locked_by VARCHAR(64),
+    locked_at TIMESTAMP,
+    result JSON,
+    error TEXT,
+    created_at TIMESTAMP,
+    updated_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS ix_jobs_status_priority_run_at ON jobs (status, priority, run_at);
+CREATE INDEX IF NOT EXISTS ix_jobs_dedupe_key ON jobs (dedupe_key);
@@ -0,0 +1,4 @@
+-- Which encryption key users' tokens are under, so reads skip trial decryption.
+-- New deployments get this column from db.create_all(); run this on existing ones.
+-- Existing rows start as NULL (every key is tried) until `flask rotate-token-keys` stamps them.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS token_key_id VARCHAR(16);
@@ -0,0 +1,13 @@
+-- Inverted index of users' latest top artists/tracks/genres, for /api/compare and /api/similar.
+-- New deployments get this table from db.create_all(); run this on existing ones,
+-- then `flask rebuild-insights` to fill it from stored snapshots.
+CREATE TABLE IF NOT EXISTS user_items (
+    time_range VARCHAR(16) NOT NULL,
+    item_type VARCHAR(16) NOT NULL,
+    item_id VARCHAR(128) NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    rank INTEGER NOT NULL,
+    weight DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (time_range, item_type, item_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS ix_user_items_user_range_type ON user_items (user_id, time_range, item_type);
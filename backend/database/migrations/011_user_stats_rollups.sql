@@ -0,0 +1,14 @@
+-- Daily/weekly summaries of user_stats snapshots past raw retention (`flask prune-stats`).
+-- New deployments get this table from db.create_all(); run this on existing ones.
+CREATE TABLE IF NOT EXISTS user_stats_rollups (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    data_type VARCHAR(16) NOT NULL,
+    time_range VARCHAR(16) NOT NULL,
+    period VARCHAR(8) NOT NULL,
+    period_start DATE NOT NULL,
+    items JSON NOT NULL,
+    snapshot_count INTEGER NOT NULL DEFAULT 0,
+    first_at TIMESTAMP,
+    last_at TIMESTAMP,
+    PRIMARY KEY (user_id, data_type, time_range, period, period_start)
+);
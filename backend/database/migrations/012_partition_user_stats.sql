@@ -0,0 +1,56 @@
+-- Optional, Postgres 11+ only: turn user_stats into a table partitioned by month
+-- on created_at, named user_stats_YYYY_MM. `flask prune-stats` then drops whole
+-- expired months instead of deleting rows, which leaves no dead tuples to vacuum
+-- and no index bloat. New deployments get a plain table from db.create_all();
+-- run this on either kind to convert it.
+-- The table is locked while its rows are copied, so run it in a maintenance window.
+-- Afterwards keep partitions created ahead of time with `flask partition-stats`
+-- (the statify-retention cron job runs it daily); rows outside every month land
+-- in user_stats_default.
+BEGIN;
+
+ALTER TABLE user_stats RENAME TO user_stats_unpartitioned;
+ALTER INDEX IF EXISTS ix_user_stats_user_type_range_created RENAME TO ix_user_stats_unpartitioned_user_type_range_created;
+ALTER INDEX IF EXISTS ix_user_stats_user_created_id RENAME TO ix_user_stats_unpartitioned_user_created_id;
+
+-- The partition key has to be part of the primary key
+CREATE TABLE user_stats (
+    id INTEGER NOT NULL DEFAULT nextval('user_stats_id_seq'),
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    time_range VARCHAR(16) NOT NULL,
+    data_type VARCHAR(16) NOT NULL,
+    data JSON,
+    item_ids JSON,
+    item_total INTEGER,
+    content_hash VARCHAR(64),
+    created_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+CREATE INDEX ix_user_stats_user_type_range_created ON user_stats (user_id, data_type, time_range, created_at);
+CREATE INDEX ix_user_stats_user_created_id ON user_stats (user_id, created_at, id);
+CREATE TABLE user_stats_default PARTITION OF user_stats DEFAULT;
+
+-- One partition per month from the oldest snapshot to three months ahead
+DO $$
+DECLARE
+    month DATE;
+BEGIN
+    FOR month IN
+        SELECT generate_series(first_month, date_trunc('month', now()) + interval '3 months', interval '1 month')::date
+        FROM (SELECT date_trunc('month', COALESCE(MIN(created_at), now())) AS first_month FROM user_stats_unpartitioned) bounds
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF user_stats FOR VALUES FROM (%L) TO (%L)',
+            'user_stats_' || to_char(month, 'YYYY_MM'), month, (month + interval '1 month')::date
+        );
+    END LOOP;
+END $$;
+
+INSERT INTO user_stats (id, user_id, time_range, data_type, data, item_ids, item_total, content_hash, created_at)
+SELECT id, user_id, time_range, data_type, data, item_ids, item_total, content_hash, COALESCE(created_at, now())
+FROM user_stats_unpartitioned;
+
+ALTER SEQUENCE user_stats_id_seq OWNED BY user_stats.id;
+DROP TABLE user_stats_unpartitioned;
+
+COMMIT;
@@ -0,0 +1,11 @@
+-- Who may be compared with whom (/api/compare, /api/similar): users who opted in,
+-- and pairs of users who have added each other as friends.
+-- New deployments get these from db.create_all(); run this on existing ones.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS discoverable BOOLEAN NOT NULL DEFAULT FALSE;
+CREATE TABLE IF NOT EXISTS friendships (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    friend_id INTEGER NOT NULL REFERENCES users(id),
+    created_at TIMESTAMP,
+    PRIMARY KEY (user_id, friend_id)
+);
+CREATE INDEX IF NOT EXISTS ix_friendships_friend_id ON friendships (friend_id);
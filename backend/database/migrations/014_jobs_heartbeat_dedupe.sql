@@ -0,0 +1,12 @@
+-- Job heartbeats (so long-running jobs aren't re-queued as stale) and a partial
+-- unique index that makes dedupe keys hold under concurrent enqueues.
+-- New deployments get these from db.create_all(); run this on existing ones.
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP;
+-- The index can't be built while duplicates exist: fail all but the oldest queued job per key
+UPDATE jobs SET status = 'failed', error = 'Duplicate of an earlier queued job'
+WHERE status = 'queued' AND dedupe_key IS NOT NULL
+  AND id NOT IN (
+      SELECT MIN(id) FROM jobs WHERE status IN ('queued', 'running') AND dedupe_key IS NOT NULL GROUP BY dedupe_key
+  );
+DROP INDEX IF EXISTS ix_jobs_dedupe_key;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_jobs_dedupe_key_active ON jobs (dedupe_key) WHERE status IN ('queued', 'running');
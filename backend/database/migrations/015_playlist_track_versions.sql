@@ -0,0 +1,16 @@
+-- Playlist tracks are stored per version and switched in one transaction, so readers
+-- never see a playlist half re-synced. The stored tracks are only a copy of
+-- Spotify's, so the table is recreated (portable to SQLite, which can't change a
+-- primary key in place) and every playlist is re-fetched by its next sync.
+-- New deployments get these from db.create_all(); run this on existing ones.
+DROP TABLE IF EXISTS playlist_tracks;
+CREATE TABLE playlist_tracks (
+    playlist_id VARCHAR(64) NOT NULL REFERENCES playlists(id),
+    version VARCHAR(24) NOT NULL,
+    position INTEGER NOT NULL,
+    track_id VARCHAR(64),
+    added_at TIMESTAMP,
+    PRIMARY KEY (playlist_id, version, position)
+);
+ALTER TABLE playlists ADD COLUMN tracks_version VARCHAR(24);
+UPDATE playlists SET synced_snapshot_id = NULL;
@@ -0,0 +1,6 @@
+-- Index for /api/stats without type/time_range filters, which pages through a
+-- user's whole history by (created_at, id); 003's index only serves it filtered.
+-- On PostgreSQL, CONCURRENTLY avoids locking writes while it builds. Drop it on
+-- SQLite. 012 creates it itself on the partitioned table.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_stats_user_created_id
+    ON user_stats (user_id, created_at, id);
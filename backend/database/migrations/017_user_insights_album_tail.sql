@@ -0,0 +1,4 @@
+-- `album_plays` now keeps only the most played albums; `album_tail` records the
+-- highest count trimmed from it. New deployments get this from db.create_all();
+-- run this on existing ones. Existing tallies are trimmed by their next update.
+ALTER TABLE user_insights ADD COLUMN IF NOT EXISTS album_tail INTEGER DEFAULT 0;
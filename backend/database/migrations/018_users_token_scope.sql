@@ -0,0 +1,4 @@
+-- The OAuth scopes each user granted, so library sync can tell tokens that predate
+-- the library scopes apart. New deployments get this column from db.create_all();
+-- run this on existing ones. Existing rows stay NULL (unknown) until the user logs in again.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS token_scope TEXT;
@@ -0,0 +1,4 @@
+-- Token refresh claims across workers (see app/tokens.py), replacing the row lock
+-- that was held for the whole OAuth round trip. New deployments get this column
+-- from db.create_all(); run this on existing ones.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS token_refreshing_until TIMESTAMP;
@@ -1,6 +1,10 @@
+import logging
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from database.encryption import encrypt_token, decrypt_token
+from database.encryption import encrypt_token_with_id, decrypt_token, primary_key_id, TokenDecryptError
+from database.token_cache import token_cache
+
+logger = logging.getLogger(__name__)
 
 db = SQLAlchemy()
 
@@ -13,27 +17,76 @@ class User(db.Model):
     display_name = db.Column(db.String(128))
     email = db.Column(db.String(128))
     profile_image = db.Column(db.Text)
+    discoverable = db.Column(db.Boolean, nullable=False, default=False)  # opted in to /api/similar and /api/compare
     _access_token = db.Column('access_token', db.Text)
     _refresh_token = db.Column('refresh_token', db.Text)
+    token_key_id = db.Column(db.String(16))  # key both tokens are encrypted with; NULL = unknown/plaintext
+    token_scope = db.Column(db.Text)  # scopes the user granted, space separated; NULL = granted before it was stored
     token_expiration = db.Column(db.DateTime)
+    token_refreshing_until = db.Column(db.DateTime)  # a worker's claim on refreshing the tokens (see app/tokens.py)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     @property
     def access_token(self):
-        return decrypt_token(self._access_token)
+        cached = token_cache.get(self.id, self._access_token)
+        if cached is not None:
+            return cached
+        plaintext = decrypt_token(self._access_token, self.token_key_id)
+        token_cache.put(self.id, self._access_token, plaintext, self.token_expiration)
+        return plaintext
 
     @access_token.setter
     def access_token(self, value):
-        self._access_token = encrypt_token(value)
+        self._set_token('_access_token', value)
 
     @property
     def refresh_token(self):
-        return decrypt_token(self._refresh_token)
+        return decrypt_token(self._refresh_token, self.token_key_id)
 
     @refresh_token.setter
     def refresh_token(self, value):
-        self._refresh_token = encrypt_token(value)
+        self._set_token('_refresh_token', value)
+
+    def _set_token(self, column, value):
+        """Store one token, writing `token_key_id` together with its ciphertext.
+
+        The other token is brought to the primary key first. If that fails (no
+        configured key decrypts it), the columns are under different keys and
+        `token_key_id` is cleared, so reads try every key.
+        """
+        self.reencrypt_tokens()
+        other = self._refresh_token if column == '_access_token' else self._access_token
+        consistent = not other or self.token_key_id == primary_key_id()
+        ciphertext, key_id = encrypt_token_with_id(value)
+        setattr(self, column, ciphertext)
+        self.token_key_id = key_id if consistent else None
+        if self.id is not None:
+            token_cache.invalidate(self.id)
+
+    def reencrypt_tokens(self):
+        """Bring both tokens to the primary key, keeping `token_key_id` true for both columns.
+        Returns True if anything changed.
+
+        A row whose tokens no configured key can decrypt (its key was removed) is
+        left untouched, `token_key_id` included, so it can still be recovered by
+        putting the old key back and is picked up again by the next rotation run.
+        """
+        key_id = primary_key_id()
+        if self.token_key_id == key_id:
+            return False
+        try:
+            access_token = decrypt_token(self._access_token, self.token_key_id, strict=True)
+            refresh_token = decrypt_token(self._refresh_token, self.token_key_id, strict=True)
+        except TokenDecryptError:
+            logger.warning("Could not re-encrypt tokens for user %s: no configured key decrypts them.", self.id)
+            return False
+        self._access_token, key_id = encrypt_token_with_id(access_token)
+        self._refresh_token, key_id = encrypt_token_with_id(refresh_token)
+        self.token_key_id = key_id
+        if self.id is not None:
+            token_cache.invalidate(self.id)
+        return True
 
     def __init__(self, spotify_id, display_name=None, email=None, profile_image=None,
                  access_token=None, refresh_token=None, token_expiration=None):
@@ -55,6 +108,7 @@ class User(db.Model):
             'display_name': self.display_name,
             'email': self.email,
             'profile_image': self.profile_image,
+            'discoverable': bool(self.discoverable),
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -63,22 +117,436 @@ class User(db.Model):
 class UserStats(db.Model):
     """Model for storing user's Spotify statistics"""
     __tablename__ = 'user_stats'
+    __table_args__ = (
+        # Serves /api/stats history pages and "latest snapshot" lookups
+        db.Index('ix_user_stats_user_type_range_created', 'user_id', 'data_type', 'time_range', 'created_at'),
+        # Unfiltered /api/stats history: ORDER BY created_at, id for one user
+        db.Index('ix_user_stats_user_created_id', 'user_id', 'created_at', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     time_range = db.Column(db.String(16), nullable=False)  # short_term, medium_term, long_term
     data_type = db.Column(db.String(16), nullable=False)  # artists, tracks, genres
-    data = db.Column(db.JSON, nullable=False)
+    data = db.Column(db.JSON(none_as_null=True))  # raw payload; NULL once compacted into item_ids
+    item_ids = db.Column(db.JSON(none_as_null=True))  # ordered SpotifyItem ids, list index = rank
+    item_total = db.Column(db.Integer)  # Spotify's `total` for the compacted page
+    content_hash = db.Column(db.String(64))  # SHA-256 of the raw payload, used to skip identical snapshots
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     user = db.relationship('User', backref=db.backref('stats', lazy=True))
 
-    def __init__(self, user_id, time_range, data_type, data):
+    def __init__(self, user_id, time_range, data_type, data=None, content_hash=None,
+                 item_ids=None, item_total=None):
         self.user_id = user_id
         self.time_range = time_range
         self.data_type = data_type
         self.data = data
+        self.content_hash = content_hash
+        self.item_ids = item_ids
+        self.item_total = item_total
 
     def __repr__(self):
         return f'<UserStats {self.user_id} {self.time_range} {self.data_type}>'
 
+
+class UserStatsRollup(db.Model):
+    """Daily or weekly summary of `user_stats` snapshots older than raw retention.
+
+    Items are scored like the genre distribution: each snapshot gives an item
+    (list length - rank index) points, genres their rank-weighted count, and a
+    rollup holds the sum over its snapshots. See database/retention.py.
+    """
+    __tablename__ = 'user_stats_rollups'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    data_type = db.Column(db.String(16), primary_key=True)  # artists, tracks, genres
+    time_range = db.Column(db.String(16), primary_key=True)  # short_term, medium_term, long_term
+    period = db.Column(db.String(8), primary_key=True)  # day, week
+    period_start = db.Column(db.Date, primary_key=True)  # the day, or the Monday of the week
+    items = db.Column(db.JSON, nullable=False)  # [[item id or genre, score], ...], best first
+    snapshot_count = db.Column(db.Integer, nullable=False, default=0)
+    first_at = db.Column(db.DateTime)  # oldest snapshot rolled up
+    last_at = db.Column(db.DateTime)  # newest snapshot rolled up
+
+    def __init__(self, user_id, data_type, time_range, period, period_start):
+        self.user_id = user_id
+        self.data_type = data_type
+        self.time_range = time_range
+        self.period = period
+        self.period_start = period_start
+        self.items = []
+        self.snapshot_count = 0
+
+    def __repr__(self):
+        return f'<UserStatsRollup {self.user_id} {self.data_type} {self.time_range} {self.period} {self.period_start}>'
+
+    def to_dict(self):
+        return {
+            'data_type': self.data_type,
+            'time_range': self.time_range,
+            'period': self.period,
+            'period_start': self.period_start.isoformat(),
+            'items': [{'id': item_id, 'score': score} for item_id, score in self.items],
+            'snapshot_count': self.snapshot_count,
+            'first_at': self.first_at.isoformat() if self.first_at else None,
+            'last_at': self.last_at.isoformat() if self.last_at else None,
+        }
+
+
+class SpotifyItem(db.Model):
+    """Deduplicated artist/track metadata shared by every compacted snapshot"""
+    __tablename__ = 'spotify_items'
+
+    item_type = db.Column(db.String(16), primary_key=True)  # artists, tracks
+    id = db.Column(db.String(64), primary_key=True)  # Spotify ID
+    data = db.Column(db.JSON, nullable=False)  # trimmed projection, see database/compaction.py
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __init__(self, item_type, id, data):
+        self.item_type = item_type
+        self.id = id
+        self.data = data
+
+    def __repr__(self):
+        return f'<SpotifyItem {self.item_type} {self.id}>'
+
+
+class Play(db.Model):
+    """A single play from the user's listening history, ingested from recently played"""
+    __tablename__ = 'plays'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'track_id', 'played_at', name='uq_plays_user_track_played'),
+        db.Index('ix_plays_user_played', 'user_id', 'played_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    track_id = db.Column(db.String(64), nullable=False)  # SpotifyItem id (item_type='tracks')
+    played_at = db.Column(db.DateTime, nullable=False)  # UTC
+    context_uri = db.Column(db.String(128))  # playlist/album/artist the play came from
+
+    def __init__(self, user_id, track_id, played_at, context_uri=None):
+        self.user_id = user_id
+        self.track_id = track_id
+        self.played_at = played_at
+        self.context_uri = context_uri
+
+    def __repr__(self):
+        return f'<Play {self.user_id} {self.track_id} {self.played_at}>'
+
+
+class UserInsights(db.Model):
+    """Precomputed insights per (user, time_range), updated incrementally.
+
+    Rows for Spotify's time ranges are maintained from top artist/track snapshots;
+    the `all` row is maintained from ingested plays. See app/materialized.py.
+    """
+    __tablename__ = 'user_insights'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    time_range = db.Column(db.String(16), primary_key=True)  # short_term, medium_term, long_term, all
+    # From top artist/track snapshots
+    top_genres = db.Column(db.JSON(none_as_null=True))
+    top_albums = db.Column(db.JSON(none_as_null=True))
+    decades = db.Column(db.JSON(none_as_null=True))
+    artist_ids = db.Column(db.JSON(none_as_null=True))  # latest ranking, diffed against the next snapshot
+    track_ids = db.Column(db.JSON(none_as_null=True))
+    artist_deltas = db.Column(db.JSON(none_as_null=True))
+    track_deltas = db.Column(db.JSON(none_as_null=True))
+    # From ingested plays
+    listening_slots = db.Column(db.JSON(none_as_null=True))  # plays per UTC 15-minute slot of the week
+    album_plays = db.Column(db.JSON(none_as_null=True))  # album id -> play count, most played albums only
+    album_tail = db.Column(db.Integer, default=0)  # highest count trimmed from album_plays
+    play_count = db.Column(db.Integer, default=0)
+    last_played_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __init__(self, user_id, time_range):
+        self.user_id = user_id
+        self.time_range = time_range
+        self.play_count = 0
+
+    def __repr__(self):
+        return f'<UserInsights {self.user_id} {self.time_range}>'
+
+
+class UserItem(db.Model):
+    """Inverted index of every user's latest top artists, tracks and genres.
+
+    One posting per (time_range, item_type, item_id, user), replaced whenever a
+    new snapshot is materialized. The primary key leads with the item, so finding
+    everyone who shares an item is an index range scan. See app/compare.py.
+    """
+    __tablename__ = 'user_items'
+    __table_args__ = (
+        # A user's own postings, for comparisons and for replacing them
+        db.Index('ix_user_items_user_range_type', 'user_id', 'time_range', 'item_type'),
+    )
+
+    time_range = db.Column(db.String(16), primary_key=True)  # short_term, medium_term, long_term
+    item_type = db.Column(db.String(16), primary_key=True)  # artists, tracks, genres
+    item_id = db.Column(db.String(128), primary_key=True)  # Spotify ID, or the genre name
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    rank = db.Column(db.Integer, nullable=False)  # 1 = top
+    weight = db.Column(db.Float, nullable=False)  # the item's component of the user's vector
+
+    def __init__(self, time_range, item_type, item_id, user_id, rank, weight):
+        self.time_range = time_range
+        self.item_type = item_type
+        self.item_id = item_id
+        self.user_id = user_id
+        self.rank = rank
+        self.weight = weight
+
+    def __repr__(self):
+        return f'<UserItem {self.user_id} {self.time_range} {self.item_type} {self.item_id}>'
+
+
+class Friendship(db.Model):
+    """One user adding another as a friend.
+
+    Links are one-way: two users are friends once each has added the other, and
+    only then may they compare their tops (unless the other user is
+    `discoverable`). See app/compare.py.
+    """
+    __tablename__ = 'friendships'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    friend_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __init__(self, user_id, friend_id):
+        self.user_id = user_id
+        self.friend_id = friend_id
+
+    def __repr__(self):
+        return f'<Friendship {self.user_id} -> {self.friend_id}>'
+
+
+class TrackFeatures(db.Model):
+    """Spotify audio features per track, shared by every user (they never change)"""
+    __tablename__ = 'track_features'
+
+    id = db.Column(db.String(64), primary_key=True)  # Spotify track ID
+    available = db.Column(db.Boolean, nullable=False, default=True)  # False if Spotify has no features
+    danceability = db.Column(db.Float)
+    energy = db.Column(db.Float)
+    valence = db.Column(db.Float)
+    acousticness = db.Column(db.Float)
+    instrumentalness = db.Column(db.Float)
+    speechiness = db.Column(db.Float)
+    liveness = db.Column(db.Float)
+    loudness = db.Column(db.Float)
+    tempo = db.Column(db.Float)
+    key = db.Column(db.Integer)
+    mode = db.Column(db.Integer)
+    time_signature = db.Column(db.Integer)
+    duration_ms = db.Column(db.Integer)
+    fetched_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    FEATURES = ('danceability', 'energy', 'valence', 'acousticness', 'instrumentalness',
+                'speechiness', 'liveness', 'loudness', 'tempo', 'key', 'mode',
+                'time_signature', 'duration_ms')
+
+    def __init__(self, id, features=None):
+        self.id = id
+        self.available = features is not None
+        for name in self.FEATURES:
+            setattr(self, name, (features or {}).get(name))
+
+    def __repr__(self):
+        return f'<TrackFeatures {self.id}>'
+
+    def to_dict(self):
+        """Feature values, or None if Spotify has none for this track."""
+        if not self.available:
+            return None
+        return {name: getattr(self, name) for name in self.FEATURES}
+
+
+class SavedTrack(db.Model):
+    """A track in the user's Liked Songs, mirrored by the library sync"""
+    __tablename__ = 'saved_tracks'
+    __table_args__ = (
+        db.Index('ix_saved_tracks_user_added', 'user_id', 'added_at'),
+    )
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    track_id = db.Column(db.String(64), primary_key=True)  # SpotifyItem id (item_type='tracks')
+    added_at = db.Column(db.DateTime, nullable=False)  # UTC
+    synced_at = db.Column(db.DateTime)  # start of the sync that last saw it; older rows are pruned by full syncs
+
+    def __init__(self, user_id, track_id, added_at, synced_at=None):
+        self.user_id = user_id
+        self.track_id = track_id
+        self.added_at = added_at
+        self.synced_at = synced_at
+
+    def __repr__(self):
+        return f'<SavedTrack {self.user_id} {self.track_id}>'
+
+
+class Playlist(db.Model):
+    """Playlist metadata, shared by every user who has the playlist in their library"""
+    __tablename__ = 'playlists'
+
+    id = db.Column(db.String(64), primary_key=True)  # Spotify ID
+    name = db.Column(db.String(256))
+    owner_id = db.Column(db.String(64))
+    image_url = db.Column(db.Text)
+    tracks_total = db.Column(db.Integer)
+    snapshot_id = db.Column(db.String(128))  # Spotify's version of the playlist
+    synced_snapshot_id = db.Column(db.String(128))  # Spotify version whose tracks are stored in playlist_tracks
+    tracks_version = db.Column(db.String(24))  # the playlist_tracks.version readers see (app/library.py)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __init__(self, id, name=None, owner_id=None, image_url=None, tracks_total=None, snapshot_id=None):
+        self.id = id
+        self.name = name
+        self.owner_id = owner_id
+        self.image_url = image_url
+        self.tracks_total = tracks_total
+        self.snapshot_id = snapshot_id
+
+    def __repr__(self):
+        return f'<Playlist {self.id}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'owner_id': self.owner_id,
+            'image_url': self.image_url,
+            'tracks_total': self.tracks_total,
+            'synced': self.synced_snapshot_id is not None and self.synced_snapshot_id == self.snapshot_id,
+        }
+
+
+class UserPlaylist(db.Model):
+    """A playlist in a user's library, in the order Spotify lists them"""
+    __tablename__ = 'user_playlists'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    playlist_id = db.Column(db.String(64), db.ForeignKey('playlists.id'), primary_key=True)
+    position = db.Column(db.Integer, nullable=False)
+    synced_at = db.Column(db.DateTime)  # start of the sync that last saw it
+
+    def __init__(self, user_id, playlist_id, position, synced_at=None):
+        self.user_id = user_id
+        self.playlist_id = playlist_id
+        self.position = position
+        self.synced_at = synced_at
+
+
+class PlaylistTrack(db.Model):
+    """One entry of a playlist's track list, in one stored version of that list"""
+    __tablename__ = 'playlist_tracks'
+
+    playlist_id = db.Column(db.String(64), db.ForeignKey('playlists.id'), primary_key=True)
+    version = db.Column(db.String(24), primary_key=True)  # live if it is the playlist's tracks_version
+    position = db.Column(db.Integer, primary_key=True)
+    track_id = db.Column(db.String(64))  # None for local files
+    added_at = db.Column(db.DateTime)
+
+    def __init__(self, playlist_id, version, position, track_id, added_at=None):
+        self.playlist_id = playlist_id
+        self.version = version
+        self.position = position
+        self.track_id = track_id
+        self.added_at = added_at
+
+
+class SyncState(db.Model):
+    """Progress checkpoint of a user's library sync, one row per kind"""
+    __tablename__ = 'sync_states'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    kind = db.Column(db.String(32), primary_key=True)  # saved_tracks, playlists
+    status = db.Column(db.String(16), nullable=False, default='idle')  # idle, running, complete, failed, needs_consent
+    cursor = db.Column(db.Integer, nullable=False, default=0)  # offset to resume from
+    total = db.Column(db.Integer)
+    high_water = db.Column(db.DateTime)  # newest added_at seen by the last complete sync
+    started_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    error = db.Column(db.Text)
+
+    def __init__(self, user_id, kind):
+        self.user_id = user_id
+        self.kind = kind
+        self.status = 'idle'
+        self.cursor = 0
+
+    def __repr__(self):
+        return f'<SyncState {self.user_id} {self.kind} {self.status}>'
+
+    def to_dict(self):
+        return {
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.total if self.status == 'complete' else self.cursor,
+            'total': self.total,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'error': self.error,
+        }
+
+
+class Job(db.Model):
+    """Background job, run by worker.py (see app/jobs.py)"""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # Serves the worker's "next runnable job" query
+        db.Index('ix_jobs_status_priority_run_at', 'status', 'priority', 'run_at'),
+        # At most one queued/running job per dedupe key, even when two enqueues race
+        db.Index('ux_jobs_dedupe_key_active', 'dedupe_key', unique=True,
+                 postgresql_where=db.text("status IN ('queued', 'running')"),
+                 sqlite_where=db.text("status IN ('queued', 'running')")),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)  # sync-top-items, ingest-recent-plays, sync-library, reencrypt-tokens
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    payload = db.Column(db.JSON(none_as_null=True))
+    status = db.Column(db.String(16), nullable=False, default='queued')  # queued, running, succeeded, failed
+    priority = db.Column(db.Integer, nullable=False, default=0)  # higher runs first
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    dedupe_key = db.Column(db.String(128))  # at most one queued/running job per key
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # not before (retry backoff)
+    locked_by = db.Column(db.String(64))
+    locked_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)  # last sign of life from the worker running it
+    result = db.Column(db.JSON(none_as_null=True))
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __init__(self, kind, user_id=None, payload=None, priority=0, max_attempts=3, dedupe_key=None):
+        self.kind = kind
+        self.user_id = user_id
+        self.payload = payload
+        self.status = 'queued'
+        self.priority = priority
+        self.attempts = 0
+        self.max_attempts = max_attempts
+        self.dedupe_key = dedupe_key
+        self.run_at = datetime.utcnow()
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'priority': self.priority,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'result': self.result,
+            'error': self.error,
+            'run_at': self.run_at.isoformat() if self.run_at else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
@@ -0,0 +1,323 @@
+"""
+Retention for `user_stats`: raw snapshots are kept for a while, then rolled up.
+
+- Snapshots older than the raw retention are summed into one `day` rollup per
+  (user, data_type, time_range, day) in `user_stats_rollups`, and deleted.
+  The newest `keep_latest` snapshots of each (user, data_type, time_range) are
+  always kept, however old: `latest_snapshot()`, `flask rebuild-insights` and
+  the compare index are built from them, so inactive users don't lose their tops.
+- Day rollups older than the daily retention are merged into `week` rollups,
+  which are kept.
+
+On a plain table raw rows are deleted in primary-key order, one committed batch
+at a time, and each batch is rolled up in the same transaction as its delete,
+so an interrupted run never counts a snapshot twice. When `user_stats` is
+partitioned by month (Postgres, see migrations/012_partition_user_stats.sql),
+whole months past retention are rolled up and dropped instead: dropping a
+partition leaves nothing behind for vacuum, and the other partitions' indexes
+are untouched. The newest snapshots found in a dropped month are moved to
+`user_stats_default`, where they are pruned row by row once superseded.
+
+`table_report()` gives row counts and sizes for every table, so the effect is
+visible (`flask table-report`).
+"""
+import re
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import inspect, select, text
+from sqlalchemy.orm import aliased
+
+from database.models import db, UserStats, UserStatsRollup
+
+MAX_ROLLUP_ITEMS = 100  # items kept per rollup, by score
+KEEP_LATEST = 2  # newest snapshots per (user, data_type, time_range) never pruned
+PARTITION_NAME = re.compile(r'^user_stats_(\d{4})_(\d{2})$')
+
+
+def snapshot_scores(snapshot):
+    """{item id or genre: points} for one snapshot; higher-ranked items score more."""
+    data = snapshot.data or {}
+    if snapshot.data_type == 'genres':
+        return {genre['name']: genre['count'] for genre in data.get('genres', [])}
+    ids = snapshot.item_ids
+    if ids is None:
+        ids = [item['id'] for item in data.get('items', []) if item and item.get('id')]
+    scores = {}
+    for rank, item_id in enumerate(ids):
+        scores.setdefault(item_id, len(ids) - rank)
+    return scores
+
+
+def _week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def _merge(rollup, scores, snapshot_count, first_at, last_at):
+    merged = dict(rollup.items)
+    for item_id, score in scores.items():
+        merged[item_id] = merged.get(item_id, 0) + score
+    ranked = sorted(merged.items(), key=lambda entry: (-entry[1], entry[0]))[:MAX_ROLLUP_ITEMS]
+    rollup.items = [[item_id, score] for item_id, score in ranked]
+    rollup.snapshot_count += snapshot_count
+    rollup.first_at = min(filter(None, (rollup.first_at, first_at)), default=None)
+    rollup.last_at = max(filter(None, (rollup.last_at, last_at)), default=None)
+
+
+def _apply(period, summaries):
+    """Merge {(user_id, data_type, time_range, period_start): [scores, count, first_at, last_at]}
+    into the stored rollups, locking the ones that exist. Caller commits."""
+    if not summaries:
+        return
+    existing = {
+        (row.user_id, row.data_type, row.time_range, row.period_start): row
+        for row in UserStatsRollup.query.filter(
+            UserStatsRollup.user_id.in_({key[0] for key in summaries}),
+            UserStatsRollup.period == period,
+            UserStatsRollup.period_start.in_({key[3] for key in summaries}),
+        ).with_for_update().populate_existing()
+    }
+    for key, (scores, count, first_at, last_at) in summaries.items():
+        rollup = existing.get(key)
+        if rollup is None:
+            user_id, data_type, time_range, period_start = key
+            rollup = UserStatsRollup(user_id, data_type, time_range, period, period_start)
+            db.session.add(rollup)
+        _merge(rollup, scores, count, first_at, last_at)
+
+
+def roll_up_snapshots(snapshots):
+    """Add raw snapshots to their day rollups. Caller deletes the snapshots and commits."""
+    summaries = {}
+    for snapshot in snapshots:
+        created_at = snapshot.created_at or datetime.utcnow()
+        key = (snapshot.user_id, snapshot.data_type, snapshot.time_range, created_at.date())
+        summary = summaries.setdefault(key, [{}, 0, created_at, created_at])
+        for item_id, score in snapshot_scores(snapshot).items():
+            summary[0][item_id] = summary[0].get(item_id, 0) + score
+        summary[1] += 1
+        summary[2] = min(summary[2], created_at)
+        summary[3] = max(summary[3], created_at)
+    _apply('day', summaries)
+
+
+def _latest(keep_latest):
+    """Correlated select of the ids of the newest `keep_latest` snapshots sharing a
+    row's (user_id, data_type, time_range); each is one short walk of that index."""
+    newer = aliased(UserStats)
+    return (
+        select(newer.id)
+        .where(newer.user_id == UserStats.user_id, newer.data_type == UserStats.data_type,
+               newer.time_range == UserStats.time_range)
+        .order_by(newer.created_at.desc(), newer.id.desc())
+        .limit(keep_latest)
+        .correlate(UserStats)
+    )
+
+
+def prune_raw(cutoff, batch_size=1000, keep_latest=KEEP_LATEST):
+    """Roll up and delete snapshots created before `cutoff`, one committed batch at a time,
+    except the newest `keep_latest` of each (user, data_type, time_range).
+
+    Returns the number of snapshots deleted.
+    """
+    total = 0
+    last_id = 0
+    while True:
+        batch = (
+            UserStats.query
+            .filter(UserStats.id > last_id, UserStats.created_at < cutoff,
+                    UserStats.id.not_in(_latest(keep_latest)))
+            .order_by(UserStats.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            return total
+        roll_up_snapshots(batch)
+        last_id = batch[-1].id
+        UserStats.query.filter(UserStats.id.in_([s.id for s in batch])).delete(synchronize_session=False)
+        db.session.commit()
+        total += len(batch)
+
+
+def roll_up_days(cutoff, batch_size=1000):
+    """Merge day rollups for days before `cutoff` into week rollups. Returns how many were merged."""
+    total = 0
+    while True:
+        days = (
+            UserStatsRollup.query
+            .filter(UserStatsRollup.period == 'day', UserStatsRollup.period_start < cutoff)
+            .order_by(UserStatsRollup.user_id, UserStatsRollup.period_start)
+            .limit(batch_size)
+            .with_for_update()
+            .all()
+        )
+        if not days:
+            return total
+        summaries = {}
+        for day in days:
+            key = (day.user_id, day.data_type, day.time_range, _week_start(day.period_start))
+            summary = summaries.setdefault(key, [{}, 0, None, None])
+            for item_id, score in day.items:
+                summary[0][item_id] = summary[0].get(item_id, 0) + score
+            summary[1] += day.snapshot_count
+            summary[2] = min(filter(None, (summary[2], day.first_at)), default=None)
+            summary[3] = max(filter(None, (summary[3], day.last_at)), default=None)
+        for day in days:
+            db.session.delete(day)
+        db.session.flush()
+        _apply('week', summaries)
+        db.session.commit()
+        total += len(days)
+
+
+def is_partitioned():
+    """True if `user_stats` is a partitioned Postgres table."""
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    kind = db.session.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('user_stats')")).scalar()
+    return kind == 'p'
+
+
+def _month_after(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def partitions():
+    """{partition name: first day of its month} for the monthly partitions of `user_stats`."""
+    names = db.session.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass('user_stats')"
+    )).scalars()
+    months = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months[name] = date(int(match.group(1)), int(match.group(2)), 1)
+    return months
+
+
+def ensure_partitions(months_ahead=3, today=None):
+    """Create the monthly partitions from this month to `months_ahead` months ahead.
+
+    Returns the names created. Does nothing unless `user_stats` is partitioned.
+    """
+    if not is_partitioned():
+        return []
+    existing = set(partitions())
+    month = (today or date.today()).replace(day=1)
+    created = []
+    for _ in range(months_ahead + 1):
+        name = f'user_stats_{month.year:04d}_{month.month:02d}'
+        if name not in existing:
+            db.session.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF user_stats "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_month_after(month).isoformat()}')"
+            ))
+            created.append(name)
+        month = _month_after(month)
+    db.session.commit()
+    return created
+
+
+def drop_expired_partitions(cutoff, batch_size=1000, keep_latest=KEEP_LATEST):
+    """Roll up and drop every monthly partition that ends on or before `cutoff`.
+
+    Each partition is rolled up and dropped in one transaction, after its rows
+    among the newest `keep_latest` of their (user, data_type, time_range) are
+    copied out; with no partition left for their month they land in
+    `user_stats_default`. Returns the names dropped.
+    """
+    dropped = []
+    for name, month in sorted(partitions().items(), key=lambda entry: entry[1]):
+        end = _month_after(month)
+        if datetime.combine(end, datetime.min.time()) > cutoff:
+            continue
+        # The created_at range lets Postgres read only this partition
+        in_month = (UserStats.created_at >= month, UserStats.created_at < end)
+        kept = [
+            dict(row._mapping) for row in db.session.execute(
+                select(UserStats.__table__).where(*in_month, UserStats.id.in_(_latest(keep_latest)))
+            )
+        ]
+        last_id = 0
+        while True:
+            batch = (
+                UserStats.query
+                .filter(*in_month, UserStats.id > last_id, UserStats.id.not_in(_latest(keep_latest)))
+                .order_by(UserStats.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not batch:
+                break
+            roll_up_snapshots(batch)
+            last_id = batch[-1].id
+            db.session.flush()
+            db.session.expunge_all()
+        db.session.execute(text(f'DROP TABLE {name}'))
+        if kept:
+            db.session.execute(UserStats.__table__.insert(), kept)
+        db.session.commit()
+        dropped.append(name)
+    return dropped
+
+
+def prune(raw_days, daily_days, batch_size=1000, keep_latest=KEEP_LATEST, now=None):
+    """Apply the retention policy. Returns a summary of what was done."""
+    now = now or datetime.utcnow()
+    raw_cutoff = now - timedelta(days=raw_days)
+    summary = {'deleted': 0, 'partitions_dropped': []}
+    if is_partitioned():
+        summary['partitions_dropped'] = drop_expired_partitions(raw_cutoff, batch_size, keep_latest)
+        # Only rows older than every monthly partition, i.e. in user_stats_default
+        months = partitions().values()
+        if months:
+            raw_cutoff = min(raw_cutoff, datetime.combine(min(months), datetime.min.time()))
+    summary['deleted'] = prune_raw(raw_cutoff, batch_size, keep_latest)
+    summary['days_rolled_up'] = roll_up_days((now - timedelta(days=daily_days)).date(), batch_size)
+    return summary
+
+
+def table_report():
+    """Rows and on-disk size of every table, largest first.
+
+    Postgres row counts are the statistics collector's estimates, alongside its
+    dead-row counts; SQLite counts are exact and sizes come from `dbstat` when
+    SQLite was built with it.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        rows = db.session.execute(text(
+            "SELECT c.relname, c.relkind, s.n_live_tup, s.n_dead_tup, pg_table_size(c.oid), "
+            "pg_indexes_size(c.oid), pg_total_relation_size(c.oid), s.last_autovacuum "
+            "FROM pg_class c LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid "
+            "WHERE c.relnamespace = 'public'::regnamespace AND c.relkind IN ('r', 'p')"
+        ))
+        report = [{
+            'table': name, 'partitioned': kind == 'p', 'rows': live, 'dead_rows': dead,
+            'table_bytes': table_bytes, 'index_bytes': index_bytes, 'total_bytes': total_bytes,
+            'last_autovacuum': last_autovacuum.isoformat() if last_autovacuum else None,
+        } for name, kind, live, dead, table_bytes, index_bytes, total_bytes, last_autovacuum in rows]
+    else:
+        sizes = None  # (table, 'table' or 'index') -> bytes
+        try:
+            sizes = {(table, kind): size for table, kind, size in db.session.execute(text(
+                "SELECT m.tbl_name, m.type, SUM(d.pgsize) FROM dbstat d JOIN sqlite_master m ON m.name = d.name "
+                "GROUP BY m.tbl_name, m.type"
+            ))}
+        except Exception:
+            db.session.rollback()  # SQLite built without SQLITE_ENABLE_DBSTAT_VTAB
+        report = []
+        for name in inspect(db.engine).get_table_names():
+            table_bytes = index_bytes = None
+            if sizes is not None:
+                table_bytes = sizes.get((name, 'table'), 0)
+                index_bytes = sizes.get((name, 'index'), 0)
+            report.append({
+                'table': name, 'partitioned': False,
+                'rows': db.session.execute(text(f'SELECT COUNT(*) FROM "{name}"')).scalar(),
+                'dead_rows': None, 'table_bytes': table_bytes, 'index_bytes': index_bytes,
+                'total_bytes': table_bytes + index_bytes if table_bytes is not None else None,
+                'last_autovacuum': None,
+            })
+    return sorted(report, key=lambda entry: (-(entry['total_bytes'] or 0), -(entry['rows'] or 0), entry['table']))
@@ -0,0 +1,83 @@
+"""
+Per-process cache of decrypted access tokens.
+
+Decrypting with Fernet (and loading the user row to get the ciphertext) on every
+API request adds up, so the plaintext access token is kept in memory for a
+bounded time. Entries are tied to the ciphertext they were decrypted from, are
+dropped when the model setters write a new token, and never outlive the token's
+own expiry.
+
+Plaintext only ever lives in this process' memory — it is not written to the
+database, the shared response cache or disk.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+
+class TokenCache:
+    """Bounded, TTL-limited map of user id -> decrypted access token."""
+
+    def __init__(self, max_entries=10000, ttl=3000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # user_id -> (ciphertext, plaintext, token_expiration, cached_until)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_entries = app.config.get('TOKEN_CACHE_MAX_ENTRIES', self.max_entries)
+        self.ttl = app.config.get('TOKEN_CACHE_TTL', self.ttl)
+        self.clear()
+
+    def get(self, user_id, ciphertext):
+        """Return the plaintext for this exact ciphertext, or None."""
+        entry = self._lookup(user_id)
+        if entry is None or entry[0] != ciphertext:
+            return None
+        return entry[1]
+
+    def get_valid(self, user_id, min_validity):
+        """Return a cached access token that stays valid for at least `min_validity`
+        (a timedelta), without touching the database. Returns None otherwise."""
+        entry = self._lookup(user_id)
+        if entry is None:
+            return None
+        token_expiration = entry[2]
+        if not token_expiration or token_expiration < datetime.now() + min_validity:
+            return None
+        return entry[1]
+
+    def put(self, user_id, ciphertext, plaintext, token_expiration=None):
+        if self.ttl <= 0 or user_id is None or not plaintext:
+            return
+        cached_until = time.monotonic() + self.ttl
+        if token_expiration:
+            cached_until = min(cached_until, time.monotonic() + (token_expiration - datetime.now()).total_seconds())
+        with self._lock:
+            self._entries[user_id] = (ciphertext, plaintext, token_expiration, cached_until)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _lookup(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[3] <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry
+
+
+token_cache = TokenCache()
@@ -0,0 +1,93 @@
+"""
+gunicorn settings (picked up automatically from backend/).
+
+WORKER_CLASS selects the serving mode:
+
+- `sync` (default): one request per worker process at a time.
+- `gevent`: each worker serves up to GUNICORN_WORKER_CONNECTIONS requests
+  cooperatively. Almost every request spends its time waiting on Spotify,
+  so a worker yields during upstream calls instead of sitting idle. The
+  standard library is monkey-patched by the worker before the app is loaded,
+  and psycopg2 is made cooperative in `post_fork`, so the existing views,
+  spotipy client and background threads run unchanged. The app's pool sizes
+  (`GEVENT_POOL_DEFAULTS`) are raised to match, unless set explicitly.
+
+WEB_CONCURRENCY sets the number of workers (1 by default, as before this file).
+
+With GUNICORN_PRELOAD (the default), the app is imported and created once in
+the master and workers are forked from it: they boot without re-importing
+anything and share those pages copy-on-write. `gc.freeze()`, once the master
+is ready and before it forks any worker, keeps the garbage collector from
+touching, and so copying, the preloaded objects. Database connections opened by the master are discarded in every
+worker. Set GUNICORN_PRELOAD=false to load the app in each worker instead.
+
+With PROMETHEUS_MULTIPROC_DIR set, workers write metrics to files there and
+`/metrics` reports all of them together (see app/metrics.py).
+"""
+import gc
+import os
+import shutil
+
+worker_class = os.environ.get('WORKER_CLASS', 'sync')
+if worker_class not in ('sync', 'gevent'):
+    raise RuntimeError(f"Unsupported WORKER_CLASS {worker_class!r}; use 'sync' or 'gevent'")
+
+# Environment defaults for config/config.py when one worker serves hundreds of requests
+GEVENT_POOL_DEFAULTS = {
+    'SPOTIFY_HTTP_POOL_MAXSIZE': '128',
+    'DASHBOARD_MAX_WORKERS': '256',
+    'DB_POOL_SIZE': '20',
+    'DB_MAX_OVERFLOW': '20',
+}
+if worker_class == 'gevent':
+    # Set before the app (and its config) is imported, by the master or the workers
+    for name, value in GEVENT_POOL_DEFAULTS.items():
+        os.environ.setdefault(name, value)
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+if preload_app and worker_class == 'gevent':
+    # The app is imported by the master, so the standard library has to be
+    # cooperative before that rather than only in the workers
+    from gevent import monkey
+    monkey.patch_all()
+
+metrics_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+if metrics_dir:
+    # Files left by a previous run would be counted again. Cleared here, before
+    # a preloaded app opens its own files in the directory
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5001)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 500))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+accesslog = '-'
+
+
+def when_ready(server):
+    # Runs once, before the first worker is forked; workers respawned later fork
+    # from the same frozen objects
+    if preload_app:
+        gc.freeze()
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    if preload_app:
+        # Pooled connections were opened by the master (e.g. by db.create_all());
+        # drop them here without closing the master's sockets
+        from database.models import db
+        app = server.app.wsgi()
+        with app.app_context():
+            db.engine.dispose(close=False)
+    if worker_class == 'gevent':
+        # Wait on Postgres sockets through the gevent hub instead of blocking the worker
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
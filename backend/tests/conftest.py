@@ -0,0 +1,63 @@
+import pytest
+from cryptography.fernet import Fernet
+
+from app import create_app
+from app.cache import response_cache
+from config.config import TestingConfig
+from database.encryption import reset_keys
+from database.models import db as _db
+from database.token_cache import token_cache
+
+
+@pytest.fixture(scope='session')
+def app():
+    TestingConfig.SQLALCHEMY_DATABASE_URI = 'sqlite://'  # in memory, one connection shared by the app
+    TestingConfig.AUTO_CREATE_TABLES = False
+    TestingConfig.RATELIMIT_ENABLED = False
+    TestingConfig.SECRET_KEY = 'test-only-secret-key'
+    return create_app('testing')
+
+
+@pytest.fixture
+def db(app):
+    with app.app_context():
+        _db.create_all()
+        yield _db
+        _db.session.remove()
+        _db.drop_all()
+
+
+@pytest.fixture
+def client(app, db):
+    """Test client with `client.login(user_id)` to set the session."""
+    client = app.test_client()
+
+    def login(user_id):
+        with client.session_transaction() as sess:
+            sess['user_id'] = user_id
+
+    client.login = login
+    response_cache.clear()
+    return client
+
+
+@pytest.fixture
+def keys(app, monkeypatch):
+    """Set TOKEN_ENCRYPTION_KEYS in the app config: keys.use(k2, k1) configures them newest first."""
+    class Keys:
+        k1 = Fernet.generate_key().decode()
+        k2 = Fernet.generate_key().decode()
+
+        @staticmethod
+        def use(*configured):
+            monkeypatch.setitem(app.config, 'TOKEN_ENCRYPTION_KEYS', ','.join(configured))
+            reset_keys()
+            token_cache.clear()
+
+    monkeypatch.setitem(app.config, 'TOKEN_ENCRYPTION_KEY', None)
+    monkeypatch.delenv('TOKEN_ENCRYPTION_KEY', raising=False)  # the fallback when the config has none
+    monkeypatch.delenv('TOKEN_ENCRYPTION_KEYS', raising=False)
+    yield Keys
+    monkeypatch.undo()
+    reset_keys()
+    token_cache.clear()
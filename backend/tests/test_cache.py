@@ -0,0 +1,56 @@
+import app.cache as cache
+from app.cache import MemoryBackend, ResponseCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'monotonic', clock)
+    backend = MemoryBackend(max_bytes=1024)
+
+    backend.set('key', 'value', ttl=60)
+    clock.now += 59
+    assert backend.get('key') == 'value'
+
+    clock.now += 1
+    assert backend.get('key') is None
+    assert backend._size == 0  # the expired entry was removed, not just hidden
+
+
+def test_least_recently_used_entries_are_evicted_past_the_byte_budget():
+    backend = MemoryBackend(max_bytes=10)
+    backend.set('a', 'aaaa', ttl=60)
+    backend.set('b', 'bbbb', ttl=60)
+    assert backend.get('a') == 'aaaa'  # now more recent than b
+
+    backend.set('c', 'cccc', ttl=60)
+
+    assert backend.get('b') is None
+    assert backend.get('a') == 'aaaa'
+    assert backend.get('c') == 'cccc'
+    assert backend.evictions == 1
+
+    backend.set('big', 'x' * 11, ttl=60)  # larger than the whole budget: not stored
+    assert backend.get('big') is None
+    assert backend.get('a') == 'aaaa'
+
+
+def test_invalidate_drops_only_that_users_entries():
+    response_cache = ResponseCache()
+    response_cache.backend = MemoryBackend(max_bytes=1024)
+    response_cache.set(1, 'profile', {'id': 'alice'})
+    response_cache.set(1, 'top:artists', {'items': []}, time_range='short_term', limit=20)
+    response_cache.set(12, 'profile', {'id': 'bob'})
+
+    response_cache.invalidate(1)
+
+    assert response_cache.get(1, 'profile') is None
+    assert response_cache.get(1, 'top:artists', time_range='short_term', limit=20) is None
+    assert response_cache.get(12, 'profile') == {'id': 'bob'}
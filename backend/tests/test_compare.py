@@ -0,0 +1,97 @@
+import math
+
+import pytest
+
+from app.compare import add_friend, compare, index_snapshot, rank_weight, similar_users
+from database.models import User
+
+RANGE = 'medium_term'
+
+
+def add_user(db, spotify_id, artists, discoverable=False):
+    user = User(spotify_id, display_name=spotify_id)
+    user.discoverable = discoverable
+    db.session.add(user)
+    db.session.flush()
+    index_snapshot(user.id, 'artists', RANGE, [{'id': artist} for artist in artists])
+    db.session.commit()
+    return user
+
+
+def test_compare_overlap_jaccard_and_similarity(db):
+    a = add_user(db, 'a', ['x', 'y', 'z'])
+    b = add_user(db, 'b', ['y', 'x', 'w'])
+
+    result = compare(a.id, b.id, RANGE)['artists']
+
+    assert result['overlap'] == 2
+    assert result['jaccard'] == pytest.approx(2 / 4)
+    dot = 2 * rank_weight(1) * rank_weight(2)
+    norm = sum(rank_weight(rank) ** 2 for rank in (1, 2, 3))
+    assert result['similarity'] == pytest.approx(dot / norm)
+    assert [item['id'] for item in result['shared']] == ['x', 'y']
+    assert compare(a.id, a.id, RANGE)['artists']['similarity'] == pytest.approx(1.0)
+
+
+def test_similar_users_matches_pairwise_compare(db):
+    me = add_user(db, 'me', ['a', 'b', 'c', 'd'])
+    others = [
+        add_user(db, 'close', ['a', 'b', 'c', 'e'], discoverable=True),
+        add_user(db, 'far', ['d', 'f', 'g'], discoverable=True),
+        add_user(db, 'none', ['q', 'r'], discoverable=True),
+    ]
+
+    found = similar_users(me.id, RANGE)
+
+    assert [entry['spotify_id'] for entry in found] == ['close', 'far']
+    for entry, other in zip(found, others):
+        assert entry['score'] == pytest.approx(compare(me.id, other.id, RANGE)['score'])
+    assert not math.isnan(found[0]['artists']['similarity'])
+
+
+def test_similar_users_only_lists_opted_in_users_and_friends(db):
+    me = add_user(db, 'me', ['a', 'b'])
+    add_user(db, 'public', ['a'], discoverable=True)
+    add_user(db, 'private', ['a', 'b'])
+    one_way = add_user(db, 'one-way', ['a', 'b'])
+    friend = add_user(db, 'friend', ['b'])
+    add_friend(me.id, one_way.id)  # not added back
+    add_friend(me.id, friend.id)
+    add_friend(friend.id, me.id)
+    db.session.commit()
+
+    found = {entry['spotify_id'] for entry in similar_users(me.id, RANGE)}
+
+    assert found == {'public', 'friend'}
+
+
+def test_compare_endpoint_hides_users_who_did_not_opt_in(client, db):
+    me = add_user(db, 'me', ['a', 'b'])
+    add_user(db, 'private', ['a'])
+    add_user(db, 'public', ['a'], discoverable=True)
+    client.login(me.id)
+
+    assert client.get('/api/compare/private').status_code == 404
+    assert client.get('/api/compare/nobody').status_code == 404
+    assert client.get('/api/compare/public').get_json()['artists']['overlap'] == 1
+
+    # A friend request alone exposes nothing; being added back does
+    assert client.put('/api/friends/private').status_code == 200
+    assert client.get('/api/compare/private').status_code == 404
+    client.login(db.session.query(User.id).filter_by(spotify_id='private').scalar())
+    client.put('/api/friends/me')
+    client.login(me.id)
+    assert client.get('/api/compare/private').status_code == 200
+    assert [f['spotify_id'] for f in client.get('/api/friends').get_json()['friends']] == ['private']
+
+
+def test_similar_endpoint_drops_users_who_opt_out(client, db):
+    me = add_user(db, 'me', ['a'])
+    other = add_user(db, 'other', ['a'], discoverable=True)
+    client.login(me.id)
+    assert [u['spotify_id'] for u in client.get('/api/similar').get_json()['users']] == ['other']
+
+    client.login(other.id)
+    assert client.put('/api/sharing', json={'discoverable': False}).get_json() == {'discoverable': False}
+    client.login(me.id)
+    assert client.get('/api/similar').get_json()['users'] == []  # even though the result was cached
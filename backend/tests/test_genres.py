@@ -0,0 +1,20 @@
+import app.api as api
+from app.api import TIME_RANGES, aggregate_top_genres
+from app.cache import response_cache
+from database.models import User, UserStats
+
+
+def test_genres_miss_writes_one_snapshot(db, monkeypatch):
+    user = User('alice')
+    db.session.add(user)
+    db.session.commit()
+    response_cache.clear()
+    artists = {'items': [{'id': 'a1', 'name': 'A', 'genres': ['rock', 'pop']}], 'total': 1}
+    monkeypatch.setattr(api, '_latest_top_artists', lambda user_id, time_range, limit: artists)
+
+    genres = aggregate_top_genres(user.id, 'short_term', 10)
+
+    assert genres is not None
+    assert [(s.data_type, s.time_range) for s in UserStats.query] == [('genres', 'short_term')]
+    for time_range in TIME_RANGES:  # the other ranges are still served from the same pass
+        assert response_cache.get(user.id, 'top-genres', time_range=time_range, limit=10) is not None
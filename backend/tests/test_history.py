@@ -0,0 +1,57 @@
+from app.history import ingest_recent_plays, load_recent_plays
+from database.models import Play, User
+
+
+class FakeSpotify:
+    def __init__(self, items):
+        self.items = items
+
+    def current_user_recently_played(self, limit, after=None):
+        return {'items': self.items, 'cursors': None}
+
+
+def test_ingest_skips_plays_without_a_track_id(db):
+    user = User('alice')
+    db.session.add(user)
+    db.session.commit()
+    local_file = {'played_at': '2026-01-01T10:00:00Z', 'track': {'id': None, 'name': 'demo.mp3', 'is_local': True}}
+
+    assert ingest_recent_plays(FakeSpotify([local_file]), user.id) == 0
+
+    played = {'played_at': '2026-01-01T11:00:00Z', 'track': {'id': 't1', 'name': 'One'}}
+    assert ingest_recent_plays(FakeSpotify([local_file, played]), user.id) == 1
+    assert [play.track_id for play in Play.query] == ['t1']
+
+
+def test_stored_plays_are_served_in_spotifys_shape(db):
+    user = User('alice')
+    db.session.add(user)
+    db.session.commit()
+    track = {'id': 't1', 'name': 'One', 'artists': [{'id': 'a1', 'name': 'Ann'}], 'album': {'id': 'al1', 'name': 'Al'}}
+    ingest_recent_plays(FakeSpotify([
+        {'played_at': f'2026-01-01T1{hour}:00:00.000Z', 'track': track,
+         'context': {'uri': 'spotify:playlist:p1', 'type': 'playlist'}}
+        for hour in range(3)
+    ]), user.id)
+
+    page = load_recent_plays(user.id, 2)
+
+    assert page['cursors'] == {'after': '1767268800000', 'before': '1767265200000'}
+    assert page['next'] == 'https://api.spotify.com/v1/me/player/recently-played?before=1767265200000&limit=2'
+    item = page['items'][0]
+    assert item['played_at'] == '2026-01-01T12:00:00.000Z'
+    assert item['context'] == {
+        'type': 'playlist',
+        'href': 'https://api.spotify.com/v1/playlists/p1',
+        'external_urls': {'spotify': 'https://open.spotify.com/playlist/p1'},
+        'uri': 'spotify:playlist:p1',
+    }
+    assert item['track']['uri'] == 'spotify:track:t1'
+    assert item['track']['external_urls'] == {'spotify': 'https://open.spotify.com/track/t1'}
+    assert item['track']['artists'][0]['href'] == 'https://api.spotify.com/v1/artists/a1'
+    assert item['track']['album']['type'] == 'album'
+
+    last = load_recent_plays(user.id, 2, before=int(page['cursors']['before']))
+    assert [item['played_at'] for item in last['items']] == ['2026-01-01T10:00:00.000Z']
+    assert last['next'] is None
+    assert last['cursors'] == {'after': '1767261600000', 'before': '1767261600000'}
@@ -0,0 +1,31 @@
+import numpy as np
+
+from app.analytics import TrackFrame
+from app.insights import get_hours
+
+
+def test_insight_views_keep_their_metadata():
+    assert get_hours.__name__ == 'get_hours'
+    assert get_hours.__doc__.startswith('Plays per hour of day')
+    assert get_hours.__wrapped__.__module__ == 'app.insights'
+
+
+def test_track_frame_metadata_is_broadcast_per_play():
+    tracks = {
+        't1': {'album': {'id': 'a1', 'name': 'One', 'release_date': '1999-05-01'}},
+        't2': {'album': {'id': 'a1', 'name': 'One', 'release_date': '1999'}},
+        't3': {'album': {'id': 'a2', 'name': 'Two', 'release_date': 'unknown'}},
+        't4': {},
+    }
+    frame = TrackFrame(['t3', 't1', 't4', 't2', 't1'], np.ones(5), tracks=tracks)
+
+    assert frame.album_ids.tolist() == ['a2', 'a1', '', 'a1', 'a1']
+    assert frame.release_years.tolist() == [0, 1999, 0, 1999, 1999]
+    assert frame.albums == {
+        'a1': {'id': 'a1', 'name': 'One', 'images': []},
+        'a2': {'id': 'a2', 'name': 'Two', 'images': []},
+    }
+
+
+def test_insights_require_login(client):
+    assert client.get('/api/insights/hours').status_code == 401
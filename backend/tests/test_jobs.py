@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from app.jobs import JobQueue, handler, job_queue
+from database.models import Job
+
+calls = []
+
+
+@handler('test-ok')
+def ok(job):
+    calls.append(job.id)
+    return {'payload': job.payload}
+
+
+@handler('test-fail')
+def fail(job):
+    raise RuntimeError('boom')
+
+
+def run_next():
+    job = job_queue.claim()
+    assert job is not None
+    return job_queue.run_job(job), job
+
+
+def test_enqueue_dedupes_while_queued_or_running(db):
+    first = job_queue.enqueue('test-ok', 1)
+    assert job_queue.enqueue('test-ok', 1).id == first.id
+    assert job_queue.enqueue('test-ok', 2).id != first.id
+
+    bumped = job_queue.enqueue('test-ok', 1, priority=10)
+    assert bumped.id == first.id and bumped.priority == 10
+
+    job_queue.claim()
+    assert job_queue.enqueue('test-ok', 1).id == first.id  # still running
+    job_queue.run_job(db.session.get(Job, first.id))
+    assert job_queue.enqueue('test-ok', 1).id != first.id  # finished, so a new one is queued
+
+
+def test_unique_index_rejects_a_second_active_job(db):
+    db.session.add(Job('test-ok', dedupe_key='k'))
+    db.session.commit()
+    db.session.add(Job('test-ok', dedupe_key='k'))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+
+
+def test_enqueue_losing_a_race_returns_the_winners_job(db, monkeypatch):
+    winner = Job('test-ok', user_id=1, dedupe_key='test-ok:1')
+    db.session.add(winner)
+    db.session.commit()
+    # The racing enqueue checked before the winner's insert was visible
+    lookups = []
+    active_job = JobQueue.active_job
+
+    def racing_lookup(key):
+        lookups.append(key)
+        return None if len(lookups) == 1 else active_job(key)
+
+    monkeypatch.setattr(JobQueue, 'active_job', staticmethod(racing_lookup))
+
+    assert job_queue.enqueue('test-ok', 1).id == winner.id
+    assert lookups == ['test-ok:1', 'test-ok:1']
+    assert Job.query.count() == 1
+
+
+def test_run_job_records_success(db):
+    job = job_queue.enqueue('test-ok', 1, payload={'a': 1})
+    assert run_next() == (True, job)
+    job = db.session.get(Job, job.id)
+    assert (job.status, job.result, job.attempts, job.locked_by) == ('succeeded', {'payload': {'a': 1}}, 1, None)
+    assert job_queue.claim() is None
+
+
+def test_failures_back_off_then_fail(db):
+    job = job_queue.enqueue('test-fail', 1, max_attempts=2)
+
+    assert run_next()[0] is False
+    job = db.session.get(Job, job.id)
+    assert job.status == 'queued' and job.error == 'RuntimeError: boom'
+    assert job.run_at > datetime.utcnow()
+    assert job_queue.claim() is None  # backing off
+
+    job.run_at = datetime.utcnow()
+    db.session.commit()
+    run_next()
+    assert db.session.get(Job, job.id).status == 'failed'
+
+
+def stale_job(db, attempts, heartbeat_age, max_attempts=3):
+    job = Job('test-ok', max_attempts=max_attempts)
+    job.status = 'running'
+    job.attempts = attempts
+    job.locked_by = 'gone:1'
+    job.locked_at = datetime.utcnow() - timedelta(hours=2)
+    job.heartbeat_at = datetime.utcnow() - heartbeat_age
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def test_requeue_stale_uses_the_heartbeat_and_caps_attempts(db):
+    alive = stale_job(db, 1, timedelta(seconds=30))
+    dead = stale_job(db, 1, timedelta(hours=1))
+    exhausted = stale_job(db, 3, timedelta(hours=1))
+
+    assert job_queue.requeue_stale() == 1
+
+    statuses = {job.id: job.status for job in Job.query}
+    assert statuses == {alive: 'running', dead: 'queued', exhausted: 'failed'}
+
+
+def test_beat_refreshes_only_this_workers_job(db):
+    mine = stale_job(db, 1, timedelta(hours=1))
+    Job.query.filter_by(id=mine).update({'locked_by': job_queue.worker_id})
+    theirs = stale_job(db, 1, timedelta(hours=1))
+    db.session.commit()
+
+    job_queue.beat(mine)
+    job_queue.beat(theirs)
+
+    assert job_queue.requeue_stale() == 1
+    assert db.session.get(Job, mine).status == 'running'
+    assert db.session.get(Job, theirs).status == 'queued'
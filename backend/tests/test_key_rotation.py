@@ -0,0 +1,99 @@
+from database.encryption import FERNET_PREFIX, key_id_for, primary_key_id
+from database.key_rotation import pending_users, reencrypt_users
+from database.models import User
+
+
+def add_user(db, spotify_id='alice'):
+    user = User(spotify_id, access_token=f'access-{spotify_id}', refresh_token=f'refresh-{spotify_id}')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def test_rotation_moves_rows_to_the_new_key(db, keys):
+    keys.use(keys.k1)
+    users = [add_user(db, f'user{i}') for i in range(5)]
+    keys.use(keys.k2, keys.k1)
+
+    assert pending_users().count() == 5
+    total, _ = reencrypt_users(batch_size=2)
+
+    assert total == 5
+    assert pending_users().count() == 0
+    keys.use(keys.k2)  # the old key can go now
+    for i, user in enumerate(users):
+        user = db.session.get(User, user.id)
+        assert user.token_key_id == key_id_for(keys.k2)
+        assert user.access_token == f'access-user{i}'
+        assert user.refresh_token == f'refresh-user{i}'
+
+
+def test_rotation_skips_rows_whose_key_was_removed(db, keys):
+    keys.use(keys.k1)
+    user = add_user(db)
+    stored = user._access_token
+    keys.use(keys.k2)  # k1 dropped before the rotation ran
+
+    total, _ = reencrypt_users()
+
+    assert total == 0
+    user = db.session.get(User, user.id)
+    assert user._access_token == stored
+    assert user.token_key_id == key_id_for(keys.k1)
+    assert pending_users().count() == 1
+
+    keys.use(keys.k2, keys.k1)  # putting the key back recovers the row
+    assert reencrypt_users() == (1, user.id)
+    user = db.session.get(User, user.id)
+    assert user.access_token == 'access-alice'
+    assert user.refresh_token == 'refresh-alice'
+    assert user.token_key_id == key_id_for(keys.k2)
+
+
+def test_setting_one_token_keeps_the_other_recoverable(db, keys):
+    keys.use(keys.k1)
+    user = add_user(db)
+    keys.use(keys.k2)
+
+    user.access_token = 'new-access'
+    db.session.commit()
+
+    keys.use(keys.k2, keys.k1)
+    user = db.session.get(User, user.id)
+    assert user.access_token == 'new-access'
+    assert user.refresh_token == 'refresh-alice'
+    assert not user.refresh_token.startswith(FERNET_PREFIX)
+
+
+def test_token_key_id_is_written_with_the_token(db, keys):
+    keys.use(keys.k1)
+    user = add_user(db)
+    keys.use(keys.k2)
+
+    user.access_token = 'new-access'
+    assert user.token_key_id is None  # the refresh token is still under k1, which is gone
+
+    keys.use(keys.k2, keys.k1)
+    user.refresh_token = 'new-refresh'
+    assert user.token_key_id == key_id_for(keys.k2)
+
+
+def test_keys_are_read_from_the_app_config_before_the_environment(db, keys, monkeypatch):
+    monkeypatch.setenv('TOKEN_ENCRYPTION_KEYS', keys.k2)
+    keys.use(keys.k1)
+    assert primary_key_id() == key_id_for(keys.k1)
+
+    keys.use()  # nothing in the config: the environment is the fallback
+    assert primary_key_id() == key_id_for(keys.k2)
+
+
+def test_legacy_plaintext_rows_are_encrypted(db, keys):
+    keys.use()  # no key: stored in plaintext
+    user = add_user(db)
+    assert user._access_token == 'access-alice'
+
+    keys.use(keys.k1)
+    assert reencrypt_users()[0] == 1
+    user = db.session.get(User, user.id)
+    assert user._access_token.startswith(FERNET_PREFIX)
+    assert user.access_token == 'access-alice'
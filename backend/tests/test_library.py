@@ -0,0 +1,161 @@
+from datetime import datetime, timedelta
+
+from types import SimpleNamespace
+
+import pytest
+from spotipy.exceptions import SpotifyException
+
+import app.jobs as jobs
+from app.library import library_sync, load_playlist_tracks, sync_playlists, sync_saved_tracks
+from database.models import PlaylistTrack, SavedTrack, SyncState, User
+
+
+def saved_item(track_id, days_ago):
+    added_at = datetime(2026, 1, 1) - timedelta(days=days_ago)
+    return {'added_at': added_at.isoformat() + 'Z', 'track': {'id': track_id, 'name': track_id}}
+
+
+class FakeSpotify:
+    """Pages from in-memory lists; `on_fetch(offset)` runs before each page is served."""
+
+    def __init__(self, saved=(), playlists=None):
+        self.saved = list(saved)  # newest first, like Spotify
+        self.playlists = playlists or {}  # id -> (snapshot_id, [track ids])
+        self.calls = []
+        self.on_fetch = None
+        self.fail_at = None
+
+    def _page(self, items, limit, offset):
+        return {'items': items[offset:offset + limit], 'total': len(items)}
+
+    def current_user_saved_tracks(self, limit, offset):
+        self.calls.append(('saved', offset))
+        if self.on_fetch:
+            self.on_fetch(offset)
+        return self._page(self.saved, limit, offset)
+
+    def current_user_playlists(self, limit, offset):
+        items = [{'id': playlist_id, 'name': playlist_id, 'snapshot_id': snapshot_id,
+                  'tracks': {'total': len(tracks)}} for playlist_id, (snapshot_id, tracks) in self.playlists.items()]
+        return self._page(items, limit, offset)
+
+    def playlist_items(self, playlist_id, fields, limit, offset, additional_types):
+        if self.fail_at is not None and offset >= self.fail_at:
+            raise RuntimeError('upstream failed')
+        tracks = [{'added_at': '2025-01-01T00:00:00Z', 'track': {'id': track_id, 'type': 'track'}}
+                  for track_id in self.playlists[playlist_id][1]]
+        return self._page(tracks, limit, offset)
+
+
+@pytest.fixture
+def user(db):
+    user = User('alice')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def stored(user):
+    return {row.track_id for row in SavedTrack.query.filter_by(user_id=user.id)}
+
+
+def test_incremental_sync_fetches_only_what_it_reads(user):
+    sp = FakeSpotify([saved_item(f't{i}', i) for i in range(200)])
+    sync_saved_tracks(sp, user.id, concurrency=4)
+    assert len(stored(user)) == 200
+
+    sp.saved[:0] = [saved_item(f'new{i}', -1 - i) for i in range(60)]
+    sp.calls.clear()
+    assert sync_saved_tracks(sp, user.id, concurrency=4) == 60
+    assert sp.calls == [('saved', 0), ('saved', 50)]  # nothing prefetched past the page with old tracks
+
+
+def test_full_sync_prunes_removed_tracks(user):
+    sp = FakeSpotify([saved_item(f't{i}', i) for i in range(120)])
+    sync_saved_tracks(sp, user.id)
+    del sp.saved[5]
+
+    sync_saved_tracks(sp, user.id, full=True)
+
+    assert 't5' not in stored(user) and len(stored(user)) == 119
+
+
+def test_full_sync_does_not_prune_when_the_list_shifts(user):
+    sp = FakeSpotify([saved_item(f't{i}', i) for i in range(120)])
+    sync_saved_tracks(sp, user.id)
+
+    # A track is removed after the first page: everything after it moves up one
+    # place, so the walk skips a track that is still saved
+    def remove_after_first_page(offset):
+        if offset == 50 and sp.saved[0]['track']['id'] == 't0':
+            del sp.saved[0]
+    sp.on_fetch = remove_after_first_page
+
+    sync_saved_tracks(sp, user.id, full=True, concurrency=0)
+
+    assert len(stored(user)) == 120  # t50 was never seen but is kept
+
+
+def test_resumed_full_sync_does_not_prune(user, db):
+    sp = FakeSpotify([saved_item(f't{i}', i) for i in range(120)])
+    sync_saved_tracks(sp, user.id)
+    state = db.session.get(SyncState, (user.id, 'saved_tracks'))
+    state.cursor = 100  # as left by an interrupted full sync
+    state.started_at = datetime.utcnow()
+    db.session.commit()
+
+    sync_saved_tracks(sp, user.id, full=True)
+
+    assert len(stored(user)) == 120
+
+
+def test_playlist_resync_swaps_in_one_step(user):
+    sp = FakeSpotify(playlists={'p1': ('s1', [f'a{i}' for i in range(250)])})
+    assert sync_playlists(sp, user.id) == 1
+    assert len(load_playlist_tracks(user.id, 'p1', 500)['items']) == 250
+
+    # A failed re-fetch leaves the stored tracks untouched
+    sp.playlists['p1'] = ('s2', [f'b{i}' for i in range(250)])
+    sp.fail_at = 100
+    with pytest.raises(RuntimeError):
+        sync_playlists(sp, user.id)
+    items = load_playlist_tracks(user.id, 'p1', 500)['items']
+    assert [item['track']['id'] for item in items] == [f'a{i}' for i in range(250)]
+    assert PlaylistTrack.query.count() == 250  # the unfinished version was removed
+
+    sp.fail_at = None
+    assert sync_playlists(sp, user.id) == 1
+    items = load_playlist_tracks(user.id, 'p1', 500)['items']
+    assert [item['track']['id'] for item in items] == [f'b{i}' for i in range(250)]
+    assert PlaylistTrack.query.count() == 250
+
+
+def statuses(user):
+    return {state.kind: state.status for state in SyncState.query.filter_by(user_id=user.id)}
+
+
+def test_sync_is_skipped_when_the_stored_scope_lacks_the_library_scopes(db, user):
+    user.token_scope = 'user-read-email user-top-read user-read-recently-played'
+    db.session.commit()
+    clients = []
+
+    library_sync.run(user.id, lambda: clients.append(1))
+
+    assert clients == []
+    assert statuses(user) == {'saved_tracks': 'needs_consent', 'playlists': 'needs_consent'}
+
+
+def test_forbidden_sync_needs_consent_and_is_not_retried(db, user, monkeypatch):
+    class Forbidden(FakeSpotify):
+        def current_user_saved_tracks(self, limit, offset):
+            raise SpotifyException(403, -1, 'Insufficient client scope')
+
+        def current_user_playlists(self, limit, offset):
+            raise SpotifyException(403, -1, 'Insufficient client scope')
+
+    monkeypatch.setattr(jobs, '_client_for', lambda job: Forbidden())
+
+    result = jobs.sync_library(SimpleNamespace(user_id=user.id, payload={}))  # returns instead of raising for a retry
+
+    assert {state['kind']: state['status'] for state in result['states']} == {
+        'saved_tracks': 'needs_consent', 'playlists': 'needs_consent'}
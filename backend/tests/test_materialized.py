@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+import app.materialized as materialized
+from app.materialized import PLAYS_RANGE, apply_plays
+from database.models import Play, User, UserInsights
+
+
+def play_albums(db, user, counts, start=datetime(2026, 1, 1)):
+    """Store and apply one batch with `counts[album]` plays of a track on each album."""
+    plays, tracks = [], {}
+    for album, count in counts.items():
+        tracks[f't-{album}'] = {'id': f't-{album}', 'name': album,
+                                'album': {'id': album, 'name': album, 'release_date': '2000'}}
+        for i in range(count):
+            plays.append(Play(user.id, f't-{album}', start + timedelta(minutes=len(plays))))
+    db.session.add_all(plays)
+    apply_plays(user.id, plays, tracks=tracks)
+    db.session.commit()
+    return db.session.get(UserInsights, (user.id, PLAYS_RANGE))
+
+
+def test_album_tally_is_capped_with_a_tail(db, monkeypatch):
+    monkeypatch.setattr(materialized, 'ALBUM_TALLY_SIZE', 2)
+    monkeypatch.setattr(materialized, 'MAX_ALBUMS', 2)
+    user = User('alice')
+    db.session.add(user)
+    db.session.commit()
+
+    row = play_albums(db, user, {'a': 5, 'b': 4, 'c': 3, 'd': 2})
+    assert row.album_plays == {'a': 5, 'b': 4, 'c': 3, 'd': 2}  # within twice the cap
+
+    row = play_albums(db, user, {'e': 1}, start=datetime(2026, 2, 1))
+    assert row.album_plays == {'a': 5, 'b': 4}
+    assert row.album_tail == 3
+    assert [(album['id'], album['count']) for album in row.top_albums] == [('a', 5), ('b', 4)]
+
+    row = play_albums(db, user, {'b': 2}, start=datetime(2026, 3, 1))
+    assert [(album['id'], album['count']) for album in row.top_albums] == [('b', 6), ('a', 5)]
+    assert row.play_count == 17
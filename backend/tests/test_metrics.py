@@ -0,0 +1,30 @@
+import sys
+import types
+
+from flask import Flask
+
+from app.metrics import Metrics
+
+
+def test_profiling_is_skipped_under_gevent(monkeypatch):
+    monkey = types.ModuleType('gevent.monkey')
+    monkey.is_module_patched = lambda name: name == 'threading'
+    monkeypatch.setitem(sys.modules, 'gevent.monkey', monkey)
+    app = Flask(__name__)
+    app.config['PROFILE_SAMPLE_RATE'] = 1.0
+    metrics = Metrics()
+
+    metrics.init_app(app)
+
+    assert metrics.profile_sample_rate == 0.0
+
+
+def test_profiling_is_sampled_with_threads(monkeypatch):
+    monkeypatch.delitem(sys.modules, 'gevent.monkey', raising=False)
+    app = Flask(__name__)
+    app.config['PROFILE_SAMPLE_RATE'] = 0.5
+    metrics = Metrics()
+
+    metrics.init_app(app)
+
+    assert metrics.profile_sample_rate == 0.5
@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+
+from database.models import User, UserStats, UserStatsRollup
+from database.retention import prune, prune_raw, roll_up_days
+
+NOW = datetime(2026, 6, 15, 12)
+
+
+def add_user(db, spotify_id='alice'):
+    user = User(spotify_id)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def add_snapshot(db, user, days_ago, item_ids, data_type='artists', time_range='medium_term'):
+    snapshot = UserStats(user.id, time_range, data_type, item_ids=item_ids)
+    snapshot.created_at = NOW - timedelta(days=days_ago)
+    db.session.add(snapshot)
+    db.session.commit()
+    return snapshot
+
+
+def remaining(db, user):
+    return sorted(snapshot.id for snapshot in UserStats.query.filter_by(user_id=user.id))
+
+
+def test_prune_rolls_up_old_snapshots_and_keeps_the_newest(db):
+    user = add_user(db)
+    old = [add_snapshot(db, user, days, ['a', 'b']) for days in (120, 120, 100)]
+    recent = add_snapshot(db, user, 1, ['b', 'a'])
+
+    deleted = prune_raw(NOW - timedelta(days=90))
+
+    # The newest two of the key survive even though one of them is past retention
+    assert deleted == 2
+    assert remaining(db, user) == [old[2].id, recent.id]
+    rollup = UserStatsRollup.query.filter_by(user_id=user.id, period='day').one()
+    assert rollup.period_start == (NOW - timedelta(days=120)).date()
+    assert rollup.snapshot_count == 2
+    assert rollup.items == [['a', 4], ['b', 2]]  # 2 points for first place, 1 for second, per snapshot
+
+
+def test_prune_keeps_inactive_users_latest_snapshots(db):
+    user = add_user(db)
+    snapshots = [add_snapshot(db, user, days, ['a']) for days in (300, 200, 150)]
+    genres = add_snapshot(db, user, 400, None, data_type='genres')
+
+    prune_raw(NOW - timedelta(days=90))
+
+    assert remaining(db, user) == sorted([snapshots[1].id, snapshots[2].id, genres.id])
+    assert prune_raw(NOW - timedelta(days=90), keep_latest=1) == 1
+    assert remaining(db, user) == sorted([snapshots[2].id, genres.id])
+
+
+def test_prune_batches_and_is_idempotent(db):
+    users = [add_user(db, f'user{i}') for i in range(3)]
+    for user in users:
+        for days in range(91, 101):
+            add_snapshot(db, user, days, ['a'])
+
+    assert prune_raw(NOW - timedelta(days=90), batch_size=4) == 3 * 8
+    assert prune_raw(NOW - timedelta(days=90), batch_size=4) == 0
+    counted = sum(rollup.snapshot_count for rollup in UserStatsRollup.query)
+    assert counted == 3 * 8
+    assert UserStats.query.count() == 3 * 2
+
+
+def test_day_rollups_merge_into_weeks(db):
+    user = add_user(db)
+    # Monday 2026-01-05 .. Sunday 2026-01-11, and the next Monday
+    for day in range(5, 13):
+        snapshot = UserStats(user.id, 'medium_term', 'artists', item_ids=['a'] if day % 2 else ['b'])
+        snapshot.created_at = datetime(2026, 1, day, 9)
+        db.session.add(snapshot)
+    for _ in range(2):  # kept as the newest
+        add_snapshot(db, user, 0, ['c'])
+    db.session.commit()
+
+    summary = prune(90, 30, now=NOW)
+
+    assert summary['deleted'] == 8
+    assert summary['days_rolled_up'] == 8
+    weeks = UserStatsRollup.query.filter_by(user_id=user.id, period='week').order_by(UserStatsRollup.period_start).all()
+    assert [week.period_start.isoformat() for week in weeks] == ['2026-01-05', '2026-01-12']
+    assert [week.snapshot_count for week in weeks] == [7, 1]
+    assert dict(map(tuple, weeks[0].items)) == {'a': 4, 'b': 3}
+    assert UserStatsRollup.query.filter_by(period='day').count() == 0
+    assert prune(90, 30, now=NOW) == {'deleted': 0, 'partitions_dropped': [], 'days_rolled_up': 0}
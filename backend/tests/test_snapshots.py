@@ -0,0 +1,57 @@
+import pytest
+
+import app.snapshots as snapshots
+from app.snapshots import SnapshotWriter
+from database.models import UserStats
+
+
+def test_dedupe_keys_are_bounded_lru(app, db):
+    writer = SnapshotWriter()
+    writer.init_app(app)
+    writer.max_keys = 2
+    payload = {'genres': ['rock']}
+
+    assert writer.record(1, 'genres', 'short_term', payload)
+    assert writer.record(2, 'genres', 'short_term', payload)
+    assert not writer.record(1, 'genres', 'short_term', payload)  # 1 is now the most recent
+    assert writer.record(3, 'genres', 'short_term', payload)  # evicts 2
+
+    assert list(writer._last) == [(1, 'genres', 'short_term'), (3, 'genres', 'short_term')]
+
+
+def test_flush_is_registered_at_exit_once(app, monkeypatch):
+    registered = []
+    monkeypatch.setattr(snapshots.atexit, 'register', registered.append)
+    writer = SnapshotWriter()
+
+    writer.init_app(app)
+    writer.init_app(app)
+
+    assert registered == [writer.flush]
+
+
+def test_min_interval_holds_across_workers(app, db):
+    first, second = SnapshotWriter(), SnapshotWriter()  # one per gunicorn worker
+    first.init_app(app)
+    second.init_app(app)
+
+    assert first.record(1, 'genres', 'short_term', {'genres': ['rock']})
+    second.record(1, 'genres', 'short_term', {'genres': ['jazz']})
+
+    assert UserStats.query.count() == 1
+    assert not second.record(1, 'genres', 'short_term', {'genres': ['jazz']})  # remembered from the stored row
+
+
+def test_failed_write_does_not_suppress_the_key(app, db, monkeypatch):
+    writer = SnapshotWriter()
+    writer.init_app(app)
+    payload = {'genres': ['rock']}
+    monkeypatch.setattr(snapshots, 'compact_snapshot', lambda snapshot: 1 / 0)
+    monkeypatch.setattr(snapshots, 'COMPACT_TYPES', ('genres',))
+
+    with pytest.raises(ZeroDivisionError):
+        writer.record(1, 'genres', 'short_term', payload)
+    monkeypatch.undo()
+
+    assert writer.record(1, 'genres', 'short_term', payload)
+    assert UserStats.query.count() == 1
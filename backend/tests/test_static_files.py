@@ -0,0 +1,16 @@
+from app.static_files import StaticFiles
+
+
+def test_only_vite_assets_are_immutable(tmp_path):
+    (tmp_path / 'assets' / 'fonts').mkdir(parents=True)
+    for name in ('index.html', 'logo-white12.png', 'assets/index-B6dLNWjt.js',
+                 'assets/fonts/inter-Ab12Cd34.woff2', 'assets/readme.txt'):
+        (tmp_path / name).write_text(name)
+    static = StaticFiles()
+    static.root = str(tmp_path)
+
+    static.index()
+
+    assert {path for path, entry in static.files.items() if entry.hashed} == {
+        'assets/index-B6dLNWjt.js', 'assets/fonts/inter-Ab12Cd34.woff2',
+    }
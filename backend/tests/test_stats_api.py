@@ -0,0 +1,72 @@
+import json
+from datetime import datetime, timedelta
+
+import app.api as api
+from database.models import User, UserStats
+
+
+def add_history(db, count):
+    user = User('alice')
+    db.session.add(user)
+    db.session.flush()
+    start = datetime(2026, 1, 1)
+    for i in range(count):
+        stat = UserStats(user.id, 'short_term', 'genres', data={'genres': [f'g{i}']})
+        stat.created_at = start + timedelta(days=i)
+        db.session.add(stat)
+    db.session.commit()
+    return user
+
+
+def test_stats_without_paging_params_keeps_the_bare_list(client, db, monkeypatch):
+    monkeypatch.setattr(api, 'STATS_EXPORT_BATCH', 3)  # the list spans several batches
+    user = add_history(db, 7)
+    client.login(user.id)
+
+    response = client.get('/api/stats')
+
+    rows = json.loads(response.get_data(as_text=True))
+    assert isinstance(rows, list)
+    assert [row['data'] for row in rows] == [{'genres': [f'g{i}']} for i in reversed(range(7))]
+
+
+def test_stats_pages_with_limit_and_cursor(client, db):
+    user = add_history(db, 5)
+    client.login(user.id)
+
+    seen = []
+    page = client.get('/api/stats?limit=2&fields=id,created_at').get_json()
+    while True:
+        assert len(page['items']) <= 2
+        seen += [row['created_at'] for row in page['items']]
+        if page['next_cursor'] is None:
+            break
+        page = client.get(f"/api/stats?fields=id,created_at&limit=2&cursor={page['next_cursor']}").get_json()
+
+    assert seen == sorted(seen, reverse=True)
+    assert len(seen) == 5
+
+
+def test_dashboard_reports_a_failing_local_history_read_as_a_section_error(client, db, monkeypatch):
+    user = User('alice')
+    db.session.add(user)
+    db.session.commit()
+    client.login(user.id)
+
+    def broken_history(*args, **kwargs):
+        raise ValueError('undecodable play row')
+
+    monkeypatch.setattr(api, 'ingest_due', lambda user_id: False)
+    monkeypatch.setattr(api, 'load_recent_plays', broken_history)
+    monkeypatch.setattr(api, 'get_spotify_client', lambda user_id: object())
+    monkeypatch.setattr(api, 'fetch_profile', lambda sp, user_id: {'id': 'alice'})
+    monkeypatch.setattr(api, 'fetch_top_items', lambda sp, user_id, kind, time_range, limit: {'items': []})
+    monkeypatch.setattr(api, 'fetch_top_genres', lambda sp, user_id, time_range, limit: {'genres': []})
+
+    response = client.get('/api/dashboard')
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['profile'] == {'id': 'alice'}
+    assert body['recently_played'] is None
+    assert body['errors'] == {'recently_played': 'An internal error occurred'}
@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import app.tokens as tokens
+from app.tokens import LOCK_STRIPES, _lock_for, refresh_user_token
+from database.models import User
+
+
+class FakeOAuth:
+    def __init__(self):
+        self.calls = 0
+
+    def refresh_access_token(self, refresh_token):
+        self.calls += 1
+        return {'access_token': f'access-{self.calls}', 'refresh_token': refresh_token, 'expires_in': 3600}
+
+
+def add_user(db, expires_in):
+    user = User('alice', access_token='access-0', refresh_token='refresh',
+                token_expiration=datetime.now() + timedelta(seconds=expires_in))
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def test_fresh_token_is_not_refreshed_unless_forced(db, monkeypatch):
+    oauth = FakeOAuth()
+    monkeypatch.setattr(tokens, 'get_spotify_oauth', lambda: oauth)
+    user = add_user(db, expires_in=3600)
+
+    refresh_user_token(user.id)
+    assert oauth.calls == 0
+
+    refresh_user_token(user.id, force=True)
+    assert oauth.calls == 1
+    assert db.session.get(User, user.id).access_token == 'access-1'
+
+
+def test_refresh_waits_for_another_workers_claim(db, monkeypatch):
+    oauth = FakeOAuth()
+    monkeypatch.setattr(tokens, 'get_spotify_oauth', lambda: oauth)
+    user = add_user(db, expires_in=0)
+    user.token_refreshing_until = datetime.now() + timedelta(seconds=30)
+    db.session.commit()
+
+    def other_worker_finishes(seconds):
+        db.session.query(User).filter_by(id=user.id).update({
+            User.token_expiration: datetime.now() + timedelta(hours=1),
+            User.token_refreshing_until: None,
+        })
+        db.session.commit()
+
+    monkeypatch.setattr(tokens.time, 'sleep', other_worker_finishes)
+
+    assert refresh_user_token(user.id, force=True).token_expiration > datetime.now()
+    assert oauth.calls == 0
+
+
+def test_lapsed_claim_is_taken_over_and_cleared(db, monkeypatch):
+    oauth = FakeOAuth()
+    monkeypatch.setattr(tokens, 'get_spotify_oauth', lambda: oauth)
+    user = add_user(db, expires_in=0)
+    user.token_refreshing_until = datetime.now() - timedelta(seconds=1)  # its worker died
+    db.session.commit()
+
+    refreshed = refresh_user_token(user.id)
+
+    assert oauth.calls == 1
+    assert refreshed.access_token == 'access-1'
+    assert refreshed.token_refreshing_until is None
+
+
+def test_failed_refresh_releases_the_claim(db, monkeypatch):
+    class FailingOAuth:
+        def refresh_access_token(self, refresh_token):
+            claimed = db.session.get(User, user.id, populate_existing=True)
+            assert claimed.token_refreshing_until is not None  # claimed and committed before the call
+            db.session.commit()
+            raise RuntimeError('accounts.spotify.com unavailable')
+
+    monkeypatch.setattr(tokens, 'get_spotify_oauth', FailingOAuth)
+    user = add_user(db, expires_in=0)
+
+    with pytest.raises(RuntimeError):
+        refresh_user_token(user.id)
+
+    assert db.session.get(User, user.id, populate_existing=True).token_refreshing_until is None
+
+
+def test_refresh_token_endpoint_always_refreshes(client, db, monkeypatch):
+    oauth = FakeOAuth()
+    monkeypatch.setattr(tokens, 'get_spotify_oauth', lambda: oauth)
+    user = add_user(db, expires_in=3600)
+    client.login(user.id)
+
+    assert client.get('/auth/refresh-token').status_code == 200
+    assert oauth.calls == 1
+
+
+def test_user_locks_are_bounded():
+    locks = {id(_lock_for(user_id)) for user_id in range(10 * LOCK_STRIPES)}
+    assert len(locks) == LOCK_STRIPES
+    assert _lock_for(12345) is _lock_for(12345)
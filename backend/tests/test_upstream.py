@@ -0,0 +1,24 @@
+import time
+
+from limits.storage import storage_from_string
+
+from app.upstream import SharedTokenBucket
+
+
+def test_shared_bucket_budget_is_shared_between_processes(tmp_path):
+    uri = f"sqlite:///{tmp_path / 'rate.db'}"
+    # Two workers, each with its own storage connection to the same file
+    workers = [SharedTokenBucket(storage_from_string(uri), rate=10, capacity=3) for _ in range(2)]
+
+    taken = [workers[i % 2].acquire(timeout=0) for i in range(5)]
+
+    assert taken == [True, True, True, False, False]
+
+
+def test_shared_bucket_waits_for_the_next_window(tmp_path):
+    bucket = SharedTokenBucket(storage_from_string(f"sqlite:///{tmp_path / 'rate.db'}"), rate=20, capacity=2)
+    assert bucket.acquire(timeout=0) and bucket.acquire(timeout=0)
+
+    started = time.monotonic()
+    assert bucket.acquire(timeout=1)
+    assert time.monotonic() - started > 0.05
@@ -0,0 +1,23 @@
+import logging
+import os
+import signal
+import sys
+import threading
+
+# Add the parent directory to sys.path to make imports work
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app import create_app
+from app.jobs import job_queue
+
+# Same environment selection as run.py
+env = os.environ.get('FLASK_ENV', 'development')
+app = create_app(env)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    stop = threading.Event()
+    # Finish the current job before exiting on a deploy/restart
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+    app.logger.info("Job worker %s started", job_queue.worker_id)
+    job_queue.work(stop_event=stop, burst='--burst' in sys.argv[1:])
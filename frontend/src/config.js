@@ -17,4 +17,7 @@ export const SPOTIFY_SCOPES = [
   "user-read-private",
   "user-top-read",
   "user-read-recently-played",
+  "user-library-read",
+  "playlist-read-private",
+  "playlist-read-collaborative",
 ];